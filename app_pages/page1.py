@@ -2,7 +2,28 @@ import streamlit as st
 import pandas as pd
 import altair as alt
 
-def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df, issues_df):
+# Prüfungen für die Heatmap: Detailtabelle mit den betroffenen Aufträgen (KvaRechnung_ID), None = Null-Werte (vorberechnet)
+HEATMAP_ISSUES = {
+    "Null-Werte": None,
+    "Testdaten": "metric_test_data_entries",
+    "Plausibilität Forderung/Einigung": "metric_plausibility_diffs_auftragsdaten",
+    "Proforma-Belege": "metric_proforma",
+    "Aufträge über 50.000 €": "metric_above_50k",
+    "Zeitwert-Fehler": "metric_zeitwert_errors",
+    "Leere Aufträge": "metric_empty_orders_dataframe",
+    "Semantische Auffälligkeiten": "metric_semantic_mismatches",
+    "False Negatives": "metric_fn_details_df1",
+}
+
+# Spalten der Auftragsdaten, nach denen die Nullquoten gruppiert werden können
+CLEANLINESS_GROUPS = {
+    "Kundengruppe": "Kundengruppe",
+    "Land": "Land",
+    "Schadenart": "Schadenart_Name",
+    "Gewerk": "Gewerk_Name",
+}
+
+def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df, issues_df, issue_heatmap=None, grouped_cleanliness=None):
     """This function renders page 1 of 5 of the dashboard. 
     
     Page 1 is the dashboard landing page.
@@ -20,6 +41,10 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df,
         DataFrame with metric value changes over time
     issues_df : bool
         DataFrame containing values for all metrics concerning potentially invalid data points
+    issue_heatmap : callable, optional
+        returns the weekday/hour heatmap for the detail table of a check (see HEATMAP_ISSUES); if None, only the null values are shown
+    grouped_cleanliness : callable, optional
+        returns the row and column null ratios per group of a column (see CLEANLINESS_GROUPS); if None, only 'Kundengruppe' is shown
     Returns
     -------
     void        
@@ -37,6 +62,7 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df,
     - Tables:
         - null values per column (top *n* columns) 
         - error frequencies aggregated over time of day & weekdays
+        - null value ratios per group of a selectable column
         - trend of position count per order over time (monthly avg.)
     """
    
@@ -172,9 +198,15 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df,
 
     # Chart 2: Fehlerhäufigkeit nach Wochentag und Stunde (Heatmap)
     with chart_col2:
-        st.subheader("Null-Ratios nach Wochentag und Stunde")
-        st.caption("Diese Heatmap visualisiert Konzentrationen der Null-Ratios im Zeitverlauf. Je intensiver der Rotton, desto höher war die prozentuale Fehlerquote am jeweiligen Wochentag zu der entsprechenden Uhrzeit.")
-        err_df = metrics_df1.get("error_frequency_weekday_hour", None)
+        st.subheader("Fehlerquote nach Wochentag und Stunde")
+        st.caption("Diese Heatmap visualisiert Konzentrationen der Null-Ratios (oder der gewählten Prüfung) im Zeitverlauf. Je intensiver der Rotton, desto höher war die prozentuale Fehlerquote am jeweiligen Wochentag zu der entsprechenden Uhrzeit.")
+        issue_label = "Null-Werte"
+        if issue_heatmap is not None:
+            issue_label = st.selectbox("Prüfung:", list(HEATMAP_ISSUES), key="p1_heatmap_issue")
+        if HEATMAP_ISSUES[issue_label] is None:
+            err_df = metrics_df1.get("error_frequency_weekday_hour", None)
+        else:
+            err_df = issue_heatmap(HEATMAP_ISSUES[issue_label])
         if isinstance(err_df, pd.DataFrame) and not err_df.empty:
             weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
             if "weekday" in err_df.columns:
@@ -198,7 +230,8 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df,
                 .properties(height=240, width="container")
             )
             st.altair_chart(heat, width="stretch")
-            st.caption("Hinweis: PLZ VN wird von OCR nicht gesetzt, daher extrem hohe Quoten an Wochenenden und nachts.")
+            if HEATMAP_ISSUES[issue_label] is None:
+                st.caption("Hinweis: PLZ VN wird von OCR nicht gesetzt, daher extrem hohe Quoten an Wochenenden und nachts.")
 
         else:
             st.info("Keine Fehlerfrequenz-Daten verfügbar.")
@@ -206,6 +239,39 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, pot_df, comparison_df,
 
     st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
 
+    # Chart: Nullquoten nach Gruppe (Gruppierung wählbar, ohne neuen Build)
+    st.subheader("Nullquoten nach Gruppe")
+    st.caption("Anteil der Aufträge mit mindestens einem Nullwert je Gruppe. In der Tabelle darunter die Nullquote jeder Spalte je Gruppe.")
+    group_label = "Kundengruppe"
+    if grouped_cleanliness is not None:
+        group_label = st.selectbox("Gruppieren nach:", list(CLEANLINESS_GROUPS), key="p1_cleanliness_group")
+        grouped_row_ratios, grouped_col_ratios = grouped_cleanliness(CLEANLINESS_GROUPS[group_label])
+    else:
+        grouped_row_ratios, grouped_col_ratios = metrics_df1.get("grouped_row_ratios"), metrics_df1.get("grouped_col_ratios")
+
+    if isinstance(grouped_row_ratios, pd.Series) and not grouped_row_ratios.empty:
+        group_df = pd.DataFrame({
+            "Gruppe": grouped_row_ratios.index.astype(str),
+            "Nullquote_%": grouped_row_ratios.to_numpy() * 100
+        }).sort_values("Nullquote_%", ascending=False).head(15)
+        bar_groups = (
+            alt.Chart(group_df)
+            .mark_bar()
+            .encode(
+                x=alt.X("Nullquote_%:Q", title="Aufträge mit Nullwerten [%]"),
+                y=alt.Y("Gruppe:N", sort='-x', title=group_label),
+                tooltip=["Gruppe", alt.Tooltip("Nullquote_%:Q", format=".2f")]
+            )
+            .properties(height=28 * len(group_df), width="container")
+        )
+        st.altair_chart(bar_groups, width="stretch")
+        with st.expander("Nullquote je Spalte und Gruppe"):
+            st.dataframe((grouped_col_ratios * 100).round(2), width="stretch")
+    else:
+        st.info("Keine gruppierten Nullwert-Informationen verfügbar.")
+
+    st.markdown("<div style='margin-top: 1rem;'></div>", unsafe_allow_html=True)
+
 
 
 # Chart 3: Avg. Positionen pro Auftrag über Monat (Trend)
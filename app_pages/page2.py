@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+from app_pages.table_view import paged_table, month_period
 
 def show_page(metrics_df1, metrics_df2, metrics_combined, comparison_df, issues_df):
     """This function renders page 2 of 5 of the dashboard. 
@@ -53,18 +54,19 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, comparison_df, issues_
             return f"{val:+.2f}%"
         return None
 
-    zeitwert_error_df = metrics_df1.get("zeitwert_error_df", pd.NA)
+    zeitwert_error_df = metrics_df1.get("zeitwert_error_df")
     zeitwert_error_count = metrics_df1.get("zeitwert_errors_count", pd.NA)
-    above_50k_df = metrics_df1.get("above_50k_df", pd.NA)
-    above_50k_count = len(above_50k_df)
+    above_50k_df = metrics_df1.get("above_50k_df")
+    above_50k_count = above_50k_df.count()
     row_count = metrics_df1.get("row_count")
     row_count_df2 = metrics_df2.get("row_count")
     auftraege_abgleich = metrics_combined.get("auftraege_abgleich")
+    auftraege_abgleich_count = auftraege_abgleich.count()
     numeric_issues = issues_df["numeric_issues"]
 
     anteil_zeitwert = (zeitwert_error_count / row_count) * 100 
     anteil_above_50k = (above_50k_count / row_count) * 100 
-    anteil_summe = (auftraege_abgleich.shape[0] / row_count) * 100 
+    anteil_summe = (auftraege_abgleich_count / row_count) * 100 
     anteil_numeric_issues = (numeric_issues / (row_count + row_count_df2)) * 100
 
     # --- KPIs ---
@@ -79,49 +81,34 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, comparison_df, issues_
         st.metric(label="Anzahl Aufträge über 50.000€", value=f"{above_50k_count:,}".replace(",", "."), delta=get_delta("count_above_50k"), delta_color="inverse", help="Anzahl der Aufträge mit einem Wert über 50.000€")
         st.caption(f"Anteil: {anteil_above_50k:.2f}% der Auftragsdaten")
     with kpi_cols[3]: 
-        st.metric(label="Abweichung Summen", value=f"{auftraege_abgleich.shape[0] if auftraege_abgleich is not None else 0:,}".replace(",", "."), delta=get_delta("count_abweichung_summen"), delta_color="inverse", help="Anzahl der Aufträge mit Abweichungen in den Summen (Auftragssumme = Summe der Positionen)")
+        st.metric(label="Abweichung Summen", value=f"{auftraege_abgleich_count:,}".replace(",", "."), delta=get_delta("count_abweichung_summen"), delta_color="inverse", help="Anzahl der Aufträge mit Abweichungen in den Summen (Auftragssumme = Summe der Positionen)")
         st.caption(f"Anteil: {anteil_summe:.2f}% der Auftragsdaten")
     st.markdown("---")
 
     st.subheader("Fehlerverlauf im Vergleich")
     
     # --- Trends for KPIs ---
-    def prepare_trend_data(df, label, time_col="CRMEingangszeit"):
-        """Helper function grouping values of passed df into monthly intervalls.
+    trend_tables = {"Zeitwert Fehler": zeitwert_error_df, "Aufträge > 50k": above_50k_df, "Abweichung Summen": auftraege_abgleich}
+
+    def prepare_trend_data(labels, period=None):
+        """Helper function returning the number of entries per month of the given categories (aggregated in DuckDB).
 
         Parameters
         ----------
-        df : pandas.DataFrame
-            DataFrame containing computed metric values over time.
-        label : string
-            label for aggregated data, written to column 'Kategorie' of the returned df
-        time_col : str, optional
-            label of the timestamp column in df, by default "CRMEingangszeit"
+        labels : list of str
+            categories (keys of trend_tables), written to column 'Kategorie' of the returned df
+        period : tuple, optional
+            (column, start, end), only counts the entries with start <= CRMEingangszeit < end, by default None
 
         Returns
         -------
         pandas.DataFrame
-            df with metric values aggregated by month. Has a column 'Kategorie' for labels. This returns an empty df if no timestamp was passed.
-            
+            columns 'Monat', 'Anzahl' and 'Kategorie'. This returns an empty df if no category has entries with timestamp.
         """
-        if df is None or df.empty or time_col not in df.columns:
-            return pd.DataFrame()
-        
-        temp = df.copy()
-        temp[time_col] = pd.to_datetime(temp[time_col], errors="coerce")
-        temp = temp.dropna(subset=[time_col])
-        
-        temp["Monat"] = temp[time_col].dt.to_period("M").dt.to_timestamp()
-        
-        aggregated = temp.groupby("Monat").size().reset_index(name="Anzahl")
-        aggregated["Kategorie"] = label
-        return aggregated
-
-    df_trend_1 = prepare_trend_data(zeitwert_error_df, "Zeitwert Fehler")
-    df_trend_2 = prepare_trend_data(above_50k_df, "Aufträge > 50k")
-    df_trend_3 = prepare_trend_data(auftraege_abgleich, "Abweichung Summen")
+        frames = [trend_tables[label].monthly_counts(period=period).assign(Kategorie=label) for label in labels]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
-    combined_trend = pd.concat([df_trend_1, df_trend_2, df_trend_3], ignore_index=True)
+    combined_trend = prepare_trend_data(trend_tables)
 
     if not combined_trend.empty:
         min_date = combined_trend["Monat"].min().date()
@@ -152,10 +139,8 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, comparison_df, issues_
                 key="p2_trend_multiselect"
             )
             
-        mask_date = (combined_trend["Monat"].dt.date >= selected_range[0]) & (combined_trend["Monat"].dt.date <= selected_range[1])
-        mask_cat = combined_trend["Kategorie"].isin(selected_metrics)
-        
-        chart_data = combined_trend.loc[mask_date & mask_cat]
+        # only the selected categories and months are counted (the tables are sorted by CRMEingangszeit)
+        chart_data = prepare_trend_data(selected_metrics, month_period("CRMEingangszeit", *selected_range))
 
         if not chart_data.empty:
             line_chart = alt.Chart(chart_data).mark_line(point=True).encode(
@@ -187,40 +172,14 @@ def show_page(metrics_df1, metrics_df2, metrics_combined, comparison_df, issues_
     with chart_col1:
         st.subheader("Inkorrekte Zeitwerte:")
         st.caption("Auflistung aller Aufträge mit inkorrekten Zeitwerten in der Zeitwert-Spalte.")
-        st.markdown(f"**Gefundene Einträge: {len(zeitwert_error_df)}**")
-        st.dataframe(zeitwert_error_df)
-        csv_zeitwert = zeitwert_error_df.to_csv(index=False).encode('utf-8')
-
-        st.download_button(
-            label="Details als CSV herunterladen",
-            data=csv_zeitwert,
-            file_name="zeitwert_fehler_details.csv",
-            mime="text/csv",
-        )
+        paged_table(zeitwert_error_df, key="p2_zeitwert_errors", file_name="zeitwert_fehler_details.csv")
 
 
     with chart_col2:
         st.subheader("Abweichungen Auftragssumme vs. Positionssummen:")
         st.caption("Auflistung aller Aufträge, bei denen die Auftragssumme nicht mit der Summe der Positionen übereinstimmt.")
-        st.markdown(f"**Gefundene Einträge: {len(auftraege_abgleich)}**")
-        st.dataframe(auftraege_abgleich)
-        csv_abweichungen = auftraege_abgleich.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="Details als CSV herunterladen",
-            data=csv_abweichungen,
-            file_name="auftragssumme_abweichungen_details.csv",
-            mime="text/csv",
-        )
+        paged_table(auftraege_abgleich, key="p2_auftraege_abgleich", file_name="auftragssumme_abweichungen_details.csv")
 
     st.subheader("Aufträge über 50.000€:")
     st.caption("Auflistung aller Aufträge mit einem Wert über 50.000€.")
-    st.markdown(f"**Gefundene Einträge: {len(above_50k_df)}**")
-    st.dataframe(above_50k_df)
-    csv_above_50k = above_50k_df.to_csv(index=False).encode('utf-8')
-
-    st.download_button(
-        label="Details als CSV herunterladen",
-        data=csv_above_50k,
-        file_name="auftraege_ueber_50k_details.csv",
-        mime="text/csv",
-    )
\ No newline at end of file
+    paged_table(above_50k_df, key="p2_above_50k", filter_columns={"Kundengruppe": "Nach Kundengruppe filtern:"}, file_name="auftraege_ueber_50k_details.csv")
\ No newline at end of file
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+from app_pages.table_view import paged_table, month_period
 
 def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
     """This function renders page 3 of 5 of the dashboard. 
@@ -57,7 +58,7 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
     # DATEN LADEN
     df_outlier = metrics_df1.get("handwerker_gewerke_outlier")
     df_semantic = metrics_df1.get("mismatched_entries")
-    test_data_df = metrics_df1.get("test_data_df", pd.DataFrame()) 
+    test_data_df = metrics_df1.get("test_data_df")
     
     kundengruppe_containing_test = metrics_df1.get("test_kundengruppen_anzahl")
     row_count = metrics_df1.get("row_count") 
@@ -119,25 +120,15 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
     st.subheader("Fehlerverlauf im Vergleich")
     st.caption("Dieses Diagramm zeigt den Verlauf der ausgewählten Fehlerkategorien über den gewählten Zeitraum. Aktuell können nur Testdatensätze visualisiert werden.")
 
-    def prepare_trend_data(df, label, time_col="CRMEingangszeit"):
-        """Bereitet DataFrame für das Zeitreihendiagramm (Aggregation) vor."""
-        if df is None or df.empty or time_col not in df.columns:
-            return pd.DataFrame()
-        
-        temp = df.copy()
-        temp[time_col] = pd.to_datetime(temp[time_col], errors="coerce")
-        temp = temp.dropna(subset=[time_col])
-        
-        temp["Monat"] = temp[time_col].dt.to_period("M").dt.to_timestamp()
-        
-        aggregated = temp.groupby("Monat").size().reset_index(name="Anzahl")
-        aggregated["Kategorie"] = label
-        return aggregated
+    trend_tables = {"Testdatensätze": test_data_df}
+
+    def prepare_trend_data(labels, period=None):
+        """Bereitet die Daten für das Zeitreihendiagramm vor (Anzahl je Monat, aggregiert in DuckDB)."""
+        frames = [trend_tables[label].monthly_counts(period=period).assign(Kategorie=label) for label in labels]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
     # Daten für Chart vorbereiten (Aggregiert)
-    df_trend_test = prepare_trend_data(test_data_df, "Testdatensätze")
-    
-    combined_trend = pd.concat([df_trend_test], ignore_index=True)
+    combined_trend = prepare_trend_data(trend_tables)
 
     if not combined_trend.empty:
         min_date = combined_trend["Monat"].min().date()
@@ -177,10 +168,8 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
         )
         
         if view_mode_trend == "Grafische Auswertung":
-            mask_date = (combined_trend["Monat"].dt.date >= selected_range[0]) & (combined_trend["Monat"].dt.date <= selected_range[1])
-            mask_cat = combined_trend["Kategorie"].isin(selected_metrics)
-            
-            chart_data = combined_trend.loc[mask_date & mask_cat]
+            # nur die gewählten Metriken und Monate werden gezählt (die Tabellen sind nach CRMEingangszeit sortiert)
+            chart_data = prepare_trend_data(selected_metrics, month_period("CRMEingangszeit", *selected_range))
 
             if not chart_data.empty:
                 line_chart = alt.Chart(chart_data).mark_line(point=True).encode(
@@ -204,42 +193,12 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
         
         else:
             
-            raw_frames = []
-
-            if "Testdatensätze" in selected_metrics and not test_data_df.empty:
-                temp_raw = test_data_df.copy()
-                
-                temp_col = "CRMEingangszeit"
-                if temp_col in temp_raw.columns:
-                    temp_raw[temp_col] = pd.to_datetime(temp_raw[temp_col], errors="coerce")
-                    
-                    mask_raw = (temp_raw[temp_col].dt.date >= selected_range[0]) & \
-                               (temp_raw[temp_col].dt.date <= selected_range[1])
-                    
-                    filtered_raw = temp_raw.loc[mask_raw].copy()
-                    
-                    filtered_raw.insert(0, "Fehlerkategorie", "Testdatensatz")
-                    
-                    raw_frames.append(filtered_raw)
-
-            if raw_frames:
-                final_raw_df = pd.concat(raw_frames, ignore_index=True)
-                
-                st.markdown(f"**Gefundene Einträge: {len(final_raw_df)}** im Zeitraum {selected_range[0].strftime('%d.%m.%Y')} bis {selected_range[1].strftime('%d.%m.%Y')}")
-                
-                st.dataframe(
-                    final_raw_df, 
-                    width="stretch", 
-                    hide_index=True
-                )
+            # Rohdaten des gewählten Zeitraums (ganze Tage), gefiltert in DuckDB
+            period = ("CRMEingangszeit", pd.Timestamp(selected_range[0]), pd.Timestamp(selected_range[1]) + pd.Timedelta(days=1))
 
-                csv_raw = final_raw_df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="Rohdaten als CSV herunterladen",
-                    data=csv_raw,
-                    file_name="zeitverlauf_rohdaten_text.csv",
-                    mime="text/csv"
-                )
+            if "Testdatensätze" in selected_metrics and test_data_df.count(period=period):
+                st.caption(f"Testdatensätze im Zeitraum {selected_range[0].strftime('%d.%m.%Y')} bis {selected_range[1].strftime('%d.%m.%Y')}")
+                paged_table(test_data_df, key="p3_trend_raw", period=period, file_name="zeitverlauf_rohdaten_text.csv")
             else:
                 st.info("Keine Rohdaten für die gewählten Metriken im ausgewählten Zeitraum gefunden.")
 
@@ -272,8 +231,8 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
             if view_mode_outlier == "Grafische Auswertung":
 
                 st.markdown("#### Fehlerschwerpunkte nach Gewerk")
-                grouped_gewerk = df_outlier['Gewerk_Name'].value_counts().reset_index()
-                grouped_gewerk.columns = ['Gewerk', 'Anzahl']
+                # im Build aus der Handwerker x Gewerk Matrix vorberechnet, absteigend sortiert
+                grouped_gewerk = metrics_df1.get("outlier_hotspots_gewerk")
 
                 chart_gewerk = alt.Chart(grouped_gewerk.head(10)).mark_bar().encode(
                     x=alt.X('Anzahl:Q', title="Anzahl Auffälligkeiten"),
@@ -287,12 +246,7 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
 
                 st.markdown("#### Top-Verursacher")
 
-                df_hw = df_outlier.copy()
-
-                grouped_hw = df_hw.groupby('Handwerker_Name', observed=True)['count'].sum().reset_index()
-                grouped_hw.columns = ['Handwerker', 'Summe_Fehler']
-
-                grouped_hw = grouped_hw.sort_values('Summe_Fehler', ascending=False).head(10)
+                grouped_hw = metrics_df1.get("outlier_hotspots_handwerker").head(10)
 
                 chart_hw = alt.Chart(grouped_hw).mark_bar().encode(
                     x=alt.X('Summe_Fehler:Q', title="Summe potenziell fehlerhafter Aufträge"),
@@ -344,7 +298,7 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
 
             view_mode_outlier = st.radio(
                 "Darstellung (Auffälligkeiten):",
-                ["Grafische Auswertung", "Detail-Tabelle"],
+                ["Grafische Auswertung", "Detail-Tabelle", "Alle Kombinationen"],
                 horizontal=True,
                 label_visibility="collapsed",
                 key="p3_semantic_view_toggle"
@@ -383,6 +337,21 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
                 ).properties(height=280)
                 st.altair_chart(chart_hw, width="stretch")
 
+            elif view_mode_outlier == "Alle Kombinationen":
+                # Ähnlichkeit jeder Gewerk/Handwerker-Kombination (einmal pro Paar berechnet, nicht pro Auftrag)
+                df_pairs = metrics_df1.get("semantic_pair_scores")
+                st.markdown(f"**Kombinationen: {len(df_pairs)}**")
+                st.dataframe(
+                    df_pairs[['Gewerk_Name', 'Handwerker_Name', 'count', 'Similarity_Score']].rename(columns={
+                        "Gewerk_Name": "Gewerk (Auftrag)",
+                        "Handwerker_Name": "Handwerker",
+                        "count": "Anzahl Aufträge",
+                        "Similarity_Score": "Ähnlichkeit"
+                    }),
+                    width="stretch",
+                    hide_index=True
+                )
+
             else:
                 # Tabellenansicht Outlier
                 df_display = df_semantic[['Gewerk_Name', 'Handwerker_Name', 'Similarity_Score']].copy()
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+from app_pages.table_view import paged_table
 
 def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
     """This function renders page 4 of 5 of the dashboard. 
@@ -77,7 +78,7 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
     fn_stats_df1 = metrics_df1.get("false_negative_stats")
     fn_details_df1 = metrics_df1.get("false_negative_details")
 
-    fn_count_df2 = len(metrics_df2.get("false_negative_details"))
+    fn_count_df2 = metrics_df2.get("false_negative_details").count()
     fn_stats_df2 = metrics_df2.get("false_negative_stats")
     fn_details_df2 = metrics_df2.get("false_negative_details")
 
@@ -218,19 +219,9 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
             ).properties(height=400, title="Top Fehlerquellen")
             st.altair_chart(bar, width="stretch")
 
-        if not disc_details.empty:
+        if disc_details.count():
             with st.expander("Details anzeigen"):
-                st.markdown(f"**Gefundene Einträge: {len(disc_details)}**")
-                st.dataframe(disc_details, width="stretch")
-
-                csv_disc = disc_details.to_csv(index=False).encode('utf-8')
-
-                st.download_button(
-                    label="Details als CSV herunterladen",
-                    data=csv_disc,
-                    file_name="rabatt_fehler_details.csv",
-                    mime="text/csv",
-                )
+                paged_table(disc_details, key="p4_discount_details", file_name="rabatt_fehler_details.csv")
 
     with tab3:
             st.subheader("Erkannte Proforma-Belege")
@@ -305,39 +296,18 @@ def show_page(metrics_df1, metrics_df2, comparison_df, issues_df):
             ).properties(height=300, title="Fehlerkategorien")
             st.altair_chart(bar, width="stretch")
 
-        if not fn_details_df2.empty:
+        if fn_count_df2:
             with st.expander("Details anzeigen"):
-                st.markdown(f"**Gefundene Einträge: {len(fn_details_df2)}**")
-                st.dataframe(fn_details_df2, width="stretch")
-                csv_data_2 = fn_details_df2.to_csv(index=False).encode('utf-8')
-
-                st.download_button(
-                    label="Details als CSV herunterladen",
-                    data=csv_data_2,
-                    file_name="konsistenz_fehler_details.csv",
-                    mime="text/csv",
-                )
+                paged_table(fn_details_df2, key="p4_fn_details_df2", file_name="konsistenz_fehler_details.csv")
     
     with tab6:
         st.subheader("Detailansicht für die Aufträge ohne Positionen")
         st.metric(label="Aufträge ohne Pos.", value=f"{empty_orders:,}".replace(",", "."), help="Anzahl der Aufträge, denen keine Positionen zugeordnet sind (PositionsAnzahl ist leer).", delta=get_delta("count_empty_orders"),delta_color="inverse")
-        selected_types = st.multiselect(
-        "Nach Schadensart filtern:",
-        options= empty_orders_df["Schadenart_Name"].unique(),
-        default=None,
-        key="schadenart_multiselect"
-    )
-        st.dataframe(empty_orders_df[empty_orders_df["Schadenart_Name"].isin(selected_types)] if selected_types else empty_orders_df)
+        paged_table(empty_orders_df, key="p4_empty_orders", filter_columns={"Schadenart_Name": "Nach Schadensart filtern:"})
 
     with tab7:
         st.subheader("Ausreißer in der Forderungssumme")
-        selected_kundengruppe = st.multiselect(
-        "Nach Kundengruppe filtern:",
-        options= outliers_by_damage["Kundengruppe"].unique(),
-        default=None,
-        key="kundengruppe_multiselect"
-    )
-        st.dataframe(outliers_by_damage[outliers_by_damage["Kundengruppe"].isin(selected_kundengruppe)] if selected_kundengruppe else outliers_by_damage)
+        paged_table(outliers_by_damage, key="p4_outliers_by_damage", filter_columns={"Kundengruppe": "Nach Kundengruppe filtern:"})
         st.caption("Gibt die Aufträge aus, deren Forderungssumme gruppiert nach Schadensart im 1. oder 99. Perzentil sind.")
 
     st.markdown("---")
\ No newline at end of file
@@ -2,35 +2,9 @@ import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 import data_drift_metrics as ddm
-import duckdb
+import db_pool
 from pathlib import Path
-
-@st.cache_data
-def load_df(df_type): 
-    """Loads the full specified DataFrame from the database into cache.
-
-    Parameters
-    ----------
-    df_type : string
-        expects df for order data, df2 for position data
-
-    Returns
-    -------
-    pandas.DataFrame
-        order or position DataFrame
-    """
-    con = duckdb.connect("resources/dashboard_data.duckdb", read_only=True)
-    if df_type == "df":
-        try:
-            df = con.execute("SELECT * FROM auftragsdaten").df()
-        finally:
-            con.close() 
-    if df_type == "df2":
-        try:
-            df = con.execute("SELECT * FROM positionsdaten").df()   
-        finally:
-             con.close()
-    return df
+from db_io import table_keys
 
 def fetch_reports_table():
     """Generates a DataFrame containing the timestamp ranges of all saved reports and the respective data source.
@@ -49,16 +23,35 @@ def fetch_reports_table():
     df_reports=df_reports.replace({"Quelle":{"df":"Aufträge","df2":"Positionen"}})
     return df_reports
     
+@st.cache_data(max_entries=4)
+def fetch_drift_sketches(_db_path, content, source_type):
+    """Monthly drift sketches of one source (see data_drift_metrics.load_drift_sketches), cached by the content key of the sketch tables."""
+    with db_pool.cursor(_db_path) as con:
+        return ddm.load_drift_sketches(con, source_type)
+
+def show_sketch_drift(result, reference_months, eval_months):
+    """Renders the result of data_drift_metrics.sketch_drift (Schnellvergleich) with the compared months."""
+    month_label = lambda months: " – ".join(m.strftime("%m/%Y") for m in months)
+    st.subheader("Schnellvergleich (Monats-Sketches)")
+    st.caption(f"Referenz: {month_label(reference_months)}, Vergleich: {month_label(eval_months)} (ganze Monate). "
+               f"Drift ab {ddm.DRIFT_THRESHOLD}: Wasserstein (normiert) für numerische, Jensen-Shannon für kategoriale Spalten.")
+    st.metric("Spalten mit Drift", f"{int(result['Drift'].sum())} von {len(result)}")
+    st.dataframe(result, hide_index=True, width="stretch")
+
 def refresh_table():
     #helper function to update the report listing as displayed in the dashboard 
      st.session_state.reports_table = fetch_reports_table()
 
-def show_page():
+def show_page(db_path):
     """This function renders page 5 of 5 of the dashboard.
 
     Page 5 lets you generate data drift reports and embeds them.
     Generated reports can be found at ./resources/reports .
     
+    Parameters
+    ----------
+    db_path : str
+        database version of the current rerun (db_io.current_db_path() in db_dashboard.py)
 
     Notes
     -----
@@ -66,18 +59,18 @@ def show_page():
     For implementation details of the report generation process and customization options, please refer to data_drift_metrics.py
     and it's documentation.     
     """
-    con = duckdb.connect("resources/dashboard_data.duckdb", read_only=True)
-   
-    try:
+    with db_pool.cursor(db_path) as con:
         #limit date selection options to observed timestamp ranges
-        min_date = con.execute("SELECT MIN(CRMEingangszeit) FROM auftragsdaten").fetchone()[0].date()
-        max_date = con.execute("SELECT MAX(CRMEingangszeit) FROM auftragsdaten").fetchone()[0].date()
-    finally:
-         con.close()    
+        min_date, max_date = (d.date() for d in con.execute("SELECT MIN(CRMEingangszeit), MAX(CRMEingangszeit) FROM auftragsdaten").fetchone())
+        # tables without a key (e.g. after an incremental build) are cached per database version
+        sketch_content = table_keys(con).get("metric_drift_histograms", db_path)
+        # databases built before the sketch tables have no Schnellvergleich
+        sketches_available = ddm.has_drift_sketches(con)
     min_date_6m = min_date + pd.Timedelta(weeks=26)
     min_date_12m = min_date + pd.Timedelta(weeks=52)
     report_html= None
     path_to_report = None
+    sketch_result = None
     
     
     form_column, tab_column = st.columns(2)
@@ -109,11 +102,22 @@ def show_page():
                         width=225
                         )
                     
+                # Schnellvergleich: drift from the monthly sketches of the build, no report and no raw data
+                method = st.radio("Methode", ("Evidently-Report", "Schnellvergleich (Monats-Sketches)"), horizontal=True)
                 force_reload = st.checkbox("Refresh erzwingen?")
 
                 submitted = st.form_submit_button("Report anzeigen")
 
-                if submitted:
+                if submitted and method != "Evidently-Report" and not sketches_available:
+                    st.info("Die Monats-Sketches fehlen in dieser Datenbankversion. Bitte build_db.py erneut ausführen oder den Evidently-Report wählen.")
+                elif submitted and method != "Evidently-Report":
+                    source_type = "df" if source_designation == "Auftragsdaten" else "df2"
+                    sketch_result = ddm.sketch_drift(
+                        fetch_drift_sketches(db_path, sketch_content, source_type),
+                        start_date_reference, end_date_reference,
+                        start_date_eval, end_date_eval
+                        )
+                elif submitted:
                 #gives feedback on selected report file location
                     st.write("Pfad zum Report:")
                     if source_designation == "Auftragsdaten":
@@ -137,6 +141,12 @@ def show_page():
             refresh_table()
             st.dataframe(st.session_state.reports_table)                                 
 
+    if sketch_result is not None:
+         show_sketch_drift(sketch_result,
+                           ddm.month_window(start_date_reference, end_date_reference),
+                           ddm.month_window(start_date_eval, end_date_eval))
+         st.stop()
+
     #prevents use of uninitialized values further down the line    
     if not path_to_report:
          st.write("Warten auf Auswahl..")
@@ -151,7 +161,9 @@ def show_page():
              raise FileNotFoundError    
     except FileNotFoundError: #if loading fails or recompute was selected, compute and save report as html
         with st.empty():
-            source_df = load_df(source_type).dropna(subset=['CRMEingangszeit'])
+            # only the schema columns and the rows of both windows are loaded (not the whole table)
+            with db_pool.cursor(db_path) as con:
+                source_df = ddm.load_drift_data(con, source_type, start_date_reference, end_date_reference, start_date_eval, end_date_eval)
             st.write("Report ist noch nicht vorhanden und wird erstellt. Dies kann einige Momente dauern...")
             ddm.data_drift_evaluation(
                 source_df, 
@@ -0,0 +1,90 @@
+import math
+import streamlit as st
+import pandas as pd
+
+"""
+Paged detail tables of the dashboard pages.
+
+The rows stay in DuckDB: filtering, sorting and paging run as SQL queries (LIMIT/OFFSET, see db_io.fetch_page), so the browser
+only receives the rows of the visible page, however large the detail table is. The CSV download is only built after 'CSV vorbereiten'.
+"""
+
+PAGE_SIZES = [25, 50, 100, 500]
+
+
+def month_period(column, start, end):
+    """Period (column, start, end) of the rows in the months whose first day lies between the dates start and end (range of a month slider)."""
+    first = pd.Timestamp(start).to_period("M").to_timestamp()
+    if first < pd.Timestamp(start):
+        first += pd.offsets.MonthBegin(1)
+    return column, first, pd.Timestamp(end).to_period("M").to_timestamp() + pd.offsets.MonthBegin(1)
+
+
+def paged_table(source, key, filter_columns=None, file_name=None, period=None):
+    """Renders a detail table page by page with column filters, text search and sorting.
+
+    Parameters
+    ----------
+    source : db_dashboard.SqlTable
+        handle of the table (provides columns, count, page, distinct and to_csv)
+    key : str
+        prefix of the widget keys, unique per table
+    filter_columns : dict, optional
+        column -> label of a multiselect filter over the distinct values of the column, by default None
+    file_name : str, optional
+        file name of the CSV download of all rows matching the filters, by default None (no download)
+    period : tuple, optional
+        (column, start, end), only shows the rows with start <= value < end (e.g. the period of a date slider), by default None
+
+    Returns
+    -------
+    int
+        number of rows matching the filters
+    """
+    columns = source.columns
+
+    filters = {}
+    if filter_columns:
+        for col, (column, label) in zip(st.columns(len(filter_columns)), filter_columns.items()):
+            selected = col.multiselect(label, options=source.distinct(column), default=None, key=f"{key}_filter_{column}")
+            if selected:
+                filters[column] = selected
+    filters = filters or None
+
+    c1, c2, c3, c4 = st.columns([2, 2, 2, 1])
+    search_column = c1.selectbox("Suche in Spalte", columns, key=f"{key}_search_column")
+    search_text = c2.text_input("enthält", key=f"{key}_search_text")
+    search = (search_column, search_text) if search_text else None
+    order_by = c3.selectbox("Sortieren nach", [None, *columns], format_func=lambda c: "Tabellenreihenfolge" if c is None else c, key=f"{key}_order_by")
+    descending = c4.toggle("absteigend", key=f"{key}_descending", disabled=order_by is None)
+
+    total = source.count(filters, search, period)
+    c1, c2, c3 = st.columns([2, 1, 1])
+    c1.markdown(f"**Gefundene Einträge: {total}**")
+    page_size = c2.selectbox("Zeilen pro Seite", PAGE_SIZES, index=1, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / page_size))
+    # fewer pages after changing the filters: stay within the range
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    page = c3.number_input(f"Seite (von {pages})", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+
+    st.dataframe(source.page(page - 1, page_size, filters, search, period, order_by, descending), width="stretch", hide_index=True)
+
+    if file_name:
+        # the CSV of all matching rows is only built on request and kept until the table or its filters change
+        query = (source.db_path, source.table, filters, search, period, order_by, descending)
+        prepared = st.session_state.get(f"{key}_csv")
+        if prepared is None or prepared[0] != query:
+            prepared = None
+            if st.button("CSV vorbereiten", key=f"{key}_prepare"):
+                prepared = st.session_state[f"{key}_csv"] = (query, source.to_csv(filters, search, period, order_by, descending))
+        if prepared is not None:
+            st.download_button(
+                label="Details als CSV herunterladen",
+                data=prepared[1],
+                file_name=file_name,
+                mime="text/csv",
+                on_click="ignore",
+                key=f"{key}_download",
+            )
+    return total
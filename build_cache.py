@@ -0,0 +1,272 @@
+import hashlib
+import inspect
+import os
+import types
+import duckdb
+import numpy as np
+import pandas as pd
+import db_io
+
+"""
+Persistent result cache of build_db.py. Every full build stores a key for the cleaned data and for every metric task in the
+table 'build_cache_keys'. If the key of the cleaned data matches the one of the previous database version, the new version
+starts as a copy of the previous one: the cleaned data is kept and only metrics whose key changed are computed again,
+so re-runs on unchanged data only hash the raw files.
+
+A key covers everything the result depends on:
+    data        content hash of the raw data (the per-order fingerprints of build_db.compute_fingerprints)
+    code        source of the task function and of all project functions and constants it (transitively) refers to
+    inputs      keys of the tasks whose outputs it reads (e.g. handwerker_outlier_stats -> metric_handwerker_outliers)
+    parameters  output/input names and the versions of pandas, numpy and duckdb
+
+Outputs of cached tasks are stored in the database: 'metric_*' tables as usual, scalars in 'scalar_metrics'
+and all other DataFrames (intermediate results such as 'handwerker_outlier_stats') as 'build_result_<name>'.
+
+The keys also describe the content of the tables: 'build_table_keys' (db_io.TABLE_KEYS) maps every table to the key of the task
+that wrote it, so the dashboard keeps its cached tables across versions as long as their key does not change.
+"""
+
+KEY_TABLE = "build_cache_keys"
+CLEANED_DATA = "cleaned_data"
+# bump to invalidate all stored keys, e.g. if the format of a stored output changes
+CACHE_VERSION = 2
+ENVIRONMENT = (CACHE_VERSION, pd.__version__, np.__version__, duckdb.__version__)
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+_CONSTANT_TYPES = (str, bytes, int, float, bool, type(None), tuple, list, dict, set, frozenset)
+
+
+def make_key(*parts):
+    """Helper function. Hash (hex string) of the repr of all parts."""
+    return hashlib.sha256(repr((ENVIRONMENT,) + parts).encode("utf-8")).hexdigest()
+
+
+def data_fingerprint(fingerprints):
+    """Content hash of the raw data, independent of the row order.
+
+    Parameters
+    ----------
+    fingerprints : pandas.DataFrame
+        output of build_db.compute_fingerprints()
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    hashes = pd.util.hash_pandas_object(fingerprints[["KvaRechnung_ID", "CRMEingangszeit", "fingerprint"]], index=False)
+    # sum with uint64 overflow: the same value for every order of the rows
+    return make_key(len(hashes), int(hashes.to_numpy().sum(dtype=np.uint64)))
+
+
+def _in_project(obj):
+    """Helper function. True for functions and modules defined in a file of this directory (not in libraries)."""
+    module = obj if isinstance(obj, types.ModuleType) else inspect.getmodule(obj)
+    path = getattr(module, "__file__", None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == _PROJECT_DIR
+
+
+def _code_names(code):
+    """Helper function. Global and attribute names used by a code object and the functions/comprehensions nested in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _constant_repr(value):
+    """Helper function. Deterministic repr of a constant (sets are sorted), None for values that are not hashed."""
+    if isinstance(value, (set, frozenset)):
+        return repr(sorted(value, key=repr))
+    if isinstance(value, _CONSTANT_TYPES):
+        return repr(value)
+    return None
+
+
+def code_fingerprint(func):
+    """Hash of the source code of func and of all project functions and constants it refers to.
+
+    Functions wrapped with functools.wraps (e.g. MetricCache.wrap) are unwrapped, lambdas are hashed with the line(s)
+    they are defined in. Library functions are covered by the versions in ENVIRONMENT only.
+
+    Parameters
+    ----------
+    func : callable
+        e.g. MetricTask.func
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    digest = hashlib.sha256()
+    seen = set()
+
+    def add_value(name, value, names):
+        if isinstance(value, types.ModuleType):
+            # e.g. mt.proformabelege: all names used by the function that are attributes of the module
+            if _in_project(value):
+                for attr in sorted(names):
+                    if hasattr(value, attr):
+                        add_value(f"{value.__name__}.{attr}", getattr(value, attr), names)
+        elif callable(value):
+            if _in_project(inspect.unwrap(value)):
+                add_function(value)
+        else:
+            text = _constant_repr(value)
+            if text is not None:
+                digest.update(f"{name}={text}\n".encode("utf-8"))
+
+    def add_function(f):
+        f = inspect.unwrap(f)
+        if id(f) in seen or not isinstance(f, types.FunctionType):
+            return
+        seen.add(id(f))
+        try:
+            source = inspect.getsource(f)
+        except (OSError, TypeError):
+            source = repr((f.__code__.co_code, f.__code__.co_consts))
+        digest.update(source.encode("utf-8"))
+        names = _code_names(f.__code__)
+        for cell in f.__closure__ or ():
+            try:
+                add_value("<closure>", cell.cell_contents, names)
+            except ValueError: # empty cell
+                pass
+        for name in sorted(names):
+            if name in f.__globals__:
+                add_value(name, f.__globals__[name], names)
+
+    add_function(func)
+    return digest.hexdigest()
+
+
+def task_keys(tasks, input_keys):
+    """Computes the cache key of every task.
+
+    Parameters
+    ----------
+    tasks : list of MetricTask
+        tasks of the build
+    input_keys : dict
+        shared input name -> key of its content (e.g. {'df': <key of the cleaned data>, ...})
+
+    Returns
+    -------
+    dict
+        task name -> key
+    """
+    producers = {output: t for t in tasks for output in t.outputs}
+    keys = {}
+
+    def key(task):
+        if task.name not in keys:
+            sources = [input_keys[i] if i in input_keys else key(producers[i]) for i in task.inputs]
+            keys[task.name] = make_key(code_fingerprint(task.func), task.outputs, task.inputs, sources)
+        return keys[task.name]
+
+    for t in tasks:
+        key(t)
+    return keys
+
+
+def previous_keys(path):
+    """Returns the keys stored in a database version (name -> key), empty if it has none (or does not exist)."""
+    if path is None or not os.path.exists(path):
+        return {}
+    with duckdb.connect(path, read_only=True) as con:
+        if KEY_TABLE not in set(con.execute("SHOW TABLES").df()["name"]):
+            return {}
+        return dict(con.execute(f"SELECT name, cache_key FROM {KEY_TABLE}").fetchall())
+
+
+def save_keys(con, keys):
+    """Writes the keys of this build into build_cache_keys."""
+    df_keys = pd.DataFrame(list(keys.items()), columns=["name", "cache_key"])
+    con.execute(f"CREATE OR REPLACE TABLE {KEY_TABLE} AS SELECT * FROM df_keys")
+
+
+def table_keys(tasks, keys, cleaned_key, scalar_names, cleaned_tables=("auftragsdaten", "positionsdaten")):
+    """Content key of every table written by the tasks (the key of the producing task), of 'scalar_metrics' (combined key
+    of all scalar tasks) and of the cleaned data tables.
+
+    Parameters
+    ----------
+    tasks : list of MetricTask
+        all tasks of the build (including the reused ones)
+    keys : dict
+        output of task_keys()
+    cleaned_key : str
+        key of the cleaned data
+    scalar_names : list of str
+        outputs stored as columns of 'scalar_metrics'
+    cleaned_tables : tuple of str, optional
+        tables of the cleaned data, by default ("auftragsdaten", "positionsdaten")
+
+    Returns
+    -------
+    dict
+        table -> key
+    """
+    output_keys = {o: keys[t.name] for t in tasks for o in t.outputs}
+    tables = {cache_table(o): key for o, key in output_keys.items() if o not in scalar_names}
+    tables["scalar_metrics"] = make_key(sorted(output_keys[name] for name in scalar_names))
+    tables.update(dict.fromkeys(cleaned_tables, cleaned_key))
+    return tables
+
+
+def save_table_keys(con, keys):
+    """Writes the content keys of the tables (table_keys()) into db_io.TABLE_KEYS."""
+    df_table_keys = pd.DataFrame(list(keys.items()), columns=["name", "cache_key"])
+    con.execute(f"CREATE OR REPLACE TABLE {db_io.TABLE_KEYS} AS SELECT * FROM df_table_keys")
+
+
+def cache_table(name):
+    """Table in which an output is stored (outputs that are neither metric tables nor scalars: 'build_result_<name>')."""
+    return name if name.startswith("metric_") else f"build_result_{name}"
+
+
+def reusable_tasks(con, tasks, keys, previous, scalar_names):
+    """Selects the tasks whose results can be kept from the previous database version.
+
+    A task is reusable if its key equals the stored key and all of its outputs are stored (tables or scalars).
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the new version, a copy of the previous one
+    tasks : list of MetricTask
+        tasks of the build
+    keys : dict
+        output of task_keys()
+    previous : dict
+        output of previous_keys() for the previous version
+    scalar_names : list of str
+        outputs stored as columns of 'scalar_metrics'
+
+    Returns
+    -------
+    list of MetricTask
+    """
+    tables = set(con.execute("SHOW TABLES").df()["name"])
+    scalars = set(con.execute("SELECT column_name FROM (DESCRIBE scalar_metrics)").df()["column_name"]) if "scalar_metrics" in tables else set()
+    return [t for t in tasks if previous.get(t.name) == keys[t.name]
+            and all(o in scalars if o in scalar_names else cache_table(o) in tables for o in t.outputs)]
+
+
+def stored_scalars(con, names):
+    """Reads scalar results (columns of 'scalar_metrics') of the previous build, name -> value."""
+    if not names:
+        return {}
+    df = con.execute(f"SELECT {', '.join(names)} FROM scalar_metrics").df()
+    # per column, so every value keeps its type (e.g. float32 -> FLOAT in the new scalar_metrics)
+    return {name: df[name].iloc[0] for name in names}
+
+
+def drop_stale_tables(con, outputs):
+    """Drops metric and result tables of the previous version that are no longer produced by any task."""
+    keep = {cache_table(o) for o in outputs}
+    for table in con.execute("SHOW TABLES").df()["name"]:
+        if (table.startswith("metric_") or table.startswith("build_result_")) and table not in keep and table != "metric_comparison":
+            con.execute(f"DROP TABLE {table}")
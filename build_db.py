@@ -2,350 +2,824 @@ import pandas as pd
 import duckdb
 import time
 import metrics as mt
+import metrics_sql as ms
 import os
+import shutil
+import argparse
+import warnings
 import data_cleaning as dc
-
-""" 
+import cleaning_sql
+import build_cache
+import data_drift_metrics as ddm
+import db_io
+from db_io import fetch_df
+from datetime import datetime
+from build_scheduler import MetricTask, MetricCache, run_tasks
+from build_profile import BuildProfiler
+from embedding_store import EmbeddingStore
+
+"""
 This script builds a duckdb database from the cleaned Auftrags- and Positionsdaten data sets.
-Additionally to the 'raw' data all metrics (if feasible) are precomputed and saved to be easily and performantly accessible by the dashboard application. 
-"""    
-DB_DIR = "resources"
-DB_NAME = "dashboard_data.duckdb"
-DB_OLD_NAME = "dashboard_data_old.duckdb"
-
-DB_PATH = os.path.join(DB_DIR, DB_NAME)
-DB_OLD_PATH = os.path.join(DB_DIR, DB_OLD_NAME)
-
-#Versioning of old databases: one old version is kept and rotated on re-run
-print("--- Step 0: Database Rotation ---")
-if os.path.exists(DB_OLD_PATH):
-    try:
-        os.remove(DB_OLD_PATH)
-        print(f"Old backup deleted: {DB_OLD_PATH}")
-    except PermissionError:
-        print(f"WARNING: Could not delete {DB_OLD_PATH}. File might be open?")
-
-if os.path.exists(DB_PATH):
-    try:
-        os.rename(DB_PATH, DB_OLD_PATH)
-        print(f"Existing DB moved to: {DB_OLD_PATH}")
-    except PermissionError:
-        print(f"WARNING: Could not move {DB_PATH}. File might be open?")
-
-# Initialize timer for script performance measurement/feedback 
-start_time = time.time()
-
-#raw data is loaded from (parquet) files defined in the data_cleaning module
-print("--- Step 1: Loading Data ---") 
-auftragsdaten, positionsdaten, zeitdaten = dc.load_data()
-
-#raw data is prepared (details in data_cleaning)
-print("--- Step 2: Merging & Cleaning ---")
-df, df2 = dc.data_cleaning(auftragsdaten, positionsdaten, zeitdaten)
-
-#Establish connection to (as of yet empty) data base
-print("--- Step 3: Building DuckDB Database ---")
-con = duckdb.connect(DB_PATH)
-
-# Store the "Original" Cleaned Data
-print("Saving (Auftragsdaten)...")
-con.execute("CREATE OR REPLACE TABLE auftragsdaten AS SELECT * FROM df")
-
-print("Saving (Positionsdaten)...")
-con.execute("CREATE OR REPLACE TABLE positionsdaten AS SELECT * FROM df2")
-
-print("--- Step 4: Calculating Scalar Metrics ---") 
-
-# --- 1. General Counts ---
-total_orders = mt.count_rows(df)
-total_positions = mt.count_rows(df2)
-empty_orders_count, empty_orders_df = mt.empty_orders(df)
-
-# --- 2. Data Quality (Nulls & Uniqueness) ---
-# returns: (float, DataFrame) -> ignore the Dataframe (_)
-null_ratio_orders, _ = mt.data_cleanliness(df, group_by_col=None)
-null_ratio_positions, _ = mt.data_cleanliness(df2, group_by_col=None)
-# returns: (boolean, DataFrame) -> Dataframe could be added to dashboard if wanted
-unique_kva, unique_pos, unique_kva_nr_land, df_uniq_problem = mt.uniqueness_check(df, df2)
-
-# --- 3. Business Logic / Test Data ---
-test_data_count = mt.Kundengruppe_containing_test(df, return_frame=False)
-
-# --- 4. Plausibility Checks (Tuples extraction) ---
-# returns: (DataFrame, count, avg) -> ignore the DataFrame (_)
-_, plausibility_error_count_df, plausibility_avg_diff_df = mt.plausibilitaetscheck_forderung_einigung(df)
-_, plausibility_error_count_df2, plausibility_avg_diff_df2 = mt.plausibilitaetscheck_forderung_einigung(df2)
-
-# returns: (DataFrame, count) -> ignore the DataFrame (_)
-_, proforma_count = mt.proformabelege(df)
-
-# --- 5. Logic Errors ---
-discount_logic_errors = mt.discount_check(df2)
-
-
-
-print("--- Step 5: Constructing Scalar Metrics Table ---")
-#aggregating of all scalar metrics computed in step 4 into a handy format for conversion to database table 
-kpi_data = {
-    # General
-    'count_total_orders': [total_orders],
-    'count_total_positions': [total_positions],
-    'count_empty_orders': [empty_orders_count],
+Additionally to the 'raw' data all metrics (if feasible) are precomputed and saved to be easily and performantly accessible by the dashboard application.
+Every build writes a new version of the database, which is published (resources/CURRENT) only after it has been completed successfully.
+
+Usage:
+    python build_db.py                  full rebuild (default)
+    python build_db.py --incremental    only new or changed orders are cleaned, row-level metric tables are updated in place
+    python build_db.py --jobs 8         number of metrics computed in parallel (default: number of CPU cores)
+    python build_db.py --executor process   compute metrics in forked processes instead of threads
+    python build_db.py --engine sql     compute the metrics of metrics_sql.py in DuckDB instead of pandas
+    python build_db.py --cleaning sql   clean the raw data in DuckDB straight from the parquet files (full builds, see cleaning_sql.py)
+    python build_db.py --profile-memory additionally trace the memory allocated by every step (slower)
+    python build_db.py --no-cache       recompute everything, even results that could be copied from the previous version
+    python build_db.py --semantic-backend int8   encode names for the semantic check with an int8-quantized/ONNX model (CPU)
+
+Runtime, memory and row counts of every step and metric are stored in the tables build_runs / build_step_profile (see build_profile.py).
+Full builds copy the cleaned data and every metric whose input data and code are unchanged from the previous version (see build_cache.py).
+"""
+# DuckDB's pandas scan (1.4) still reads pyarrow-backed string columns via a deprecated pandas attribute
+warnings.filterwarnings("ignore", message="ArrowStringArray._data", category=FutureWarning)
+
+DB_DIR = db_io.DB_DIR
+DB_VERSION_PREFIX = "dashboard_data_"
+
+# Detail tables in which every row belongs to exactly one order (KvaRechnung_ID) or position (Position_ID).
+# In incremental builds these are computed on the delta only and merged into the existing table via their key column.
+# All other metric tables are aggregates over the whole data set and are recomputed from the updated data.
+ROW_METRIC_KEYS = {
+    "metric_test_data_entries": "KvaRechnung_ID",
+    "metric_plausibility_diffs_auftragsdaten": "KvaRechnung_ID",
+    "metric_plausibility_diffs_positionsdaten": "Position_ID",
+    "metric_proforma": "KvaRechnung_ID",
+    "metric_above_50k": "KvaRechnung_ID",
+    "metric_zeitwert_errors": "KvaRechnung_ID",
+    "metric_order_pos_mismatch": "KvaRechnung_ID",
+    "metric_semantic_mismatches": "KvaRechnung_ID",
+    "metric_position_count_positionsdaten": "KvaRechnung_ID",
+    "metric_empty_orders_dataframe": "KvaRechnung_ID",
+    "metric_discount_details": "Position_ID",
+    "metric_fn_details_df1": "KvaRechnung_ID",
+    "metric_fn_details_df2": "Position_ID",
+}
 
+# Detail tables the dashboard filters by period (trend charts, raw data of a period). They are stored sorted by CRMEingangszeit,
+# so the min/max statistics of DuckDB's row groups (zonemaps) let a period query skip all row groups outside the period.
+TIME_SORTED_TABLES = ["metric_test_data_entries", "metric_above_50k", "metric_zeitwert_errors", "metric_order_pos_mismatch"]
+
+# column types that update_table widens if the appended rows need a larger type
+NUMERIC_TYPES = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT", "FLOAT", "DOUBLE"}
+
+# order-independent hash of all rows of a group (see compute_fingerprints)
+HASH_SUM = "(sum(hash({})) % 18446744073709551616)::UBIGINT"
+
+# functions that produce the tables 'auftragsdaten' and 'positionsdaten', part of the cache key of the cleaned data
+CLEANING_FUNCTIONS = [dc.load_data, dc.data_cleaning, cleaning_sql.data_cleaning]
+
+
+def new_db_path():
+    """Returns the path of a new, not yet published database version (resources/dashboard_data_<timestamp>.duckdb)."""
+    version = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(DB_DIR, f"{DB_VERSION_PREFIX}{version}.duckdb")
+
+
+def publish_database(path):
+    """Makes a finished build the current database by atomically replacing the pointer file resources/CURRENT.
+
+    Readers (db_dashboard.py) either see the previous or the new version, never a partially written database.
+    """
+    tmp_path = db_io.DB_POINTER_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(path))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, db_io.DB_POINTER_PATH)
+    print(f"Published: {path}")
+
+
+def remove_old_versions(keep):
+    """Deletes all database versions except the given ones, including leftovers of failed builds.
+
+    Parameters
+    ----------
+    keep : list of str
+        paths of the versions to keep
+    """
+    keep = {os.path.basename(path) for path in keep if path}
+    versions = [f for f in os.listdir(DB_DIR) if f.startswith(DB_VERSION_PREFIX) and f.endswith(".duckdb")]
+    for version in versions:
+        if version in keep:
+            continue
+        path = os.path.join(DB_DIR, version)
+        try:
+            os.remove(path)
+            if os.path.exists(path + ".wal"):
+                os.remove(path + ".wal")
+            print(f"Old version deleted: {path}")
+        except PermissionError:
+            print(f"WARNING: Could not delete {path}. File might be open?")
+
+
+def compute_fingerprints(con):
+    """Calculates a content hash for every order of the raw data, including its timestamp and all of its positions.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection used to run the (multithreaded) hashing, with the views raw_auftragsdaten, raw_positionsdaten and
+        raw_zeitdaten over the raw files (cleaning_sql.create_raw_views)
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame with the columns 'KvaRechnung_ID', 'CRMEingangszeit' and 'fingerprint' (one row per order ID found in any of the files)
+    """
+    # the row hashes of an order are summed up modulo 2^64: independent of the row order, but unlike bit_xor
+    # a pair of identical rows (e.g. a duplicated position) does not cancel out
+    return con.execute(f"""
+        WITH pos AS (
+            SELECT KvaRechnung_ID, {HASH_SUM.format("p")} AS pos_hash
+            FROM raw_positionsdaten p GROUP BY KvaRechnung_ID
+        ),
+        zeit AS (
+            SELECT KvaRechnung_ID, MAX(CRMEingangszeit) AS CRMEingangszeit, {HASH_SUM.format("z")} AS zeit_hash
+            FROM raw_zeitdaten z GROUP BY KvaRechnung_ID
+        ),
+        orders AS (
+            SELECT KvaRechnung_ID, {HASH_SUM.format("a")} AS order_hash
+            FROM raw_auftragsdaten a GROUP BY KvaRechnung_ID
+        )
+        SELECT
+            COALESCE(o.KvaRechnung_ID, pos.KvaRechnung_ID) AS KvaRechnung_ID,
+            zeit.CRMEingangszeit,
+            hash(o.order_hash, zeit.zeit_hash, pos.pos_hash) AS fingerprint
+        FROM orders o
+        FULL JOIN pos ON o.KvaRechnung_ID = pos.KvaRechnung_ID
+        LEFT JOIN zeit ON COALESCE(o.KvaRechnung_ID, pos.KvaRechnung_ID) = zeit.KvaRechnung_ID
+    """).df()
+
+
+def find_delta(con, fingerprints):
+    """Compares the fingerprints of the raw data with the state stored by the last build.
+
+    An order is part of the delta if it was received after the stored CRMEingangszeit watermark, if its KvaRechnung_ID is unknown
+    or if its content (order, timestamp or any of its positions) changed. Orders that disappeared from the raw data are stale as well.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the database of the last build
+    fingerprints : pandas.DataFrame
+        output of compute_fingerprints() for the current raw data
+
+    Returns
+    -------
+    delta_ids: pandas.Series
+        KvaRechnung_IDs that have to be (re-)cleaned and (re-)computed
+    stale_ids: pandas.Series
+        KvaRechnung_IDs whose rows have to be removed from the database before the delta is appended (changed and removed orders)
+    """
+    watermark = con.execute("SELECT MAX(watermark) FROM build_state").fetchone()[0]
+    print(f"Last watermark (CRMEingangszeit): {watermark}")
+
+    delta_ids = con.execute("""
+        SELECT f.KvaRechnung_ID
+        FROM fingerprints f
+        LEFT JOIN build_fingerprints b ON f.KvaRechnung_ID = b.KvaRechnung_ID
+        WHERE b.KvaRechnung_ID IS NULL
+           OR f.CRMEingangszeit > ?
+           OR f.fingerprint <> b.fingerprint
+    """, [watermark]).df()["KvaRechnung_ID"]
+
+    stale_ids = con.execute("""
+        SELECT b.KvaRechnung_ID
+        FROM build_fingerprints b
+        LEFT JOIN fingerprints f ON f.KvaRechnung_ID = b.KvaRechnung_ID
+        WHERE f.KvaRechnung_ID IS NULL OR f.fingerprint <> b.fingerprint OR f.CRMEingangszeit > ?
+    """, [watermark]).df()["KvaRechnung_ID"]
+
+    return delta_ids, stale_ids
+
+
+def save_build_state(con, fingerprints, mode):
+    """Stores watermark and fingerprints of the processed raw data, which are the basis for the next incremental build."""
+    watermark = fingerprints["CRMEingangszeit"].max()
+    con.execute("CREATE TABLE IF NOT EXISTS build_state (built_at TIMESTAMP, mode VARCHAR, watermark TIMESTAMP, order_count BIGINT)")
+    con.execute("INSERT INTO build_state VALUES (current_localtimestamp(), ?, ?, ?)", [mode, watermark, len(fingerprints)])
+    con.execute("CREATE OR REPLACE TABLE build_fingerprints AS SELECT KvaRechnung_ID, fingerprint FROM fingerprints")
+
+
+def update_table(con, table, key, stale, new_rows):
+    """Applies the delta of an incremental build to a table in place: deletes the rows of stale keys and appends the new rows.
+
+    ENUM columns get exactly the values present afterwards (sorted, like the categories of a full build), numeric columns are
+    widened to the common type of table and new rows where needed (e.g. SMALLINT and INTEGER -> INTEGER, FLOAT and DOUBLE -> DOUBLE).
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the new database version
+    table : str
+        table to update
+    key : str
+        key column, 'KvaRechnung_ID' or 'Position_ID'
+    stale : str
+        (temporary) table with the column key, rows with one of its keys are deleted (missing keys match as well)
+    new_rows : pandas.DataFrame
+        rows to append (by column name), may be empty
+    """
+    con.execute(f'DELETE FROM {table} USING {stale} s WHERE {table}."{key}" IS NOT DISTINCT FROM s."{key}"')
+    has_rows = not new_rows.empty
+    if has_rows:
+        con.register("new_rows", new_rows)
+    types = dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {table})").fetchall())
+    combined = dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM {table} UNION ALL BY NAME SELECT * FROM new_rows)").fetchall()) if has_rows else types
+    casts = []
+    for column, ctype in types.items():
+        if ctype.startswith("ENUM("):
+            sources = [f'SELECT "{column}"::VARCHAR AS v FROM {table}']
+            if has_rows and column in new_rows.columns:
+                sources.append(f'SELECT "{column}"::VARCHAR FROM new_rows')
+            values = [v for v, in con.execute(f"SELECT DISTINCT v FROM ({' UNION ALL '.join(sources)}) WHERE v IS NOT NULL ORDER BY 1").fetchall()]
+            current = [v for v, in con.execute(f'SELECT unnest(enum_range(any_value("{column}")))::VARCHAR FROM {table}').fetchall()]
+            if values and values != current:
+                literals = ", ".join("'" + v.replace("'", "''") + "'" for v in values)
+                casts.append(f'CAST("{column}"::VARCHAR AS ENUM({literals})) AS "{column}"')
+        elif ctype in NUMERIC_TYPES and combined[column] in NUMERIC_TYPES and combined[column] != ctype:
+            casts.append(f'CAST("{column}" AS {combined[column]}) AS "{column}"')
+    if casts:
+        # rewritten instead of ALTER TABLE ... TYPE, which also converts the values of the deleted rows
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * REPLACE ({', '.join(casts)}) FROM {table}")
+    if has_rows:
+        con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM new_rows")
+        con.unregister("new_rows")
+
+
+# metrics.py functions whose results are used for several outputs (e.g. scalar KPI and detail table),
+# memoized so each of them runs only once per build and input frame
+metric_cache = MetricCache()
+plausibility_check = metric_cache.wrap(mt.plausibilitaetscheck_forderung_einigung)
+data_cleanliness = metric_cache.wrap(mt.data_cleanliness)
+test_data_entries = metric_cache.wrap(lambda df: mt.Kundengruppe_containing_test(df, return_frame=True))
+proformabelege = metric_cache.wrap(mt.proformabelege)
+empty_orders = metric_cache.wrap(mt.empty_orders)
+discount_details = metric_cache.wrap(mt.discount_details)
+false_negative_df1 = metric_cache.wrap(mt.false_negative_df1)
+false_negative_df2 = metric_cache.wrap(mt.false_negative_df2)
+handwerker_gewerke_outlier = metric_cache.wrap(mt.handwerker_gewerke_outlier)
+
+
+def flag_handwerker_outliers(df_outlier):
+    """Keeps the outliers of mt.handwerker_gewerke_outlier() and checks them against the trade keywords."""
+    df_outliers_true = df_outlier[df_outlier['is_outlier'] == True].copy()
+    df_outliers_true['Check_Result'] = mt.check_keywords(df_outliers_true)
+    return df_outliers_true
+
+
+def semantic_pair_scores(df, backend="torch"):
+    """mt.semantic_pair_scores with the embeddings of known Gewerk/Handwerker names taken from resources/embeddings.duckdb (embedding_store.py)."""
+    return mt.semantic_pair_scores(df, embedding_store=EmbeddingStore(), backend=backend)
+
+
+def cleanliness_tables(series_row_ratios_grouped_df, df_col_ratios_grouped_df):
+    """Tables of the grouped Data Cleanliness. The index of both results is reset to make 'Kundengruppe' a real column."""
+    return series_row_ratios_grouped_df.to_frame(name='row_null_ratio').reset_index(), df_col_ratios_grouped_df.reset_index()
+
+
+def cleanliness_grouped(df):
+    """Data Cleanliness grouped by Kundengruppe (see cleanliness_tables)."""
+    return cleanliness_tables(*data_cleanliness(df, group_by_col="Kundengruppe"))
+
+
+# Step 4: every metric with its inputs and outputs, run by build_scheduler.run_tasks().
+# Inputs are the cleaned frames 'df' (Auftragsdaten) and 'df2' (Positionsdaten) or outputs of other tasks.
+# Outputs starting with 'metric_' are saved as tables as soon as they are computed, all others are scalars or intermediate results.
+METRIC_TASKS = [
+    # --- scalar metrics ---
+    # General Counts
+    MetricTask("count_total_orders", mt.count_rows, ["df"]),
+    MetricTask("count_total_positions", mt.count_rows, ["df2"]),
+    MetricTask("count_empty_orders", lambda df: empty_orders(df)[0], ["df"]),
+    # Data Quality (Nulls & Uniqueness)
+    MetricTask("null_row_ratio_orders", lambda df: data_cleanliness(df, group_by_col=None)[0], ["df"]),
+    MetricTask("null_row_ratio_positions", lambda df2: data_cleanliness(df2, group_by_col=None)[0], ["df2"]),
+    # returns: (boolean, boolean, boolean, DataFrame) -> Dataframe could be added to dashboard if wanted
+    MetricTask(["is_unique_kva_id", "is_unique_position_id", "is_unique_kva_nr_per_land", "uniqueness_problems"], mt.uniqueness_check, ["df", "df2"]),
+    # Business Logic / Test Data
+    MetricTask("count_test_data_rows", lambda df: len(test_data_entries(df)), ["df"]),
+    # Plausibility Checks, returns: (DataFrame, count, avg) -> ignore the DataFrame
+    MetricTask(["count_plausibility_errors_df", "avg_plausibility_diff_df"], lambda df: plausibility_check(df)[1:], ["df"]),
+    MetricTask(["count_plausibility_errors_df2", "avg_plausibility_diff_df2"], lambda df2: plausibility_check(df2)[1:], ["df2"]),
+    MetricTask("count_proforma_receipts", lambda df: proformabelege(df)[1], ["df"]),
+    # Logic Errors
+    MetricTask("count_discount_logic_errors", mt.discount_check, ["df2"]),
+
+    # --- detail tables (ROW_METRIC_KEYS) ---
+    MetricTask("metric_test_data_entries", test_data_entries, ["df"]),
+    MetricTask("metric_plausibility_diffs_auftragsdaten", lambda df: plausibility_check(df)[0], ["df"]),
+    MetricTask("metric_plausibility_diffs_positionsdaten", lambda df2: plausibility_check(df2)[0], ["df2"]),
+    MetricTask("metric_proforma", lambda df: proformabelege(df)[0], ["df"]),
+    MetricTask("metric_above_50k", mt.above_50k, ["df"]),
+    MetricTask("metric_zeitwert_errors", mt.check_zeitwert, ["df"]),
+    MetricTask("metric_order_pos_mismatch", mt.abgleich_auftraege, ["df", "df2"]),
+    # scores of metric_semantic_pair_scores looked up per order, no model needed.
+    # Optional: durch lambda df, pairs: pd.DataFrame(columns=['KvaRechnung_ID']) ersetzen, falls mt.semantic_pair_scores(df) nicht ausgeführt werden kann (wenn dependencies oder ressourcen für classifer nicht gegeben)
+    MetricTask("metric_semantic_mismatches", lambda df, pairs: mt.mismatched_entries(df, pair_scores=pairs), ["df", "metric_semantic_pair_scores"]),
+    MetricTask("metric_position_count_positionsdaten", mt.position_count, ["df2"]),
+    MetricTask("metric_empty_orders_dataframe", lambda df: empty_orders(df)[1], ["df"]),
+    # page4 Tab 2, 4 and 5
+    MetricTask("metric_discount_details", lambda df2: discount_details(df2)[1], ["df2"]),
+    MetricTask("metric_fn_details_df1", lambda df: false_negative_df1(df)[1], ["df"]),
+    MetricTask("metric_fn_details_df2", lambda df2: false_negative_df2(df2)[1], ["df2"]),
+
+    # --- aggregate tables ---
+    MetricTask("metric_null_ratios_per_column", mt.ratio_null_values_column, ["df"]),
+    MetricTask(["metric_cleanliness_rows_grouped_auftragsdaten", "metric_cleanliness_cols_grouped_auftragsdaten"], cleanliness_grouped, ["df"]),
+    MetricTask("metric_cleanliness_cols_ungrouped_auftragsdaten",
+               lambda df: data_cleanliness(df, group_by_col=None)[1].rename(columns={'index': 'column_name'}), ["df"]),
+    MetricTask("metric_cleanliness_cols_ungrouped_positionsdaten",
+               lambda df2: data_cleanliness(df2, group_by_col=None)[1].rename(columns={'index': 'column_name'}), ["df2"]),
+    MetricTask("metric_positions_over_time", lambda df, df2: mt.positions_per_order_over_time(df, df2, time_col="CRMEingangszeit"), ["df", "df2"]),
+    MetricTask("metric_error_heatmap", lambda df: mt.error_frequency_by_weekday_hour(df, time_col="CRMEingangszeit"), ["df"]),
+    MetricTask("handwerker_outlier_stats", lambda df: handwerker_gewerke_outlier(df, return_matrix=True)[0], ["df"]),
+    MetricTask("metric_handwerker_outliers", flag_handwerker_outliers, ["handwerker_outlier_stats"]),
+    # page3 top charts, from the Handwerker x Gewerk count matrix
+    MetricTask(["metric_outlier_hotspots_gewerk", "metric_outlier_hotspots_handwerker"],
+               lambda df: mt.outlier_hotspots(handwerker_gewerke_outlier(df, return_matrix=True)[1]), ["df"]),
+    MetricTask("metric_outliers_by_damage", mt.outliers_by_damage, ["df"]),
+    # similarity of every distinct Gewerk/Handwerker pair (input of metric_semantic_mismatches, always computed on the full data)
+    MetricTask("metric_semantic_pair_scores", semantic_pair_scores, ["df"]),
+    # page4 Tab 2, 4 and 5
+    MetricTask("metric_discount_stats", lambda df2: discount_details(df2)[0], ["df2"]),
+    MetricTask("metric_fn_stats_df1", lambda df: false_negative_df1(df)[0], ["df"]),
+    MetricTask("metric_fn_stats_df2", lambda df2: false_negative_df2(df2)[0], ["df2"]),
+    # page5 Schnellvergleich: monthly sketches of the drift columns (schema_df/schema_df2)
+    MetricTask(["metric_drift_histograms", "metric_drift_bins", "metric_drift_categories"], ddm.drift_sketches, ["df", "df2"]),
+]
+
+# --engine sql: metrics that are computed by DuckDB directly on the tables 'auftragsdaten'/'positionsdaten' (see metrics_sql.py)
+# instead of pandas. They replace the task with the same name in METRIC_TASKS, inputs are the connection and table names.
+sql_plausibility_check = metric_cache.wrap(ms.plausibilitaetscheck_forderung_einigung)
+sql_proformabelege = metric_cache.wrap(ms.proformabelege)
+sql_discount_details = metric_cache.wrap(ms.discount_details)
+sql_false_negative_df1 = metric_cache.wrap(ms.false_negative_df1)
+sql_false_negative_df2 = metric_cache.wrap(ms.false_negative_df2)
+
+SQL_METRIC_TASKS = [
+    # --- scalar metrics ---
+    MetricTask(["count_plausibility_errors_df", "avg_plausibility_diff_df"], lambda con, table: sql_plausibility_check(con, table)[1:], ["con", "auftragsdaten"]),
+    MetricTask(["count_plausibility_errors_df2", "avg_plausibility_diff_df2"], lambda con, table: sql_plausibility_check(con, table)[1:], ["con", "positionsdaten"]),
+    MetricTask("count_proforma_receipts", lambda con, table: sql_proformabelege(con, table)[1], ["con", "auftragsdaten"]),
+
+    # --- detail tables (ROW_METRIC_KEYS) ---
+    MetricTask("metric_plausibility_diffs_auftragsdaten", lambda con, table: sql_plausibility_check(con, table)[0], ["con", "auftragsdaten"]),
+    MetricTask("metric_plausibility_diffs_positionsdaten", lambda con, table: sql_plausibility_check(con, table)[0], ["con", "positionsdaten"]),
+    MetricTask("metric_proforma", lambda con, table: sql_proformabelege(con, table)[0], ["con", "auftragsdaten"]),
+    MetricTask("metric_above_50k", ms.above_50k, ["con", "auftragsdaten"]),
+    MetricTask("metric_zeitwert_errors", ms.check_zeitwert, ["con", "auftragsdaten"]),
+    MetricTask("metric_order_pos_mismatch", ms.abgleich_auftraege, ["con", "auftragsdaten", "positionsdaten"]),
+    MetricTask("metric_position_count_positionsdaten", ms.position_count, ["con", "positionsdaten"]),
+    MetricTask("metric_discount_details", lambda con, table: sql_discount_details(con, table)[1], ["con", "positionsdaten"]),
+    MetricTask("metric_fn_details_df1", lambda con, table: sql_false_negative_df1(con, table)[1], ["con", "auftragsdaten"]),
+    MetricTask("metric_fn_details_df2", lambda con, table: sql_false_negative_df2(con, table)[1], ["con", "positionsdaten"]),
+
+    # --- aggregate tables ---
+    MetricTask(["metric_cleanliness_rows_grouped_auftragsdaten", "metric_cleanliness_cols_grouped_auftragsdaten"],
+               lambda con, table: cleanliness_tables(*ms.data_cleanliness(con, table, group_by_col="Kundengruppe")), ["con", "auftragsdaten"]),
+    MetricTask("metric_error_heatmap", ms.error_frequency_by_weekday_hour, ["con", "auftragsdaten"]),
+    MetricTask("metric_discount_stats", lambda con, table: sql_discount_details(con, table)[0], ["con", "positionsdaten"]),
+    MetricTask("metric_fn_stats_df1", lambda con, table: sql_false_negative_df1(con, table)[0], ["con", "auftragsdaten"]),
+    MetricTask("metric_fn_stats_df2", lambda con, table: sql_false_negative_df2(con, table)[0], ["con", "positionsdaten"]),
+]
+
+# columns of the table 'scalar_metrics'
+SCALAR_METRICS = [
+    # General
+    'count_total_orders', 'count_total_positions', 'count_empty_orders',
     # Quality
-    'null_row_ratio_orders': [null_ratio_orders],
-    'null_row_ratio_positions': [null_ratio_positions],
-    'is_unique_kva_id': [unique_kva],
-    'is_unique_kva_nr_per_land': [unique_kva_nr_land],
-    'is_unique_position_id': [unique_pos],
-
+    'null_row_ratio_orders', 'null_row_ratio_positions', 'is_unique_kva_id', 'is_unique_kva_nr_per_land', 'is_unique_position_id',
     # Test Data
-    'count_test_data_rows': [test_data_count],
-
+    'count_test_data_rows',
     # Logic Errors
-    'count_plausibility_errors_df': [plausibility_error_count_df],
-    'avg_plausibility_diff_df': [plausibility_avg_diff_df],
-    'count_plausibility_errors_df2': [plausibility_error_count_df2],
-    'avg_plausibility_diff_df2': [plausibility_avg_diff_df2],
-    'count_proforma_receipts': [proforma_count],
-    'count_discount_logic_errors': [discount_logic_errors],
-}
-
-df_scalars = pd.DataFrame(kpi_data)
-
-print("--- Step 6: Saving to DuckDB ---")
-con.execute("CREATE OR REPLACE TABLE scalar_metrics AS SELECT * FROM df_scalars")
-
-
-print("--- Step 7: Computing Complex Metrics and Creating Tables ---")
-
-# Null Ratios per Column (Returns DataFrame)
-print("1. Null Ratios")
-df_null_ratios = mt.ratio_null_values_column(df)
-con.execute("CREATE OR REPLACE TABLE metric_null_ratios_per_column AS SELECT * FROM df_null_ratios")
-
-# Test Data Entries (Returns (int, DataFrame) -> we want the DF)
-print("2. Test Data Check")
-df_test_rows = mt.Kundengruppe_containing_test(df, return_frame=True)
-con.execute("CREATE OR REPLACE TABLE metric_test_data_entries AS SELECT * FROM df_test_rows")
-
-# Plausibility Check (Returns (DataFrame, int, avg) -> only extract the DataFrame)
-print("3. Plausibility Differences")
-df_plausi_df, _, _ = mt.plausibilitaetscheck_forderung_einigung(df)
-con.execute("CREATE OR REPLACE TABLE metric_plausibility_diffs_auftragsdaten AS SELECT * FROM df_plausi_df")
-
-df_plausi_df2, _, _ = mt.plausibilitaetscheck_forderung_einigung(df2)
-con.execute("CREATE OR REPLACE TABLE metric_plausibility_diffs_positionsdaten AS SELECT * FROM df_plausi_df2")
-
-# Data Cleanliness Grouped (Returns (Series, DataFrame))
-print("4. Data Cleanliness Grouped")
-series_row_ratios_grouped_df, df_col_ratios_grouped_df = mt.data_cleanliness(df, group_by_col="Kundengruppe")
-
-# Reset index to make 'Kundengruppe' a real column
-con.execute("CREATE OR REPLACE TABLE metric_cleanliness_cols_grouped_auftragsdaten AS SELECT * FROM df_col_ratios_grouped_df")
-
-# Handle the Series part (Rows)
-df_clean_rows_df = series_row_ratios_grouped_df.to_frame(name='row_null_ratio').reset_index()
-con.execute("CREATE OR REPLACE TABLE metric_cleanliness_rows_grouped_auftragsdaten AS SELECT * FROM df_clean_rows_df")
-
-
-print("5. Data Cleanliness Ungrouped")
-_, df_col_ratios_ungrouped_df = mt.data_cleanliness(df, group_by_col=None)
-df_col_ratios_ungrouped_df = df_col_ratios_ungrouped_df.rename(columns={'index': 'column_name'})
-con.execute("CREATE OR REPLACE TABLE metric_cleanliness_cols_ungrouped_auftragsdaten AS SELECT * FROM df_col_ratios_ungrouped_df")
-
-_, df_col_ratios_ungrouped_df2 = mt.data_cleanliness(df2, group_by_col=None)
-df_col_ratios_ungrouped_df2 = df_col_ratios_ungrouped_df2.rename(columns={'index': 'column_name'})
-con.execute("CREATE OR REPLACE TABLE metric_cleanliness_cols_ungrouped_positionsdaten AS SELECT * FROM df_col_ratios_ungrouped_df2")
-
-
-# Proforma Receipts Returns (DataFrame, int)
-print("6. Proforma Receipts")
-df_proforma, _ = mt.proformabelege(df)
-con.execute("CREATE OR REPLACE TABLE metric_proforma AS SELECT * FROM df_proforma")
-
-# High Value > 50k (Returns DataFrame)
-print("7. Suspiciously high Value")
-df_above_50k = mt.above_50k(df)
-con.execute("CREATE OR REPLACE TABLE metric_above_50k AS SELECT * FROM df_above_50k")
-
-# Zeitwert Errors (Returns Series -> Convert to DF)
-print("8. Zeitwert Errors")
-zeitwert = mt.check_zeitwert(df)
-#df_zeitwert = zeitwert.to_frame(name='zeitwert_diff')
-con.execute("CREATE OR REPLACE TABLE metric_zeitwert_errors AS SELECT * FROM zeitwert")
-
-# Positions over Time (Returns DataFrame)
-print("9. Positions Over Time")
-df_pos_time = mt.positions_per_order_over_time(df, df2, time_col="CRMEingangszeit")
-con.execute("CREATE OR REPLACE TABLE metric_positions_over_time AS SELECT * FROM df_pos_time")
-
-# Error Frequency Heatmap (Returns DataFrame)
-print("10. Error Frequency Heatmap")
-df_heatmap = mt.error_frequency_by_weekday_hour(df, time_col="CRMEingangszeit")
-con.execute("CREATE OR REPLACE TABLE metric_error_heatmap AS SELECT * FROM df_heatmap")
-
-# Order vs Position Financial Mismatch (Returns DataFrame)
-print("11. Order/Position Mismatch")
-df_mismatch = mt.abgleich_auftraege(df, df2)
-con.execute("CREATE OR REPLACE TABLE metric_order_pos_mismatch AS SELECT * FROM df_mismatch")
-
-# Handwerker Outliers (Returns DataFrame)
-print("12. Handwerker Outliers")
-df_outlier = mt.handwerker_gewerke_outlier(df)
-df_outliers_true = df_outlier[df_outlier['is_outlier'] == True].copy()
-df_outliers_true['Check_Result'] = mt.check_keywords(df_outliers_true)
-con.execute("CREATE OR REPLACE TABLE metric_handwerker_outliers AS SELECT * FROM df_outliers_true")
-
-# Semantic Handwerker Mismatches (Returns DataFrame)
-print("13. Semantic Handwerker Mismatches")
-df_semantic = mt.mismatched_entries(df)
-con.execute("CREATE OR REPLACE TABLE metric_semantic_mismatches AS SELECT * FROM df_semantic")
-
-# Optional: Leere Tabelle in DB anlegen, falls mt.get_mismatched_entries(df) nicht ausgeführt werden kann (wenn dependencies oder ressourcen für classifer nicht gegeben)
-#df_semantic = []
-#con.execute("CREATE OR REPLACE TABLE metric_semantic_mismatches AS SELECT 'dummy' as col1 WHERE 1=0")
-
-print("14. Calculate Position count")
-position_count_df2 = mt.position_count(df2)
-con.execute("CREATE OR REPLACE TABLE metric_position_count_positionsdaten AS SELECT * FROM position_count_df2")
-
-print("15. Empty Orders Details")
-con.execute("CREATE OR REPLACE TABLE metric_empty_orders_dataframe AS SELECT * FROM empty_orders_df")
-
-print("16. Outliers by Damage")
-outliers_by_damage = mt.outliers_by_damage(df)
-con.execute("CREATE OR REPLACE TABLE metric_outliers_by_damage AS SELECT * FROM outliers_by_damage")
-
-print("Calculating Extended Chart Data...")
-# page4 Tab 2
-disc_stats, disc_details = mt.discount_details(df2)
-con.execute("CREATE OR REPLACE TABLE metric_discount_stats AS SELECT * FROM disc_stats")
-con.execute("CREATE OR REPLACE TABLE metric_discount_details AS SELECT * FROM disc_details")
-
-# page4 Tab 4
-fn_stats1, fn_details1 = mt.false_negative_df1(df)
-con.execute("CREATE OR REPLACE TABLE metric_fn_stats_df1 AS SELECT * FROM fn_stats1")
-con.execute("CREATE OR REPLACE TABLE metric_fn_details_df1 AS SELECT * FROM fn_details1")
-
-# page4 Tab 5
-fn_stats2, fn_details2 = mt.false_negative_df2(df2)
-con.execute("CREATE OR REPLACE TABLE metric_fn_stats_df2 AS SELECT * FROM fn_stats2")
-con.execute("CREATE OR REPLACE TABLE metric_fn_details_df2 AS SELECT * FROM fn_details2")
-
-print("--- Step 8: Calculating overall Issue Metric ---")
-numeric_issues = len(zeitwert) + len(df_above_50k) + len(df_mismatch)
-text_issues = test_data_count + len(df_outliers_true) + len(df_semantic)
-plausi_issues = plausibility_error_count_df + plausibility_error_count_df2 + discount_logic_errors + proforma_count + len(fn_details1) + len(fn_details2) + empty_orders_count
-overall_issues = numeric_issues + text_issues + plausi_issues + len(df_uniq_problem)
-
-issues = {
-    'numeric_issues': [numeric_issues],
-    'text_issues': [text_issues],
-    'plausi_issues': [plausi_issues],
-    'overall_issues': [overall_issues],
-    'count_zeitwert_errors': [len(zeitwert)],
-    'count_above_50k': [len(df_above_50k)],
-    'count_handwerker_outliers': [len(df_outliers_true)],
-    'count_semantic_outliers': [len(df_semantic)],
-    'count_abweichung_summen': [len(df_mismatch)],
-    'count_plausibility_errors_df': [plausibility_error_count_df],
-    'count_plausibility_errors_df2': [plausibility_error_count_df2],
-    'count_false_negative_df': [len(fn_details1)],
-    'count_false_negative_df2': [len(fn_details2)],
-}
-# The values from count_zeitwert_errors to count_false_negative_df2 are stored here due to practicality. They are used for the Trend Analysis
-df_issues = pd.DataFrame(issues)
-print(df_issues)
-con.execute("CREATE OR REPLACE TABLE issues AS SELECT * FROM df_issues")
-
-
-print("--- Step 9: Comparing with Old Database (Metric Trends) ---")
-
-df_new_combined = pd.concat([df_scalars, df_issues], axis=1)
-df_comparison = df_new_combined.T.reset_index()
-df_comparison.columns = ['Metric', 'Current_Value']
-
-df_old_combined = pd.DataFrame()
-
-if os.path.exists(DB_OLD_PATH):
-    try:
-        con_old = duckdb.connect(DB_OLD_PATH, read_only=True)
-
-        tables_old = con_old.execute("SHOW TABLES").df()['name'].tolist()
-
-        old_scalars = pd.DataFrame()
-        old_issues = pd.DataFrame()
-
-        if 'scalar_metrics' in tables_old:
-            old_scalars = con_old.execute("SELECT * FROM scalar_metrics").df()
+    'count_plausibility_errors_df', 'avg_plausibility_diff_df', 'count_plausibility_errors_df2', 'avg_plausibility_diff_df2',
+    'count_proforma_receipts', 'count_discount_logic_errors',
+]
 
-        if 'issues' in tables_old:
-            old_issues = con_old.execute("SELECT * FROM issues").df()
 
-        con_old.close()
+def update_cleaned_data(con, delta_ids, stale_ids, profiler=None):
+    """Incremental Step 2/3: cleans the delta and applies it to the tables 'auftragsdaten' and 'positionsdaten' in place.
 
-        if not old_scalars.empty or not old_issues.empty:
-            df_old_combined = pd.concat([old_scalars, old_issues], axis=1)
+    Only the raw rows of the delta are loaded (from the views of cleaning_sql.create_raw_views). The rows of changed and
+    removed orders are deleted from the tables and the newly cleaned rows appended (update_table), the kept rows stay in DuckDB.
 
-    except Exception as e:
-        print(f"WARNING: Can not read old database: {e}")
-else:
-    print("No old database found (first run?). Comparison values are 0.")
+    Returns
+    -------
+    df_delta, df2_delta: pandas.DataFrame
+        cleaned Auftrags- and Positionsdaten of the delta
+    """
+    stale_frame = stale_ids.to_frame()
+    delta_frame = delta_ids.to_frame()
+    con.execute("CREATE OR REPLACE TEMP TABLE stale_ids AS SELECT * FROM stale_frame")
+    con.execute("CREATE OR REPLACE TEMP TABLE delta_ids AS SELECT * FROM delta_frame")
+    # positions of stale orders, needed after their rows have been deleted from 'positionsdaten' (see merge_row_metric_table)
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE stale_position_ids AS
+        SELECT p.Position_ID FROM positionsdaten p SEMI JOIN stale_ids s ON p.KvaRechnung_ID IS NOT DISTINCT FROM s.KvaRechnung_ID
+    """)
 
+    if delta_ids.empty: # orders were only removed
+        df_delta = df2_delta = pd.DataFrame()
+    else:
+        auftragsdaten, positionsdaten, zeitdaten = (
+            fetch_df(con, f"SELECT r.* FROM raw_{name} r SEMI JOIN delta_ids d ON r.KvaRechnung_ID IS NOT DISTINCT FROM d.KvaRechnung_ID")
+            for name in ("auftragsdaten", "positionsdaten", "zeitdaten"))
+        df_delta, df2_delta = dc.data_cleaning(auftragsdaten, positionsdaten, zeitdaten, profiler=profiler)
 
-if not df_old_combined.empty:
-    df_old_long = df_old_combined.T.reset_index()
-    df_old_long.columns = ['Metric', 'Old_Value']
+    update_table(con, "auftragsdaten", "KvaRechnung_ID", "stale_ids", df_delta)
+    update_table(con, "positionsdaten", "KvaRechnung_ID", "stale_ids", df2_delta)
+    return df_delta, df2_delta
 
-    df_comparison = pd.merge(df_comparison, df_old_long, on='Metric', how='left')
 
-    df_comparison['Old_Value'] = df_comparison['Old_Value'].fillna(0)
+def merge_row_metric_table(con, table, new_rows):
+    """Incremental Step 4: removes rows of changed/removed orders from a row-level metric table and appends the rows computed on the delta.
 
-else:
-    df_comparison['Old_Value'] = 0.0
+    Positions are matched to their orders via the temporary table 'stale_position_ids', which is created before the rows of
+    'positionsdaten' are deleted.
+    """
+    key = ROW_METRIC_KEYS[table]
+    update_table(con, table, key, "stale_position_ids" if key == "Position_ID" else "stale_ids", new_rows)
+    if table == "metric_semantic_mismatches":
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} ORDER BY Similarity_Score")
 
-df_comparison['Current_Value'] = pd.to_numeric(df_comparison['Current_Value'], errors='coerce').fillna(0)
-df_comparison['Old_Value'] = pd.to_numeric(df_comparison['Old_Value'], errors='coerce').fillna(0)
 
-df_comparison['Absolute_Change'] = df_comparison['Current_Value'] - df_comparison['Old_Value']
+def compare_with_old_database(df_scalars, df_issues, old_db_path):
+    """Step 7: compares all scalar metrics and issue counts with the values of the previous database version (metric trends)."""
+    df_new_combined = pd.concat([df_scalars, df_issues], axis=1)
+    df_comparison = df_new_combined.T.reset_index()
+    df_comparison.columns = ['Metric', 'Current_Value']
 
-#Helper function for percentage difference
-def calc_percent(row):
-    old = row['Old_Value']
-    new = row['Current_Value']
-    diff = row['Absolute_Change']
+    df_old_combined = pd.DataFrame()
 
-    if old == 0:
-        if new == 0:
-            return 0.0
+    if old_db_path and os.path.exists(old_db_path):
+        try:
+            con_old = duckdb.connect(old_db_path, read_only=True)
+
+            tables_old = con_old.execute("SHOW TABLES").df()['name'].tolist()
+
+            old_scalars = pd.DataFrame()
+            old_issues = pd.DataFrame()
+
+            if 'scalar_metrics' in tables_old:
+                old_scalars = con_old.execute("SELECT * FROM scalar_metrics").df()
+
+            if 'issues' in tables_old:
+                old_issues = con_old.execute("SELECT * FROM issues").df()
+
+            con_old.close()
+
+            if not old_scalars.empty or not old_issues.empty:
+                df_old_combined = pd.concat([old_scalars, old_issues], axis=1)
+
+        except Exception as e:
+            print(f"WARNING: Can not read old database: {e}")
+    else:
+        print("No old database found (first run?). Comparison values are 0.")
+
+
+    if not df_old_combined.empty:
+        df_old_long = df_old_combined.T.reset_index()
+        df_old_long.columns = ['Metric', 'Old_Value']
+
+        df_comparison = pd.merge(df_comparison, df_old_long, on='Metric', how='left')
+
+        df_comparison['Old_Value'] = df_comparison['Old_Value'].fillna(0)
+
+    else:
+        df_comparison['Old_Value'] = 0.0
+
+    df_comparison['Current_Value'] = pd.to_numeric(df_comparison['Current_Value'], errors='coerce').fillna(0)
+    df_comparison['Old_Value'] = pd.to_numeric(df_comparison['Old_Value'], errors='coerce').fillna(0)
+
+    df_comparison['Absolute_Change'] = df_comparison['Current_Value'] - df_comparison['Old_Value']
+
+    #Helper function for percentage difference
+    def calc_percent(row):
+        old = row['Old_Value']
+        new = row['Current_Value']
+        diff = row['Absolute_Change']
+
+        if old == 0:
+            if new == 0:
+                return 0.0
+            else:
+                return 100.0
+
+        return (diff / old) * 100
+
+    df_comparison['Percent_Change'] = df_comparison.apply(calc_percent, axis=1).round(2)
+
+    df_comparison = df_comparison.sort_values('Metric')
+    return df_comparison
+
+
+def main(incremental=False, jobs=1, executor="thread", engine="pandas", profile_memory=False, cleaning="pandas", use_cache=True,
+         semantic_backend="torch"):
+    # the build is written into a new version, the published one stays untouched (and readable by the dashboard) until Step 8
+    old_db_path = db_io.current_db_path()
+    if incremental and old_db_path is None:
+        print("No existing database found, falling back to a full build.")
+        incremental = False
+
+    # Initialize timer for script performance measurement/feedback
+    start_time = time.time()
+    profiler = BuildProfiler(trace_memory=profile_memory)
+
+    # the SQL cleaning writes complete tables, incremental builds clean the (small) delta with pandas
+    sql_cleaning = cleaning == "sql" and not incremental
+    if cleaning == "sql" and incremental:
+        print("--cleaning sql is only used for full builds, the delta is cleaned with pandas.")
+
+    #raw data is loaded from (parquet) files defined in the data_cleaning module
+    print("--- Step 1: Loading Data ---")
+    # the raw files are hashed in DuckDB first, the data is only loaded if (and as far as) it has to be cleaned (Step 2)
+    print("Raw data is read by DuckDB, it is loaded only if it has to be cleaned.")
+    auftragsdaten = positionsdaten = zeitdaten = None
+
+    if incremental:
+        con = duckdb.connect(old_db_path, read_only=True)
+        tables = con.execute("SHOW TABLES").df()['name'].tolist()
+        if not {'build_state', 'build_fingerprints'}.issubset(tables):
+            print("Existing database has no build state (built by an older version?), falling back to a full build.")
+            con.close()
+            incremental = False
+
+    db_path = new_db_path()
+    if incremental:
+        with profiler.step("fingerprints and delta") as step:
+            cleaning_sql.create_raw_views(con)
+            fingerprints = compute_fingerprints(con)
+            delta_ids, stale_ids = find_delta(con, fingerprints)
+            step["rows_out"] = len(delta_ids) + len(stale_ids)
+        print(f"Delta: {len(delta_ids)} new or changed orders, {len(stale_ids)} orders to replace or remove.")
+        con.close()
+        if delta_ids.empty and stale_ids.empty:
+            print("No changes since the last build, database is up to date.")
+            return
+
+        # the new version starts as a copy of the published one and is updated in place
+        shutil.copy2(old_db_path, db_path)
+        print(f"Existing DB copied to: {db_path}")
+        con = duckdb.connect(db_path)
+        cleaning_sql.create_raw_views(con)
+
+        print("--- Step 2: Merging & Cleaning (Delta) ---")
+        with profiler.step("cleaning (delta)", rows_in=len(delta_ids)) as step:
+            df_delta, df2_delta = update_cleaned_data(con, delta_ids, stale_ids, profiler)
+            step["rows_out"] = len(df_delta) + len(df2_delta)
+        # loaded from the updated tables in Step 4 if a metric has to be computed on the full data
+        df = df2 = None
+    else:
+        #Establish connection to (as of yet empty) new database version
+        print(f"Building new database: {db_path}")
+        con = duckdb.connect(db_path)
+        cleaning_sql.create_raw_views(con)
+        with profiler.step("fingerprints") as step:
+            fingerprints = compute_fingerprints(con)
+            step["rows_out"] = len(fingerprints)
+        # key of the cleaned data: content of the raw data and code of the cleaning (build_cache.py)
+        cleaned_key = build_cache.make_key(build_cache.data_fingerprint(fingerprints),
+                                           [build_cache.code_fingerprint(f) for f in CLEANING_FUNCTIONS])
+        previous_keys = build_cache.previous_keys(old_db_path) if use_cache else {}
+        reuse_previous = previous_keys.get(build_cache.CLEANED_DATA) == cleaned_key
+
+        #raw data is prepared (details in data_cleaning / cleaning_sql)
+        print("--- Step 2: Merging & Cleaning ---")
+        if reuse_previous:
+            # the new version starts as a copy of the previous one, unchanged metrics are kept as well (Step 4)
+            print(f"Raw data and cleaning unchanged, the cleaned data is taken from {old_db_path}.")
+            with profiler.step("cleaning (cached)"):
+                con.close()
+                shutil.copy2(old_db_path, db_path)
+                con = duckdb.connect(db_path)
+            # loaded from the tables in Step 4 if a metric has to be computed
+            df = df2 = None
+        elif sql_cleaning:
+            with profiler.step("cleaning (sql)") as step:
+                cleaning_sql.data_cleaning(con)
+                # the pandas metrics work on the cleaned tables
+                df = fetch_df(con, "SELECT * FROM auftragsdaten", nullable_int=True)
+                df2 = fetch_df(con, "SELECT * FROM positionsdaten", nullable_int=True)
+                step["rows_out"] = len(df) + len(df2)
         else:
-            return 100.0
-
-    return (diff / old) * 100
-
-df_comparison['Percent_Change'] = df_comparison.apply(calc_percent, axis=1).round(2)
-
-df_comparison = df_comparison.sort_values('Metric')
-
-print("Comparison table created:")
-print(df_comparison[['Metric', 'Current_Value', 'Old_Value', 'Percent_Change']].head())
-
-con.execute("CREATE OR REPLACE TABLE metric_comparison AS SELECT * FROM df_comparison")
-
-
-print("\n--- All Complex Metrics Saved Successfully ---")
-end_time = time.time()
-print(f"Berechnungsdauer: {end_time - start_time:.2f} Sekunden")
-tables = con.execute("SHOW TABLES").df()
-print(tables)
-con.close()
-
-# Optional: Aufräumen der alten Datenbank nach erfolgreicher Erstellung der neuen
-# print("--- Step 10: Cleaning up ---")
-# if os.path.exists(DB_OLD_PATH):
-#     try:
-#         os.remove(DB_OLD_PATH)
-#         print(f"Old backup deleted: {DB_OLD_PATH}")
-#     except Exception as e:
-#         print(f"WARNING: Could not delete old database: {e}")
\ No newline at end of file
+            with profiler.step("load data") as step:
+                auftragsdaten, positionsdaten, zeitdaten = dc.load_data()
+                step["rows_out"] = len(auftragsdaten) + len(positionsdaten) + len(zeitdaten)
+            with profiler.step("cleaning", rows_in=len(auftragsdaten) + len(positionsdaten)) as step:
+                df, df2 = dc.data_cleaning(auftragsdaten, positionsdaten, zeitdaten, profiler=profiler)
+                step["rows_out"] = len(df) + len(df2)
+
+    # raw data is no longer needed
+    del auftragsdaten, positionsdaten, zeitdaten
+
+    print("--- Step 3: Building DuckDB Database ---")
+    if df is None or sql_cleaning:
+        print("Auftragsdaten and Positionsdaten have already been written (SQL cleaning, copied or updated in place).")
+    else:
+        with profiler.step("save cleaned data", rows_in=len(df) + len(df2)):
+            # Store the "Original" Cleaned Data
+            print("Saving (Auftragsdaten)...")
+            con.execute("CREATE OR REPLACE TABLE auftragsdaten AS SELECT * FROM df")
+
+            print("Saving (Positionsdaten)...")
+            con.execute("CREATE OR REPLACE TABLE positionsdaten AS SELECT * FROM df2")
+
+    if engine == "sql" and executor == "process":
+        # forked workers can not share the DuckDB connection, DuckDB parallelises the SQL metrics itself
+        print("The SQL engine runs in threads, --executor process is ignored.")
+        executor = "thread"
+
+    print(f"--- Step 4: Computing Metrics and Creating Tables ({engine} engine, {jobs} {executor} worker(s)) ---")
+    results = {}
+
+    def save_result(name, value):
+        """Called for every result as soon as it is computed, metric tables are saved right away."""
+        if name in TIME_SORTED_TABLES and not value.empty:
+            value = value.sort_values("CRMEingangszeit", kind="stable", na_position="last", ignore_index=True)
+        if incremental and name in ROW_METRIC_KEYS:
+            # only the rows of the delta, the table is updated in place (Step 6 counts its rows in the database)
+            merge_row_metric_table(con, name, value)
+            return
+        results[name] = value
+        # intermediate DataFrames (e.g. handwerker_outlier_stats) are stored as well, so the result cache can restore them
+        if name.startswith("metric_") or (name not in SCALAR_METRICS and isinstance(value, pd.DataFrame)):
+            con.register("table_df", value)
+            con.execute(f"CREATE OR REPLACE TABLE {build_cache.cache_table(name)} AS SELECT * FROM table_df")
+            con.unregister("table_df")
+
+    tasks = METRIC_TASKS
+    inputs = {"df": df, "df2": df2}
+    if engine == "sql":
+        sql_tasks = {t.name: t for t in SQL_METRIC_TASKS}
+        tasks = [sql_tasks.get(t.name, t) for t in tasks]
+        inputs.update({"con": con, "auftragsdaten": "auftragsdaten", "positionsdaten": "positionsdaten"})
+    if semantic_backend != "torch":
+        tasks = [MetricTask(t.outputs, lambda df: semantic_pair_scores(df, backend=semantic_backend), t.inputs)
+                 if t.name == "metric_semantic_pair_scores" else t for t in tasks]
+
+    delta_tables = []
+    if incremental:
+        # row-level tables are computed on the delta only and merged into the existing tables
+        row_tasks = [t for t in tasks if t.name in ROW_METRIC_KEYS]
+        tasks = [t for t in tasks if t.name not in ROW_METRIC_KEYS]
+        if df_delta.empty: # orders were only removed
+            for t in row_tasks:
+                save_result(t.name, pd.DataFrame())
+        else:
+            tasks += [t.rebind({"df": "df_delta", "df2": "df2_delta", "auftragsdaten": "auftragsdaten_delta", "positionsdaten": "positionsdaten_delta"})
+                      for t in row_tasks]
+            inputs.update({"df_delta": df_delta, "df2_delta": df2_delta})
+            if engine == "sql":
+                # (non-temporary) tables, temporary tables are not visible to the cursors of the SQL metrics
+                con.execute("CREATE OR REPLACE TABLE build_delta_auftragsdaten AS SELECT * FROM df_delta")
+                con.execute("CREATE OR REPLACE TABLE build_delta_positionsdaten AS SELECT * FROM df2_delta")
+                delta_tables = ["build_delta_auftragsdaten", "build_delta_positionsdaten"]
+                inputs.update({"auftragsdaten_delta": "build_delta_auftragsdaten", "positionsdaten_delta": "build_delta_positionsdaten"})
+    else:
+        task_keys = build_cache.task_keys(tasks, {name: cleaned_key for name in inputs})
+        table_keys = build_cache.table_keys(tasks, task_keys, cleaned_key, SCALAR_METRICS)
+        if reuse_previous:
+            # tasks whose key (cleaned data, code, inputs) is unchanged keep their tables/scalars of the previous version
+            reused = build_cache.reusable_tasks(con, tasks, task_keys, previous_keys, SCALAR_METRICS)
+            build_cache.drop_stale_tables(con, [o for t in tasks for o in t.outputs])
+            tasks = [t for t in tasks if t not in reused]
+            reused_outputs = [o for t in reused for o in t.outputs]
+            results.update(build_cache.stored_scalars(con, [o for o in reused_outputs if o in SCALAR_METRICS]))
+            # stored results of reused tasks that are inputs of recomputed ones
+            for i in {i for t in tasks for i in t.inputs if i in reused_outputs}:
+                results[i] = inputs[i] = fetch_df(con, f"SELECT * FROM {build_cache.cache_table(i)}")
+            print(f"Unchanged metrics kept from {old_db_path}: {len(reused)} of {len(reused) + len(tasks)} tasks")
+    if df is None and any(i in ("df", "df2") for t in tasks for i in t.inputs):
+        # the cleaned data has been copied or updated in place, the pandas metrics on the full data work on the tables
+        with profiler.step("load cleaned data") as step:
+            df = inputs["df"] = fetch_df(con, "SELECT * FROM auftragsdaten", nullable_int=True)
+            df2 = inputs["df2"] = fetch_df(con, "SELECT * FROM positionsdaten", nullable_int=True)
+            step["rows_out"] = len(df) + len(df2)
+    rows_auftragsdaten, rows_positionsdaten = con.execute("SELECT (SELECT count(*) FROM auftragsdaten), (SELECT count(*) FROM positionsdaten)").fetchone()
+
+    with profiler.step("metrics", rows_in=rows_auftragsdaten + rows_positionsdaten):
+        task_profile = run_tasks(tasks, inputs, save_result, jobs=jobs, executor=executor)
+    for name, stats in task_profile.items():
+        profiler.add(name, "metric", stats)
+    for table in delta_tables:
+        con.execute(f"DROP TABLE {table}")
+    if metric_cache.misses: # with the process executor the caches live in the workers
+        print(f"Memoized metrics: {metric_cache.misses} computed, {metric_cache.hits} reused")
+    metric_cache.clear()
+
+    print("--- Step 5: Saving Scalar Metrics ---")
+    #aggregating of all scalar metrics computed in step 4 into a handy format for conversion to database table
+    with profiler.step("scalar metrics"):
+        df_scalars = pd.DataFrame({name: [results[name]] for name in SCALAR_METRICS})
+        con.execute("CREATE OR REPLACE TABLE scalar_metrics AS SELECT * FROM df_scalars")
+
+    print("--- Step 6: Calculating overall Issue Metric ---")
+
+    def row_count(name):
+        """Rows of a result; tables kept from the previous version (result cache) are counted in the database instead of being loaded."""
+        if name in results:
+            return len(results[name])
+        return con.execute(f"SELECT count(*) FROM {build_cache.cache_table(name)}").fetchone()[0]
+
+    count_zeitwert = row_count("metric_zeitwert_errors")
+    count_above_50k = row_count("metric_above_50k")
+    count_mismatch = row_count("metric_order_pos_mismatch")
+    count_outliers_true = row_count("metric_handwerker_outliers")
+    count_semantic = row_count("metric_semantic_mismatches")
+    count_fn_details1 = row_count("metric_fn_details_df1")
+    count_fn_details2 = row_count("metric_fn_details_df2")
+
+    numeric_issues = count_zeitwert + count_above_50k + count_mismatch
+    text_issues = results['count_test_data_rows'] + count_outliers_true + count_semantic
+    plausi_issues = results['count_plausibility_errors_df'] + results['count_plausibility_errors_df2'] + results['count_discount_logic_errors'] + results['count_proforma_receipts'] + count_fn_details1 + count_fn_details2 + results['count_empty_orders']
+    overall_issues = numeric_issues + text_issues + plausi_issues + row_count('uniqueness_problems')
+
+    issues = {
+        'numeric_issues': [numeric_issues],
+        'text_issues': [text_issues],
+        'plausi_issues': [plausi_issues],
+        'overall_issues': [overall_issues],
+        'count_zeitwert_errors': [count_zeitwert],
+        'count_above_50k': [count_above_50k],
+        'count_handwerker_outliers': [count_outliers_true],
+        'count_semantic_outliers': [count_semantic],
+        'count_abweichung_summen': [count_mismatch],
+        'count_plausibility_errors_df': [results['count_plausibility_errors_df']],
+        'count_plausibility_errors_df2': [results['count_plausibility_errors_df2']],
+        'count_false_negative_df': [count_fn_details1],
+        'count_false_negative_df2': [count_fn_details2],
+    }
+    # The values from count_zeitwert_errors to count_false_negative_df2 are stored here due to practicality. They are used for the Trend Analysis
+    df_issues = pd.DataFrame(issues)
+    print(df_issues)
+    con.execute("CREATE OR REPLACE TABLE issues AS SELECT * FROM df_issues")
+
+
+    print("--- Step 7: Comparing with Old Database (Metric Trends) ---")
+    with profiler.step("comparison with old database") as step:
+        df_comparison = compare_with_old_database(df_scalars, df_issues, old_db_path)
+        step["rows_out"] = len(df_comparison)
+
+    print("Comparison table created:")
+    print(df_comparison[['Metric', 'Current_Value', 'Old_Value', 'Percent_Change']].head())
+
+    con.execute("CREATE OR REPLACE TABLE metric_comparison AS SELECT * FROM df_comparison")
+
+    # watermark and fingerprints for the next incremental build
+    save_build_state(con, fingerprints, mode="incremental" if incremental else "full")
+    if incremental:
+        # the updated tables differ from a full build in row order, they are not reused (the keys copied with the database are outdated)
+        con.execute(f"DROP TABLE IF EXISTS {build_cache.KEY_TABLE}")
+        con.execute(f"DROP TABLE IF EXISTS {db_io.TABLE_KEYS}")
+    else:
+        build_cache.save_keys(con, {build_cache.CLEANED_DATA: cleaned_key, **task_keys})
+        build_cache.save_table_keys(con, table_keys)
+
+    # profile of this build, appended to the history of the previous versions
+    profiler.save(con, old_db_path, mode="incremental" if incremental else "full", engine=engine, jobs=jobs,
+                  executor=executor, rows_auftragsdaten=rows_auftragsdaten, rows_positionsdaten=rows_positionsdaten)
+
+    print("\n--- All Complex Metrics Saved Successfully ---")
+    end_time = time.time()
+    print(f"Berechnungsdauer: {end_time - start_time:.2f} Sekunden")
+    print("Slowest steps:")
+    print(profiler.summary().to_string())
+    tables = con.execute("SHOW TABLES").df()
+    print(tables)
+    con.close()
+
+    print("--- Step 8: Publishing ---")
+    publish_database(db_path)
+    # the previous version is kept for the next trend comparison and for dashboard sessions that are still reading it
+    remove_old_versions(keep=[db_path, old_db_path])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds a new version of the dashboard database (resources/dashboard_data_<version>.duckdb, published via resources/CURRENT).")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only clean and compute orders that are new or changed since the last build (CRMEingangszeit watermark and content fingerprints)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                        help="number of metrics computed in parallel (default: number of CPU cores, 1 = sequential)")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="run parallel metrics in threads (default) or in forked processes")
+    parser.add_argument("--engine", choices=["pandas", "sql"], default="pandas",
+                        help="compute the filter/aggregate metrics with pandas (default) or as DuckDB SQL on the saved tables (metrics_sql.py)")
+    parser.add_argument("--cleaning", choices=["pandas", "sql"], default="pandas",
+                        help="clean the raw data with pandas (default) or as DuckDB SQL over the parquet files (cleaning_sql.py, full builds only)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="trace the memory allocated by every step with tracemalloc (build_step_profile.traced_peak_mb), slows down the build")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="recompute the cleaned data and all metrics instead of copying unchanged results from the previous version")
+    parser.add_argument("--semantic-backend", choices=mt.SEMANTIC_BACKENDS, default="torch",
+                        help="inference backend of the semantic Gewerk/Handwerker check (default: torch; int8/onnx/onnx-int8 for CPU-only machines, see semantic_parity.py)")
+    args = parser.parse_args()
+    main(incremental=args.incremental, jobs=args.jobs, executor=args.executor, engine=args.engine, profile_memory=args.profile_memory,
+         cleaning=args.cleaning, use_cache=not args.no_cache, semantic_backend=args.semantic_backend)
@@ -0,0 +1,147 @@
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+
+try:
+    import resource # not available on Windows, peak RSS is not recorded there
+except ImportError:
+    resource = None
+
+"""
+Profiling of build_db.py runs. Every build step (loading, cleaning, saving, every metric task, ...) is recorded with
+wall time, CPU time, memory and the number of input/output rows. The records are stored in the database
+(tables 'build_runs' and 'build_step_profile') and carried over from the previous version, so the tables contain
+the history of all builds and regressions can be tracked across builds.
+
+Memory:
+    peak_rss_mb     high-water mark of the resident memory of the process at the end of the step
+    rss_growth_mb   how much the step raised this high-water mark (0 if it stayed below an earlier peak)
+    traced_peak_mb  peak of the memory allocated during the step (tracemalloc), only with --profile-memory.
+                    Not recorded for metric tasks running in parallel, as their allocations can not be told apart.
+"""
+
+RUN_COLUMNS = {
+    "run_id": "BIGINT", "started_at": "TIMESTAMP", "finished_at": "TIMESTAMP", "mode": "VARCHAR", "engine": "VARCHAR",
+    "jobs": "INTEGER", "executor": "VARCHAR", "wall_s": "DOUBLE", "cpu_s": "DOUBLE", "peak_rss_mb": "DOUBLE",
+    "rows_auftragsdaten": "BIGINT", "rows_positionsdaten": "BIGINT",
+}
+STEP_COLUMNS = {
+    "run_id": "BIGINT", "step_no": "INTEGER", "step": "VARCHAR", "kind": "VARCHAR", "wall_s": "DOUBLE", "cpu_s": "DOUBLE",
+    "peak_rss_mb": "DOUBLE", "rss_growth_mb": "DOUBLE", "traced_peak_mb": "DOUBLE", "rows_in": "BIGINT", "rows_out": "BIGINT",
+}
+
+
+def peak_rss_mb():
+    """Returns the high-water mark of the resident memory of the current process in MB (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def cpu_seconds():
+    """CPU time of the process and its finished child processes (e.g. workers of the process executor)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def count_rows(*values):
+    """Total number of rows of all DataFrames/Series among values, None if there are none."""
+    frames = [v for v in values if isinstance(v, (pd.DataFrame, pd.Series))]
+    return sum(len(v) for v in frames) if frames else None
+
+
+class BuildProfiler:
+    """Collects the profile of one build.
+
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        If True, allocations are traced with tracemalloc (noticeably slows down the build), by default False
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.steps = []
+        self.started_at = datetime.now()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = cpu_seconds()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def step(self, name, kind="step", rows_in=None):
+        """Measures the enclosed code as one step. The yielded dict can be used to set 'rows_out' (and 'rows_in').
+
+        Usage:
+            with profiler.step("cleaning", rows_in=len(df)) as step:
+                ...
+                step["rows_out"] = len(df_clean)
+        """
+        record = {"step": name, "kind": kind, "rows_in": rows_in, "rows_out": None}
+        # the step number is assigned at the start, so nested steps are listed after their parent
+        self.steps.append(record)
+        rss_before = peak_rss_mb()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        start_wall, start_cpu = time.perf_counter(), cpu_seconds()
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - start_wall
+            record["cpu_s"] = cpu_seconds() - start_cpu
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["rss_growth_mb"] = record["peak_rss_mb"] - rss_before if rss_before is not None else None
+            if self.trace_memory:
+                record["traced_peak_mb"] = (tracemalloc.get_traced_memory()[1] - traced_before) / 1024**2
+
+    def add(self, name, kind, stats):
+        """Adds a step measured elsewhere, e.g. the statistics of a metric task reported by build_scheduler.run_tasks."""
+        self.steps.append({"step": name, "kind": kind, **stats})
+
+    def save(self, con, old_db_path=None, **run_info):
+        """Writes the profile into build_runs / build_step_profile.
+
+        Parameters
+        ----------
+        con : duckdb.DuckDBPyConnection
+            connection to the new database version
+        old_db_path : str, optional
+            previous version, whose history is copied if the new version does not contain it yet (full builds), by default None
+        **run_info
+            further columns of build_runs (mode, engine, jobs, executor, rows_auftragsdaten, rows_positionsdaten)
+        """
+        tables = set(con.execute("SHOW TABLES").df()['name'])
+        for table, columns in (("build_runs", RUN_COLUMNS), ("build_step_profile", STEP_COLUMNS)):
+            if table not in tables:
+                con.execute(f"CREATE TABLE {table} ({', '.join(f'{c} {t}' for c, t in columns.items())})")
+                if old_db_path is not None:
+                    con.execute(f"ATTACH '{old_db_path}' AS previous_version (READ_ONLY)")
+                    try:
+                        if con.execute("SELECT count(*) FROM duckdb_tables() WHERE database_name = 'previous_version' AND table_name = ?",
+                                       [table]).fetchone()[0]:
+                            con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM previous_version.{table}")
+                    finally:
+                        con.execute("DETACH previous_version")
+
+        run_id = con.execute("SELECT coalesce(max(run_id), 0) + 1 FROM build_runs").fetchone()[0]
+        run = {**{c: None for c in RUN_COLUMNS}, **run_info, "run_id": run_id, "started_at": self.started_at,
+               "finished_at": datetime.now(), "wall_s": time.perf_counter() - self._start_wall,
+               "cpu_s": cpu_seconds() - self._start_cpu, "peak_rss_mb": peak_rss_mb()}
+        df_run = pd.DataFrame([run], columns=list(RUN_COLUMNS))
+        df_steps = pd.DataFrame(self.steps).reindex(columns=list(STEP_COLUMNS))
+        df_steps["run_id"] = run_id
+        df_steps["step_no"] = range(1, len(df_steps) + 1)
+        con.execute("INSERT INTO build_runs BY NAME SELECT * FROM df_run")
+        con.execute("INSERT INTO build_step_profile BY NAME SELECT * FROM df_steps")
+        return run_id
+
+    def summary(self, top=10):
+        """Returns the slowest steps as DataFrame (for the console output)."""
+        df = pd.DataFrame(self.steps)
+        return df.sort_values("wall_s", ascending=False).head(top)[["step", "kind", "wall_s", "cpu_s", "peak_rss_mb", "rows_in", "rows_out"]]
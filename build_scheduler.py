@@ -0,0 +1,230 @@
+import functools
+import multiprocessing
+import threading
+import time
+import tracemalloc
+import pandas as pd
+from build_profile import count_rows, peak_rss_mb
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+"""
+Small dependency-aware scheduler for the metric computations in build_db.py.
+
+Every metric is declared as a MetricTask with the names of its inputs and outputs. Inputs are either shared frames
+(e.g. 'df', 'df2') or outputs of other tasks. Tasks whose inputs are available run concurrently in a thread or process pool,
+results are handed back to the caller (in the main thread) as soon as a task finishes, together with the runtime
+statistics of the task (see build_profile.py).
+"""
+
+# State of the worker (thread pool: the calling process, process pool: set once per worker by _init_worker)
+_WORKER_STATE = {"tasks": {}, "inputs": {}, "sequential": False}
+
+
+class MetricTask:
+    """Declaration of one metric computation.
+
+    Parameters
+    ----------
+    outputs : str or list of str
+        Name(s) of the result(s). If more than one name is given, func has to return a tuple of the same length.
+        The first output name identifies the task.
+    func : callable
+        Function that computes the result(s), called with the values of inputs as positional arguments.
+    inputs : list of str
+        Names of shared inputs or outputs of other tasks.
+    """
+    def __init__(self, outputs, func, inputs):
+        self.outputs = [outputs] if isinstance(outputs, str) else list(outputs)
+        self.func = func
+        self.inputs = list(inputs)
+
+    @property
+    def name(self):
+        return self.outputs[0]
+
+    def rebind(self, mapping):
+        """Returns a copy of the task that reads its inputs from other sources, e.g. {'df': 'df_delta'}."""
+        return MetricTask(self.outputs, self.func, [mapping.get(i, i) for i in self.inputs])
+
+    def __repr__(self):
+        return f"MetricTask({self.outputs}, inputs={self.inputs})"
+
+
+class MetricCache:
+    """Memoization of metric functions for the duration of one build.
+
+    Results are keyed by function, arguments and the identity of DataFrame/Series arguments (the frames are not hashed,
+    they are assumed not to change during the build). Concurrent calls with the same key wait for the first one, so every
+    result is computed exactly once. Cached results are shared between callers and must not be modified in place.
+
+    With the process executor every worker has its own cache, duplicate calls are only shared within a worker.
+    """
+    def __init__(self):
+        self._results = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _arg_key(value):
+        if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+            return ("frame", id(value))
+        return value
+
+    def call(self, func, *args, **kwargs):
+        """Returns func(*args, **kwargs), computed at most once per key."""
+        key = (func,
+               tuple(self._arg_key(a) for a in args),
+               tuple(sorted((k, self._arg_key(v)) for k, v in kwargs.items())))
+        try:
+            hash(key)
+        except TypeError: # unhashable argument, e.g. a list -> no caching
+            return func(*args, **kwargs)
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self._results:
+                self.hits += 1
+                return self._results[key][0]
+            result = func(*args, **kwargs)
+            # the arguments are kept alive with the result, so their ids can not be reused by other objects
+            self._results[key] = (result, args, kwargs)
+            self.misses += 1
+            return result
+
+    def wrap(self, func):
+        """Returns a memoized version of func."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return wrapper
+
+    def clear(self):
+        """Drops all results (and the references to the input frames)."""
+        with self._lock:
+            self._results.clear()
+            self._key_locks.clear()
+
+
+def _init_worker(tasks, inputs, sequential=False):
+    _WORKER_STATE["tasks"] = tasks
+    _WORKER_STATE["inputs"] = inputs
+    _WORKER_STATE["sequential"] = sequential
+
+
+def _run_task(name, dependency_values):
+    """Executes a task inside a worker. Only the task name and the results of other tasks are passed between processes,
+    shared inputs are taken from the worker state.
+
+    Returns the outputs and the statistics of the task: wall and CPU time (of the executing thread), memory and the
+    number of rows of all DataFrame inputs and outputs. Allocations are only traced if the tasks run sequentially."""
+    task = _WORKER_STATE["tasks"][name]
+    values = {**_WORKER_STATE["inputs"], **dependency_values}
+    args = [values[i] for i in task.inputs]
+    trace = _WORKER_STATE["sequential"] and tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = peak_rss_mb()
+    start_wall, start_cpu = time.perf_counter(), time.thread_time()
+    result = task.func(*args)
+    stats = {"wall_s": time.perf_counter() - start_wall, "cpu_s": time.thread_time() - start_cpu}
+    if len(task.outputs) == 1:
+        result = (result,)
+    stats["peak_rss_mb"] = peak_rss_mb()
+    stats["rss_growth_mb"] = stats["peak_rss_mb"] - rss_before if rss_before is not None else None
+    stats["traced_peak_mb"] = (tracemalloc.get_traced_memory()[1] - traced_before) / 1024**2 if trace else None
+    stats["rows_in"] = count_rows(*args)
+    stats["rows_out"] = count_rows(*result)
+    return dict(zip(task.outputs, result)), stats
+
+
+def _create_executor(jobs, executor, tasks, inputs):
+    if executor == "process":
+        if "fork" in multiprocessing.get_all_start_methods():
+            # forked workers inherit tasks and shared frames without pickling them
+            return ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("fork"),
+                                       initializer=_init_worker, initargs=(tasks, inputs))
+        print("WARNING: process pool needs the 'fork' start method, which is not available on this platform. Using threads.")
+    _init_worker(tasks, inputs)
+    return ThreadPoolExecutor(max_workers=jobs)
+
+
+def run_tasks(tasks, inputs, on_result, jobs=1, executor="thread"):
+    """Runs all tasks as soon as their inputs are available and reports every output via on_result.
+
+    Parameters
+    ----------
+    tasks : list of MetricTask
+        tasks to run; with jobs=1 they are executed sequentially in the given order (as far as dependencies allow)
+    inputs : dict
+        shared inputs, name -> value
+    on_result : callable
+        called in the calling thread as on_result(output_name, value) for every output, in order of completion
+    jobs : int, optional
+        number of parallel workers, by default 1
+    executor : str, optional
+        'thread' or 'process', by default 'thread'
+
+    Returns
+    -------
+    dict
+        task name -> statistics of the task (wall_s, cpu_s, peak_rss_mb, rss_growth_mb, traced_peak_mb, rows_in, rows_out),
+        in order of completion
+    """
+    task_map = {t.name: t for t in tasks}
+    if len(task_map) != len(tasks):
+        raise ValueError("Task names (first output) must be unique.")
+
+    producers = {output: t.name for t in tasks for output in t.outputs}
+    missing = {i for t in tasks for i in t.inputs if i not in inputs and i not in producers}
+    if missing:
+        raise ValueError(f"No input or task provides: {sorted(missing)}")
+
+    # outputs that other tasks depend on are kept to be passed on
+    needed = {i for t in tasks for i in t.inputs if i in producers}
+    results = {}
+    pending = list(tasks)
+    profile = {}
+
+    def ready_tasks():
+        ready = [t for t in pending if all(i in inputs or i in results for i in t.inputs)]
+        for t in ready:
+            pending.remove(t)
+        return ready
+
+    def finish(name, outputs, stats):
+        profile[name] = stats
+        print(f"  done: {', '.join(outputs)} ({stats['wall_s']:.2f}s)")
+        for output, value in outputs.items():
+            if output in needed:
+                results[output] = value
+            on_result(output, value)
+
+    if jobs <= 1:
+        _init_worker(task_map, inputs, sequential=True)
+        while pending:
+            ready = ready_tasks()
+            if not ready:
+                raise ValueError(f"Circular dependencies between tasks: {pending}")
+            for t in ready:
+                outputs, stats = _run_task(t.name, {i: results[i] for i in t.inputs if i in results})
+                finish(t.name, outputs, stats)
+        return profile
+
+    with _create_executor(jobs, executor, task_map, inputs) as pool:
+        running = {}
+        while pending or running:
+            for t in ready_tasks():
+                future = pool.submit(_run_task, t.name, {i: results[i] for i in t.inputs if i in results})
+                running[future] = t.name
+            if not running:
+                raise ValueError(f"Circular dependencies between tasks: {pending}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                outputs, stats = future.result()
+                finish(name, outputs, stats)
+    return profile
@@ -0,0 +1,191 @@
+import pyarrow.dataset as ds
+import data_cleaning as dc
+
+"""
+DuckDB variant of data_cleaning.py (build_db.py --cleaning sql).
+
+The raw parquet files are read with read_parquet() and cleaned in SQL, the results are written directly into the tables
+'auftragsdaten' and 'positionsdaten'. Column names, order, types (ENUM for category columns, downcast integers/floats),
+row order and values are the same as with data_cleaning.data_cleaning, so both variants can be mixed (e.g. a full build
+with the SQL variant followed by incremental builds, which clean the delta with pandas).
+
+DuckDB runs the cleaning on all cores and can spill intermediate results to disk, the raw data is never loaded into pandas.
+"""
+
+RAW_FILES = {
+    "auftragsdaten": "resources/Auftragsdaten",
+    "positionsdaten": "resources/Positionsdaten",
+    "zeitdaten": "resources/Auftragsdaten_Zeit",
+}
+
+
+def _literal(value):
+    """Helper function. SQL string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _parquet_source(path):
+    """Helper function. read_parquet() over the same files (in the same order) that pyarrow reads for data_cleaning.load_data,
+    and an expression for the position of a row in these files (file index * 2^40 + row number)."""
+    files = "[" + ", ".join(_literal(f) for f in sorted(ds.dataset(path, format="parquet").files)) + "]"
+    position = f"(list_position({files}, filename) * 1099511627776 + file_row_number)::BIGINT"
+    return f"read_parquet({files}, filename = true, file_row_number = true)", position
+
+
+def _normalized(column, corrections=None):
+    """Helper function. SQL expression that replaces placeholders by NULL and applies the typo corrections (see data_cleaning.normalize_values)."""
+    col = _identifier(column)
+    cases = [f"WHEN {_literal(p)} THEN NULL" for p in dc.NONE_PLACEHOLDER]
+    cases += [f"WHEN {_literal(wrong)} THEN {_literal(right)}" for wrong, right in (corrections or {}).items()]
+    return f"CASE {col} {' '.join(cases)} ELSE {col} END"
+
+
+def _raw_select(con, path, columns, corrections=None, row_order=False):
+    """Helper function. SELECT statement for the projected and normalized raw data of one file, optionally with the column
+    '_row' (position of the row in the files)."""
+    source, position = _parquet_source(path)
+    types = dict(con.execute(f"SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM {source})").fetchall())
+    missing = [c for c in columns if c not in types]
+    if missing:
+        raise ValueError(f"Columns missing in {path}: {missing}")
+    select = [f"{_normalized(c, corrections)} AS {_identifier(c)}" if types[c] == "VARCHAR" else _identifier(c) for c in columns]
+    if row_order:
+        select.append(f"{position} AS _row")
+    return f"SELECT {', '.join(select)} FROM {source}"
+
+
+def raw_columns(files, name):
+    """Columns read from a raw file, the same as data_cleaning.load_data reads (all except the duplicated ones of Auftragsdaten_Zeit)."""
+    return dc.raw_columns(files[name], skip=dc.SKIPPED_TIME_COLUMNS if name == "zeitdaten" else ())
+
+
+def create_raw_views(con, files=RAW_FILES):
+    """Creates the temporary views raw_auftragsdaten, raw_positionsdaten and raw_zeitdaten over the parquet files.
+
+    The views contain the same columns and values as the frames returned by data_cleaning.load_data (same columns,
+    placeholders replaced), e.g. for build_db.compute_fingerprints.
+    """
+    for name, columns, corrections in (("auftragsdaten", raw_columns(files, "auftragsdaten"), dc.TYPO_CORRECTIONS),
+                                       ("positionsdaten", raw_columns(files, "positionsdaten"), None),
+                                       ("zeitdaten", raw_columns(files, "zeitdaten"), None)):
+        con.execute(f"CREATE OR REPLACE TEMP VIEW raw_{name} AS {_raw_select(con, files[name], columns, corrections)}")
+
+
+def _column_types(con, table, category_columns, downcast_int, keep=()):
+    """Helper function. Target type of every column of a staging table, following the conversions of data_cleaning.data_cleaning:
+    category columns -> ENUM (sorted categories), int64 -> smallest integer type (only if downcast_int),
+    integer columns with missing values -> DOUBLE (as pandas reads them as float64), float columns with at least one value
+    that has at most four decimals -> FLOAT. Columns in keep (added by the cleaning) keep their type."""
+    columns = [(name, ctype) for name, ctype in con.execute(f"SELECT column_name, column_type FROM (DESCRIBE {table})").fetchall()
+               if not name.startswith("_")]
+    types = {name: ctype for name, ctype in columns if name in keep}
+    columns = [(name, ctype) for name, ctype in columns if name not in keep]
+    integer_types = {"TINYINT", "SMALLINT", "INTEGER", "BIGINT"}
+    aggregates = []
+    for name, ctype in columns:
+        col = _identifier(name)
+        if ctype in integer_types:
+            aggregates += [f"count(*) - count({col})", f"min({col})", f"max({col})"]
+        if ctype in integer_types | {"DOUBLE", "FLOAT"}:
+            # np.isclose(col, col.round(4)).any()
+            aggregates.append(f"coalesce(bool_or(abs({col} - round_even({col}, 4)) <= 1e-8 + 1e-5 * abs(round_even({col}, 4))), false)")
+    stats = iter(con.execute(f"SELECT {', '.join(aggregates)} FROM {table}").fetchone() if aggregates else [])
+
+    for name, ctype in columns:
+        target = ctype
+        if name in category_columns:
+            values = [v for (v,) in con.execute(f"SELECT DISTINCT {_identifier(name)} FROM {table} WHERE {_identifier(name)} IS NOT NULL ORDER BY 1").fetchall()]
+            target = f"ENUM({', '.join(_literal(v) for v in values)})"
+        elif ctype in integer_types:
+            nulls, low, high = next(stats), next(stats), next(stats)
+            if nulls:
+                target = "DOUBLE"
+            elif ctype == "BIGINT" and downcast_int:
+                # pd.to_numeric(downcast='integer')
+                target = next(t for t, bits in (("TINYINT", 8), ("SMALLINT", 16), ("INTEGER", 32), ("BIGINT", 64))
+                              if -2**(bits - 1) <= low and high < 2**(bits - 1))
+        if ctype in integer_types | {"DOUBLE", "FLOAT"}:
+            below_four_decimals = next(stats)
+            if target in ("DOUBLE", "FLOAT") and below_four_decimals:
+                target = "FLOAT"
+        types[name] = target
+    # in the order of the staging table
+    return {name: types[name] for name in [c for c, in con.execute(f"SELECT column_name FROM (DESCRIBE {table})").fetchall()] if name in types}
+
+
+def _create_table(con, table, staging, order, category_columns, downcast_int, keep=(), extra=""):
+    """Helper function. Writes a staging table with the final column types, sorted by the given row position columns.
+    extra: additional columns, computed on the converted columns."""
+    types = _column_types(con, staging, category_columns, downcast_int, keep)
+    select = ", ".join(f"CAST({_identifier(c)} AS {t}) AS {_identifier(c)}" for c, t in types.items())
+    order = ", ".join(order)
+    con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * EXCLUDE ({order}){extra} FROM (SELECT {select}, {order} FROM {staging}) ORDER BY {order}")
+
+
+def data_cleaning(con, files=RAW_FILES):
+    """Cleans the raw data like data_cleaning.data_cleaning and writes the tables 'auftragsdaten' and 'positionsdaten'.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the database the tables are written to
+    files : dict, optional
+        paths of the raw parquet files, by default RAW_FILES
+
+    Returns
+    -------
+    int, int
+        number of rows of auftragsdaten and positionsdaten
+    """
+    order_columns, position_columns, time_columns = (raw_columns(files, name) for name in ("auftragsdaten", "positionsdaten", "zeitdaten"))
+    orders = _raw_select(con, files["auftragsdaten"], order_columns, dc.TYPO_CORRECTIONS, row_order=True)
+    positions = _raw_select(con, files["positionsdaten"], position_columns, row_order=True)
+    times = _raw_select(con, files["zeitdaten"], time_columns, row_order=True)
+    order_select = ", ".join(f"o.{_identifier(c)}" if c != "Auftrag_ID" else 'o."Auftrag_ID" AS "AuftragID"' for c in order_columns)
+    time_select = ", ".join(f"z.{_identifier(c)}" for c in time_columns if c != "KvaRechnung_ID")
+
+    # timestamps added to the orders; IS NOT DISTINCT FROM, as pandas.merge also matches missing keys.
+    # The row positions in the files (_o, _z, _p) are kept to restore the row order of pandas.merge
+    # (left rows in file order, matches in the order of the right file) when the tables are written.
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE clean_stage_auftragsdaten AS
+        SELECT {order_select}, {time_select}, o._row AS _o, z._row AS _z
+        FROM ({orders}) o
+        LEFT JOIN ({times}) z ON o.KvaRechnung_ID IS NOT DISTINCT FROM z.KvaRechnung_ID
+    """)
+    # timestamps of the orders added to the positions (positions of orders that occur more than once are duplicated, as with pandas)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE clean_stage_positionsdaten AS
+        SELECT {", ".join(f"p.{_identifier(c)}" for c in position_columns)}, a.CRMEingangszeit,
+               -- discount positions (data_cleaning: str.contains(pattern, case=False))
+               coalesce(regexp_matches(p.Bezeichnung, {_literal("|".join(dc.DISCOUNT_KEYWORDS))}, 'i'), false) AS ist_Abzug,
+               p._row AS _p, a._o, a._z
+        FROM ({positions}) p
+        LEFT JOIN clean_stage_auftragsdaten a ON p.KvaRechnung_ID IS NOT DISTINCT FROM a.KvaRechnung_ID
+    """)
+    # number of positions per order (mt.position_count: non-null Position_IDs, orders without positions stay NULL)
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE clean_position_count AS
+        SELECT KvaRechnung_ID, count(Position_ID)::SMALLINT AS PositionsAnzahl
+        FROM clean_stage_positionsdaten WHERE KvaRechnung_ID IS NOT NULL GROUP BY KvaRechnung_ID
+    """)
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE clean_stage_auftragsdaten AS
+        SELECT a.* EXCLUDE (_o, _z), c.PositionsAnzahl, a._o, a._z
+        FROM clean_stage_auftragsdaten a LEFT JOIN clean_position_count c ON a.KvaRechnung_ID = c.KvaRechnung_ID
+    """)
+
+    _create_table(con, "auftragsdaten", "clean_stage_auftragsdaten", ["_o", "_z"], dc.ORDER_CATEGORY_COLUMNS, downcast_int=True,
+                  keep=("CRMEingangszeit", "PositionsAnzahl"))
+    # plausibility of the sign of Einigung_Netto (after the conversion to float, as in data_cleaning)
+    _create_table(con, "positionsdaten", "clean_stage_positionsdaten", ["_p", "_o", "_z"], dc.POSITION_CATEGORY_COLUMNS, downcast_int=False,
+                  keep=("CRMEingangszeit", "ist_Abzug"),
+                  extra=", coalesce((Einigung_Netto >= 0 AND NOT ist_Abzug) OR (Einigung_Netto < 0 AND ist_Abzug), false) AS Plausibel")
+    for table in ["clean_stage_auftragsdaten", "clean_stage_positionsdaten", "clean_position_count"]:
+        con.execute(f"DROP TABLE {table}")
+
+    return tuple(con.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for table in ("auftragsdaten", "positionsdaten"))
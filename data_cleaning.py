@@ -2,11 +2,99 @@
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 import metrics as mt
+from contextlib import nullcontext
+from db_io import ARROW_TYPES
+
+# Columns of 'Auftragsdaten_Zeit' that are not read, they duplicate the columns of 'Auftragsdaten'.
+# All other columns of the raw files are read (and kept by the cleaning).
+SKIPPED_TIME_COLUMNS = ['Auftrag_ID', 'Schadensnummer']
+
+# custom indicators for missing values (replaced by null in all text columns)
+NONE_PLACEHOLDER = ["-", "(leer)", "(null)", "wird vergeben", "unbekannter HW", "#unbekannter hw", "Allgemeine Standardbeschreibungen"]
+# common typing errors from data entry in Auftragsdaten (Schadenart_Name, Falltyp_Name)
+TYPO_CORRECTIONS = {
+    "Betriebsunterbrechnung": "Betriebsunterbrechung",
+    "Überpannung Heizung": "Überspannung Heizung",
+    "Kfz": "KFZ",
+    "Schliessanlagen": "Schließanlagen",
+}
+
+# low cardinality text columns, converted to category
+ORDER_CATEGORY_COLUMNS = ['Land', 'PLZ_SO', 'PLZ_HW', 'PLZ_VN', 'address1_postalcode', 'Schadenart_Name', 'Falltyp_Name',
+                          'Gewerk_Name', 'Kundengruppe', 'Handwerker_Name']
+POSITION_CATEGORY_COLUMNS = ['KvaRechnung_ID', 'KvaRechnung_Nummer', 'Mengeneinheit', 'Bemerkung']
+
+# keywords in 'Bezeichnung' that mark a discount position (ist_Abzug)
+DISCOUNT_KEYWORDS = ["Rabatt", "Skonto", "Nachlass", "Gutschrift", "Bonus", "Abzug", "Minderung", "Gutschein", "Erlass", "Storno", "Kulanz"]
+
+# number of rows read and normalized at once
+BATCH_SIZE = 64_000
+
+
+def _normalize_batch(batch, corrections):
+    """Helper function. Replaces placeholders by null and applies the typo corrections to all text columns of a record batch."""
+    placeholders = pa.array(NONE_PLACEHOLDER)
+    wrong, right = pa.array(list(corrections)), pa.array(list(corrections.values()))
+    columns = []
+    for column in batch.columns:
+        if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            column = pc.if_else(pc.is_in(column, value_set=placeholders), pa.scalar(None, column.type), column)
+            if corrections:
+                index = pc.index_in(column, value_set=wrong)
+                column = pc.if_else(pc.is_valid(index), pc.take(right, index).cast(column.type), column)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def raw_columns(path, skip=()):
+    """Returns the columns of a raw parquet file (or directory) in file order, without the given ones."""
+    return [c for c in ds.dataset(path, format="parquet").schema.names if c not in skip]
+
+
+def read_parquet_batched(path, columns=None, corrections=None, batch_size=BATCH_SIZE):
+    """Reads a parquet file (or directory) batch by batch into one DataFrame.
+
+    Placeholders are replaced by null in every batch right after reading, text is kept in Arrow memory and converted
+    to pyarrow-backed strings ('string[pyarrow]'), so no Python string objects are created for the raw data.
+    This is not a streaming loader: the batches only bound the normalization, the result holds all rows and peak memory
+    grows with the input (about the Arrow table plus the DataFrame). cleaning_sql.py (build_db.py --cleaning sql) reads the
+    files with DuckDB's read_parquet instead and cleans them without loading them into pandas.
+
+    Parameters
+    ----------
+    path : str
+        parquet file or directory of parquet files
+    columns : list of str, optional
+        columns to read, by default all columns
+    corrections : dict, optional
+        wrong value -> corrected value, applied to all text columns, by default None
+    batch_size : int, optional
+        number of rows per batch, by default BATCH_SIZE
+
+    Returns
+    -------
+    pandas.DataFrame
+        data with the given columns in the given order
+    """
+    dataset = ds.dataset(path, format="parquet")
+    batches = [_normalize_batch(batch, corrections or {}) for batch in dataset.to_batches(columns=columns, batch_size=batch_size)]
+    schema = batches[0].schema if batches else dataset.schema.select(columns if columns else dataset.schema.names)
+    table = pa.Table.from_batches(batches, schema=schema.remove_metadata())
+    del batches
+    # self_destruct releases the Arrow buffers column by column during the conversion
+    return table.to_pandas(types_mapper=ARROW_TYPES.get, split_blocks=True, self_destruct=True)
+
 
 def load_data():
     """This function loads the raw data from the programs 'resources' folder. Three .parquet files are expected: 'Auftragsdaten', 'Positionsdaten' and 'Auftragsdaten_Zeit'.
 
+    All columns are read except the duplicated ones of Auftragsdaten_Zeit (SKIPPED_TIME_COLUMNS). Placeholders (and typing errors
+    in Auftragsdaten) are replaced while reading, text columns are pyarrow-backed strings (see read_parquet_batched).
+
     Returns
     -------
     pandas.DataFrame
@@ -17,14 +105,61 @@ def load_data():
         Auftragsdaten_Zeit
     """
     print("Loading Data...")
-    df = pd.read_parquet("resources/Auftragsdaten")
-    df2 = pd.read_parquet("resources/Positionsdaten")
-    df3 = pd.read_parquet("resources/Auftragsdaten_Zeit")
+    df = read_parquet_batched("resources/Auftragsdaten", corrections=TYPO_CORRECTIONS)
+    df2 = read_parquet_batched("resources/Positionsdaten")
+    df3 = read_parquet_batched("resources/Auftragsdaten_Zeit", raw_columns("resources/Auftragsdaten_Zeit", skip=SKIPPED_TIME_COLUMNS))
 
     return df, df2, df3
 
 
-def data_cleaning(df, df2, df3):
+def normalize_values(df, mapping):
+    """Replaces values in all text and categorical columns of df in a single pass.
+
+    Categorical columns are mapped via their categories, text columns are probed once for the values of the mapping (isin)
+    and only the matching rows are replaced. Columns that contain none of the values are left untouched.
+    Equivalent to calling df.replace(value, replacement) for every entry of mapping.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        data to normalize, is not modified
+    mapping : dict
+        value -> replacement (pd.NA to replace the value by null)
+
+    Returns
+    -------
+    pandas.DataFrame
+        DataFrame with replaced values, unchanged columns are shared with df
+    """
+    df = df.copy(deep=False)
+    values = list(mapping)
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            categories = series.cat.categories
+            if not categories.isin(values).any():
+                continue
+            # map the categories and merge categories that became equal, codes are translated via the factorized new categories
+            new_codes, new_categories = pd.factorize(pd.Series(categories).replace(mapping))
+            codes = series.cat.codes.to_numpy()
+            codes = np.where(codes >= 0, new_codes[codes], -1)
+            df[col] = pd.Categorical.from_codes(codes, categories=new_categories, ordered=series.cat.ordered)
+        elif series.dtype == object or isinstance(series.dtype, pd.StringDtype):
+            hits = series.isin(values)
+            if not hits.any():
+                continue
+            df[col] = series.mask(hits, series[hits].replace(mapping))
+    return df
+
+
+def _step(profiler, name, rows_in=None):
+    """Helper function. Profiles a part of the cleaning as step of kind 'cleaning' if a profiler is given (see build_profile.py)."""
+    if profiler is None:
+        return nullcontext({})
+    return profiler.step(name, kind="cleaning", rows_in=rows_in)
+
+
+def data_cleaning(df, df2, df3, profiler=None):
     """This function merges the given raw data sets with appropriate timestamp data and adds columns for more expedient metric computation. 
 
     Parameters
@@ -35,6 +170,8 @@ def data_cleaning(df, df2, df3):
         DataFrame containing 'Positionsdaten' data set_
     df3 : pandas.DataFrame
         DataFrame containing 'Auftragsdaten_Zeit' data set
+    profiler : build_profile.BuildProfiler, optional
+        records the runtime of the individual cleaning steps, by default None
 
     Returns
     -------
@@ -56,83 +193,71 @@ def data_cleaning(df, df2, df3):
 
     """
     print("Starting data cleaning...")
-    #add timestamp columns to Auftragsdaten
-    df = pd.merge(df, df3, on='KvaRechnung_ID', how='left') 
-    # remove duplicate columns introduced by df3
-    df = df.drop(["Auftrag_ID_y", "Schadensnummer_y"], axis=1) 
-    #restore original column naming in df
-    df = df.rename(columns={'Auftrag_ID_x': 'AuftragID', 'Schadensnummer_x': 'Schadensnummer'}) 
-    #transfer timestamps for orders to associated position data
-    df2 = pd.merge(df2,df[['KvaRechnung_ID','CRMEingangszeit']], on='KvaRechnung_ID', how='left')
+    with _step(profiler, "cleaning: merge timestamps", rows_in=len(df) + len(df2) + len(df3)) as step:
+        #add timestamp columns to Auftragsdaten, without the columns of df3 that duplicate df (not read by load_data)
+        df = pd.merge(df, df3.drop(columns=SKIPPED_TIME_COLUMNS, errors='ignore'), on='KvaRechnung_ID', how='left') 
+        df = df.rename(columns={'Auftrag_ID': 'AuftragID'}) 
+        #transfer timestamps for orders to associated position data
+        df2 = pd.merge(df2,df[['KvaRechnung_ID','CRMEingangszeit']], on='KvaRechnung_ID', how='left')
    
-    #add int column with number of positions for every entry in Auftragsdaten, downcast to save space
-    df = pd.merge(df,mt.position_count(df2), on='KvaRechnung_ID', how='left')
-    df['PositionsAnzahl'] = df['PositionsAnzahl'].astype('Int16')
+        #add int column with number of positions for every entry in Auftragsdaten, downcast to save space
+        df = pd.merge(df,mt.position_count(df2), on='KvaRechnung_ID', how='left')
+        df['PositionsAnzahl'] = df['PositionsAnzahl'].astype('Int16')
+        step["rows_out"] = len(df) + len(df2)
 
     #checking effectivness of dtype changes, print initial state
     print(f"Memory usage before converting:")
     df.info(memory_usage='deep')
     df2.info(memory_usage='deep')
 
-    #multiple columns contain custom indicators or empty fields, these are transformed into proper null values
-    None_placeholder = ["-", "(leer)", "(null)", "wird vergeben", "unbekannter HW", "#unbekannter hw", "Allgemeine Standardbeschreibungen"]
-    for placeholder in None_placeholder:
-        df = df.replace(placeholder, pd.NA)
-        df2 = df2.replace(placeholder, pd.NA)
-
-    # Replace Typing Error in Schadensart_Name
-    df = df.replace("Betriebsunterbrechnung", "Betriebsunterbrechung")
-
-    # Replace Typing Error in Falltyp_Name
-    df = df.replace("Überpannung Heizung", "Überspannung Heizung")
-    df = df.replace("Kfz", "KFZ")
-    df = df.replace("Schliessanlagen", "Schließanlagen")
+    with _step(profiler, "cleaning: replace placeholders and typos", rows_in=len(df) + len(df2)) as step:
+        #multiple columns contain custom indicators or empty fields, these are transformed into proper null values
+        #(already done by load_data while reading, repeated here for data that was loaded otherwise)
+        placeholders = dict.fromkeys(NONE_PLACEHOLDER, pd.NA)
+        # Replace Typing Errors in Schadensart_Name and Falltyp_Name in the same pass
+        df = normalize_values(df, {**placeholders, **TYPO_CORRECTIONS})
+        df2 = normalize_values(df2, placeholders)
+        step["rows_out"] = len(df) + len(df2)
 
-    # Converting Object Types for df
-    columns_to_convert = ['Land', 'PLZ_SO', 'PLZ_HW', 'PLZ_VN', 'address1_postalcode', 
-                        'Schadenart_Name', 'Falltyp_Name', 'Gewerk_Name', 'Kundengruppe', 
-                        'Handwerker_Name']
+    with _step(profiler, "cleaning: convert dtypes", rows_in=len(df) + len(df2)) as step:
+        # Convert Column with low Cardinality to Category
+        df[ORDER_CATEGORY_COLUMNS] = df[ORDER_CATEGORY_COLUMNS].astype('category')
 
-    # Convert Column with low Cardinality to Category
-    df[columns_to_convert] = df[columns_to_convert].astype('category')
+        # Convert the other Object Columns to (pyarrow-backed) String, DuckDB reads the Arrow buffers without conversion
+        object_columns = df.select_dtypes('object').columns
+        df[object_columns] = df[object_columns].astype('string[pyarrow]')
 
-    # Convert the other Object Columns to String
-    object_columns = df.select_dtypes('object').columns
-    df[object_columns] = df[object_columns].astype('string')
 
+        # Downcast integer columns
+        int_cols = df.select_dtypes(include=['int64']).columns
+        for col in int_cols:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
 
-    # Downcast integer columns
-    int_cols = df.select_dtypes(include=['int64']).columns
-    for col in int_cols:
-        df[col] = pd.to_numeric(df[col], downcast='integer')
+        # Downcast float columns
+        df_below_four_decimals = df.select_dtypes(include='float') \
+                                            .apply(lambda col: np.isclose(col, col.round(4))) \
+                                            .any() \
+                                            .loc[lambda s: s] \
+                                            .index.tolist()
 
-    # Downcast float columns
-    df_below_four_decimals = df.select_dtypes(include='float') \
-                                        .apply(lambda col: np.isclose(col, col.round(4))) \
-                                        .any() \
-                                        .loc[lambda s: s] \
-                                        .index.tolist()
+        df[df_below_four_decimals] = df[df_below_four_decimals].astype('float32')
 
-    df[df_below_four_decimals] = df[df_below_four_decimals].astype('float32')
+        # Converting to Category
+        df2[POSITION_CATEGORY_COLUMNS] = df2[POSITION_CATEGORY_COLUMNS].astype('category')
 
-    # Converting Object Types for df2
-    df2_columns_to_convert = ['KvaRechnung_ID', 'KvaRechnung_Nummer', 'Mengeneinheit', 'Bemerkung']
+        # Converting the rest to (pyarrow-backed) strings
+        object_columns = df2.select_dtypes('object').columns
+        df2[object_columns] = df2[object_columns].astype('string[pyarrow]')
 
-    # Converting to Category
-    df2[df2_columns_to_convert] = df2[df2_columns_to_convert].astype('category')
+        # Downcast float columns
+        df2_below_four_decimals = df2.select_dtypes(include='float') \
+                                            .apply(lambda col: np.isclose(col, col.round(4))) \
+                                            .any() \
+                                            .loc[lambda s: s] \
+                                            .index.tolist()
 
-    # Converting the rest to strings
-    object_columns = df2.select_dtypes('object').columns
-    df2[object_columns] = df2[object_columns].astype('string')
-
-    # Downcast float columns
-    df2_below_four_decimals = df2.select_dtypes(include='float') \
-                                        .apply(lambda col: np.isclose(col, col.round(4))) \
-                                        .any() \
-                                        .loc[lambda s: s] \
-                                        .index.tolist()
-
-    df2[df2_below_four_decimals] = df2[df2_below_four_decimals].astype('float32')
+        df2[df2_below_four_decimals] = df2[df2_below_four_decimals].astype('float32')
+        step["rows_out"] = len(df) + len(df2)
 
     #checking effectivness of dtype changes, print 'after' state
     print(f"Memory usage after converting:")
@@ -140,15 +265,15 @@ def data_cleaning(df, df2, df3):
     df2.info(memory_usage='deep')
 
 
-    # Add boolean column to check if row is a discount position
-    keywords = ["Rabatt", "Skonto", "Nachlass", "Gutschrift", "Bonus", "Abzug", "Minderung", "Gutschein", "Erlass", "Storno", "Kulanz"]
-
-    pattern = '|'.join(keywords)
-    df2['ist_Abzug'] = df2['Bezeichnung'].str.contains(pattern, case=False, regex=True, na=False)
-    normal_position = (df2['Einigung_Netto'] >= 0) & (df2['ist_Abzug'] == False)
-    discount_position = (df2['Einigung_Netto'] < 0) & (df2['ist_Abzug'] == True)
+    with _step(profiler, "cleaning: discount flag", rows_in=len(df2)) as step:
+        # Add boolean column to check if row is a discount position
+        pattern = '|'.join(DISCOUNT_KEYWORDS)
+        df2['ist_Abzug'] = df2['Bezeichnung'].str.contains(pattern, case=False, regex=True, na=False)
+        normal_position = (df2['Einigung_Netto'] >= 0) & (df2['ist_Abzug'] == False)
+        discount_position = (df2['Einigung_Netto'] < 0) & (df2['ist_Abzug'] == True)
 
-    df2['Plausibel'] = normal_position | discount_position
+        df2['Plausibel'] = normal_position | discount_position
+        step["rows_out"] = len(df2)
 
     return df, df2
 
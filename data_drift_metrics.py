@@ -1,22 +1,36 @@
+import numpy as np
 import pandas as pd
-from evidently import Dataset
-from evidently import DataDefinition
-from evidently import Report
-from evidently.presets import DataDriftPreset
+from db_io import fetch_df
 
-# Schema für Auftragsdatenset, nur aufgeführte Spalten werden geprüft   
-schema_df = DataDefinition(
+# evidently is imported by the functions that use it (on first use), importing it takes several seconds
+# and would otherwise slow down the start of the dashboard (see import_benchmark.py)
+
+# Schema für Auftragsdatenset, nur aufgeführte Spalten werden geprüft (Argumente von evidently.DataDefinition)
+schema_df = dict(
     numerical_columns= ["Forderung_Netto", "Empfehlung_Netto", "Einigung_Netto", "Differenz_vor_Zeitwert_Netto"],
     categorical_columns= ["Land","Schadenart_Name", "Falltyp_Name", "Gewerk_Name"],
     id_column= "AuftragID",
     timestamp= "CRMEingangszeit"
 ) 
 #Analog für Positionsdaten
-schema_df2 = DataDefinition(
+schema_df2 = dict(
     id_column= "Position_ID",
     numerical_columns= ["Menge","Menge_Einigung", "EP", "EP_Einigung", "Forderung_Netto", "Einigung_Netto"],
     timestamp="CRMEingangszeit"
     )
+# Datenquellen der Reports: Tabelle in der Dashboard-Datenbank und Schema je Quelltyp ('df' = Aufträge, 'df2' = Positionen)
+SOURCES = {"df": ("auftragsdaten", schema_df), "df2": ("positionsdaten", schema_df2)}
+
+# Monats-Sketches (drift_sketches): Anzahl Perzentil-Bins je numerischer Spalte
+SKETCH_BINS = 100
+# Spalten und Typen der Sketch-Tabellen (drift_sketches), auch ohne Spalten mit Werten
+SKETCH_COLUMNS = {
+    "histograms": {"Quelle": "string", "Spalte": "string", "Monat": "datetime64[ns]", "Bin": "int64", "Anzahl": "int64", "Summe": "float64", "Quadratsumme": "float64"},
+    "bins": {"Quelle": "string", "Spalte": "string", "Bin": "int64", "Untergrenze": "float64", "Obergrenze": "float64"},
+    "categories": {"Quelle": "string", "Spalte": "string", "Monat": "datetime64[ns]", "Kategorie": "string", "Anzahl": "int64"},
+}
+# Schwellwert für Drift (Default von evidently für Wasserstein (normiert) und Jensen-Shannon)
+DRIFT_THRESHOLD = 0.1
 
 def check_start_end_date(start,end):
     """Helper function. Checks if end follows start chronologically and reorders the two if needed. 
@@ -38,6 +52,225 @@ def check_start_end_date(start,end):
     return start, end
 
 
+def window_bounds(start_date, end_date):
+    """Helper function. Converts the dates of a window to full datetimes at midnight, the window contains start <= t < end."""
+    #Type cleanup to full datetime, due to the dashboard passing only date-level precision values
+    start_date = pd.to_datetime(start_date).replace(hour=0,minute=0,second=0)
+    end_date = pd.to_datetime(end_date).replace(hour=0,minute=0,second=0)
+    return start_date, end_date
+
+
+def load_drift_data(con, source_type, start_date_reference, end_date_reference, start_date_eval, end_date_eval):
+    """Loads the data of a report from the database: only the columns of the schema and only the rows of both windows.
+
+    Projection and window filter run in DuckDB and the result is fetched via Arrow, so the full table is never loaded.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the dashboard database
+    source_type : str
+        'df' for order data, 'df2' for position data
+    start_date_reference, end_date_reference, start_date_eval, end_date_eval : date
+        windows as passed to data_drift_evaluation
+
+    Returns
+    -------
+    pandas.DataFrame
+        rows of the reference and the evaluation window, can be passed to data_drift_evaluation
+    """
+    table, schema = SOURCES[source_type]
+    columns = [schema["id_column"], schema["timestamp"], *schema.get("numerical_columns", []), *schema.get("categorical_columns", [])]
+    windows = [window_bounds(*check_start_end_date(start_date_reference, end_date_reference)),
+               window_bounds(*check_start_end_date(start_date_eval, end_date_eval))]
+    selection = ", ".join(f'"{c}"' for c in columns)
+    in_window = " OR ".join(f'("{schema["timestamp"]}" >= ? AND "{schema["timestamp"]}" < ?)' for _ in windows)
+    return fetch_df(con, f"SELECT {selection} FROM {table} WHERE {in_window}", [bound for window in windows for bound in window])
+
+
+def drift_sketches(df, df2):
+    """Computes compact per-month sketches of all schema columns of both sources (build step, see build_db.METRIC_TASKS).
+
+    Numerical columns are binned on global percentile edges (SKETCH_BINS bins over all months), per month and bin the number,
+    sum and sum of squares of the values are kept. Categorical columns keep the number of rows per month and category.
+    Merging the months of a window only sums these counts, so sketch_drift compares any two month-aligned windows without raw data.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Auftragsdaten
+    df2 : pandas.DataFrame
+        Positionsdaten
+
+    Returns
+    -------
+    pandas.DataFrame, pandas.DataFrame, pandas.DataFrame
+        histograms (Quelle, Spalte, Monat, Bin, Anzahl, Summe, Quadratsumme), bin edges (Quelle, Spalte, Bin, Untergrenze, Obergrenze)
+        and category counts (Quelle, Spalte, Monat, Kategorie, Anzahl); Quelle is the source type ('df'/'df2').
+        Sources without values in their schema columns add no rows, the tables are empty (SKETCH_COLUMNS) if no source has any.
+    """
+    histograms, bins, categories = [], [], []
+    for source_type, frame in (("df", df), ("df2", df2)):
+        schema = SOURCES[source_type][1]
+        months = frame[schema["timestamp"]].dt.to_period("M").dt.to_timestamp()
+        for column in schema.get("numerical_columns", []):
+            values = frame[column].astype("float64")
+            valid = values.notna() & months.notna()
+            values = values[valid].to_numpy()
+            if not len(values):
+                continue
+            edges = np.unique(np.quantile(values, np.linspace(0, 1, SKETCH_BINS + 1)))
+            if len(edges) == 1: # constant column: one bin
+                edges = np.repeat(edges, 2)
+            bin_ids = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, len(edges) - 2)
+            hist = (pd.DataFrame({"Monat": months[valid].to_numpy(), "Bin": bin_ids, "Wert": values, "Quadrat": values * values})
+                    .groupby(["Monat", "Bin"])
+                    .agg(Anzahl=("Wert", "size"), Summe=("Wert", "sum"), Quadratsumme=("Quadrat", "sum"))
+                    .reset_index())
+            hist.insert(0, "Spalte", column)
+            hist.insert(0, "Quelle", source_type)
+            histograms.append(hist)
+            bins.append(pd.DataFrame({"Quelle": source_type, "Spalte": column, "Bin": np.arange(len(edges) - 1), "Untergrenze": edges[:-1], "Obergrenze": edges[1:]}))
+        for column in schema.get("categorical_columns", []):
+            counts = pd.DataFrame({"Monat": months, "Kategorie": frame[column]}).dropna()
+            if counts.empty:
+                continue
+            counts["Kategorie"] = counts["Kategorie"].astype(str)
+            counts = counts.groupby(["Monat", "Kategorie"]).size().reset_index(name="Anzahl")
+            counts.insert(0, "Spalte", column)
+            counts.insert(0, "Quelle", source_type)
+            categories.append(counts)
+    # no part if no schema column has values (e.g. empty data): empty tables with the expected columns
+    return tuple(pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=list(SKETCH_COLUMNS[name])).astype(SKETCH_COLUMNS[name])
+                 for name, parts in (("histograms", histograms), ("bins", bins), ("categories", categories)))
+
+
+def load_drift_sketches(con, source_type):
+    """Loads the monthly sketches of one source from the database (tables of drift_sketches without the column Quelle).
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the dashboard database
+    source_type : str
+        'df' for order data, 'df2' for position data
+
+    Returns
+    -------
+    dict
+        'histograms', 'bins' and 'categories' -> pandas.DataFrame, can be passed to sketch_drift
+    """
+    return {name: fetch_df(con, f"SELECT * EXCLUDE (Quelle) FROM metric_drift_{name} WHERE Quelle = ?", [source_type])
+            for name in ("histograms", "bins", "categories")}
+
+
+def has_drift_sketches(con):
+    """Checks whether the database contains the sketch tables of drift_sketches (missing in databases built before them).
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the dashboard database
+
+    Returns
+    -------
+    bool
+    """
+    tables = [f"metric_drift_{name}" for name in SKETCH_COLUMNS]
+    return con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name IN (SELECT unnest(?))", [tables]).fetchone()[0] == len(tables)
+
+
+def month_window(start_date, end_date):
+    """Helper function. First and last month (first days) of the months overlapping the window start <= t < end (dates as in the dashboard)."""
+    start_date, end_date = window_bounds(*check_start_end_date(start_date, end_date))
+    return start_date.to_period("M").to_timestamp(), (end_date - pd.Timedelta(days=1)).to_period("M").to_timestamp()
+
+
+def _wasserstein(points_p, weights_p, points_q, weights_q):
+    """Helper function. Wasserstein distance (W1) of two discrete distributions, the integral of |F_p - F_q| over the merged support."""
+    points = np.concatenate([points_p, points_q])
+    order = np.argsort(points, kind="stable")
+    cdf_diff = np.cumsum(np.concatenate([weights_p, -weights_q])[order])[:-1]
+    return float(np.sum(np.abs(cdf_diff) * np.diff(points[order])))
+
+
+def _jensen_shannon(p, q):
+    """Helper function. Jensen-Shannon distance (natural logarithm) of two distributions over the same bins/categories."""
+    m = (p + q) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kl_p = np.where(p > 0, p * np.log(p / m), 0.0).sum()
+        kl_q = np.where(q > 0, q * np.log(q / m), 0.0).sum()
+    return float(np.sqrt(max((kl_p + kl_q) / 2, 0.0)))
+
+
+def _psi(p, q):
+    """Helper function. Population Stability Index, empty bins/categories count as 0.01 %."""
+    p, q = np.where(p == 0, 0.0001, p), np.where(q == 0, 0.0001, q)
+    return float(np.sum((p - q) * np.log(p / q)))
+
+
+def sketch_drift(sketches, start_date_reference, end_date_reference, start_date_eval, end_date_eval, threshold=DRIFT_THRESHOLD):
+    """Compares two windows on the monthly sketches (load_drift_sketches), only the sketch counts of the months are summed.
+
+    The windows are expanded to full months (month_window). Numerical columns: Wasserstein distance normed by the standard deviation
+    of the reference (as in evidently; the values of a bin sit at their mean within the window, the standard deviation is exact),
+    Jensen-Shannon distance and PSI over the percentile bins. Categorical columns: Jensen-Shannon distance and PSI over the categories.
+
+    Parameters
+    ----------
+    sketches : dict
+        result of load_drift_sketches
+    start_date_reference, end_date_reference, start_date_eval, end_date_eval : date
+        windows as passed to data_drift_evaluation
+    threshold : float, optional
+        drift if the normed Wasserstein distance (numerical) or the Jensen-Shannon distance (categorical) reaches it, by default DRIFT_THRESHOLD
+
+    Returns
+    -------
+    pandas.DataFrame
+        one row per column: Spalte, Typ, Anzahl_Referenz, Anzahl_Vergleich, Wasserstein_normiert, Jensen_Shannon, PSI, Drift
+    """
+    windows = [month_window(start_date_reference, end_date_reference), month_window(start_date_eval, end_date_eval)]
+    rows = []
+
+    histograms, bins = sketches["histograms"], sketches["bins"]
+    for column, column_bins in bins.groupby("Spalte", sort=False):
+        n_bins = len(column_bins)
+        column_hist = histograms[histograms["Spalte"] == column]
+        ref, cur = (column_hist[column_hist["Monat"].between(first, last)]
+                    .groupby("Bin")[["Anzahl", "Summe", "Quadratsumme"]].sum()
+                    .reindex(range(n_bins), fill_value=0)
+                    for first, last in windows)
+        n_ref, n_cur = ref["Anzahl"].sum(), cur["Anzahl"].sum()
+        row = {"Spalte": column, "Typ": "numerisch", "Anzahl_Referenz": n_ref, "Anzahl_Vergleich": n_cur,
+               "Wasserstein_normiert": np.nan, "Jensen_Shannon": np.nan, "PSI": np.nan}
+        if n_ref and n_cur:
+            ref_mean = ref["Summe"].sum() / n_ref
+            ref_std = np.sqrt(max(ref["Quadratsumme"].sum() / n_ref - ref_mean ** 2, 0.0))
+            filled_ref, filled_cur = ref[ref["Anzahl"] > 0], cur[cur["Anzahl"] > 0]
+            distance = _wasserstein((filled_ref["Summe"] / filled_ref["Anzahl"]).to_numpy(), (filled_ref["Anzahl"] / n_ref).to_numpy(),
+                                    (filled_cur["Summe"] / filled_cur["Anzahl"]).to_numpy(), (filled_cur["Anzahl"] / n_cur).to_numpy())
+            p, q = (ref["Anzahl"] / n_ref).to_numpy(), (cur["Anzahl"] / n_cur).to_numpy()
+            row.update(Wasserstein_normiert=distance / max(ref_std, 0.0001), Jensen_Shannon=_jensen_shannon(p, q), PSI=_psi(p, q))
+        row["Drift"] = bool(row["Wasserstein_normiert"] >= threshold)
+        rows.append(row)
+
+    categories = sketches["categories"]
+    for column, column_counts in categories.groupby("Spalte", sort=False):
+        ref, cur = (column_counts[column_counts["Monat"].between(first, last)].groupby("Kategorie")["Anzahl"].sum()
+                    for first, last in windows)
+        ref, cur = ref.align(cur, fill_value=0)
+        n_ref, n_cur = ref.sum(), cur.sum()
+        row = {"Spalte": column, "Typ": "kategorial", "Anzahl_Referenz": n_ref, "Anzahl_Vergleich": n_cur,
+               "Wasserstein_normiert": np.nan, "Jensen_Shannon": np.nan, "PSI": np.nan}
+        if n_ref and n_cur:
+            p, q = (ref / n_ref).to_numpy(), (cur / n_cur).to_numpy()
+            row.update(Jensen_Shannon=_jensen_shannon(p, q), PSI=_psi(p, q))
+        row["Drift"] = bool(row["Jensen_Shannon"] >= threshold)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["Spalte", "Typ", "Anzahl_Referenz", "Anzahl_Vergleich", "Wasserstein_normiert", "Jensen_Shannon", "PSI", "Drift"])
+
+
 def datetime_slice_mask(df, start_date, end_date):
     """Helper function. Returns a chronologically sliced Dataset according to passed datetime.
 
@@ -55,21 +288,21 @@ def datetime_slice_mask(df, start_date, end_date):
     evidently.Dataset
         sliced DataFrame, converted to Dataset.
     """
-    #Type cleanup to full datetime, due to the dashboard passing only date-level precision values
-    start_date = pd.to_datetime(start_date).replace(hour=0,minute=0,second=0)
-    end_date = pd.to_datetime(end_date).replace(hour=0,minute=0,second=0) 
+    from evidently import Dataset, DataDefinition
+
+    start_date, end_date = window_bounds(start_date, end_date)
 
     mask =(df["CRMEingangszeit"] >= start_date) & (df["CRMEingangszeit"] < end_date)
 
-    if 'Kundengruppe' in df.columns: #evaluates true if Auftragsdaten-df was passed 
+    if schema_df["id_column"] in df.columns: #evaluates true if Auftragsdaten-df was passed 
         sliced_ds = Dataset.from_pandas(
             df.loc[mask],
-            data_definition=schema_df
+            data_definition=DataDefinition(**schema_df)
         ) 
-    if 'Menge' in df.columns: #evaluates true if Positionsdaten-df was passed
+    if schema_df2["id_column"] in df.columns: #evaluates true if Positionsdaten-df was passed
         sliced_ds = Dataset.from_pandas(
             df.loc[mask],
-            data_definition=schema_df2
+            data_definition=DataDefinition(**schema_df2)
         )  
     return sliced_ds
 
@@ -100,6 +333,9 @@ def data_drift_evaluation(df, start_date_reference, end_date_reference, start_da
     detailed in https://docs.evidentlyai.com/metrics/customize_data_drift. 
 
     """
+    from evidently import Report
+    from evidently.presets import DataDriftPreset
+
     #check if start and end dates are in chronologicl order, switch if needed
     start_date_reference, end_date_reference = check_start_end_date(start_date_reference, end_date_reference)
     start_date_eval, end_date_eval = check_start_end_date(start_date_eval, end_date_eval)
@@ -108,7 +344,7 @@ def data_drift_evaluation(df, start_date_reference, end_date_reference, start_da
     reference_data = datetime_slice_mask(df,start_date_reference,end_date_reference)
     eval_data = datetime_slice_mask(df, start_date_eval,end_date_eval) 
     
-    if 'Kundengruppe' in df.columns: #evaluates true if Auftragsdaten-df was passed
+    if schema_df["id_column"] in df.columns: #evaluates true if Auftragsdaten-df was passed
         report = Report([
             DataDriftPreset(
                 columns=["Forderung_Netto", "Empfehlung_Netto", "Einigung_Netto", "Differenz_vor_Zeitwert_Netto","Land","Schadenart_Name", "Falltyp_Name", "Gewerk_Name"]
@@ -121,7 +357,7 @@ def data_drift_evaluation(df, start_date_reference, end_date_reference, start_da
                           str(start_date_eval)+"_"+
                           str(end_date_eval)+
                           ".html")
-    if 'Menge' in df.columns: #evaluates true if Positionsdaten-df was passed
+    if schema_df2["id_column"] in df.columns: #evaluates true if Positionsdaten-df was passed
         report = Report([
             #add arguments here to customize reports
             DataDriftPreset(
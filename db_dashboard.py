@@ -1,6 +1,9 @@
 import time
+from collections.abc import Mapping
 import streamlit as st
-import duckdb
+import db_pool
+from db_io import fetch_df, fetch_page, count_rows, monthly_counts, current_db_path, table_keys
+import metrics_sql as ms
 from streamlit_option_menu import option_menu
 from app_pages import page1, page2, page3, page4, page5
 
@@ -13,171 +16,248 @@ st.set_page_config(
     layout="wide"
 )
 
-@st.cache_resource #lade duckdb-Verbindung als permanente Ressource
-def get_db_connection():
-    """Establishes a read-only connection to the DuckDB database."""
-    DB_PATH = "resources/dashboard_data.duckdb"
-    con = duckdb.connect(DB_PATH, read_only=True)
-    return con
+# Alle Abfragen laufen auf Cursorn des gemeinsamen Pools (db_pool.py), eine DuckDB-Instanz je Datenbankversion.
+# build_db.py veröffentlicht neue Versionen über resources/CURRENT (db_io.current_db_path()), der nächste Rerun nach einem Build
+# fragt die neue Version ab, die vorherige bleibt bis dahin lesbar.
+# Die Cache-Keys enthalten statt des Pfads den Inhalts-Key der Tabelle (content_key): nach einem Build bleiben alle unveränderten
+# Tabellen im Cache, neu geladen wird nur, was sich geändert hat. Der Pfad wird als _db_path übergeben (von st.cache_data nicht gehasht).
 
+@st.cache_data(max_entries=2)
+def load_content_keys(db_path):
+    """Content key of every table of a database version (db_io.table_keys), read once per version."""
+    with db_pool.cursor(db_path) as con:
+        return table_keys(con)
 
-@st.cache_data
-def compute_metrics_df1(): # Vorberechnete Daten für Auftragsdaten werden aus duckdb geladen und einmalig gecached (Rohdaten werden nicht vorgehalten)
-    print("Loading metrics for df1 (Auftragsdaten) from DB...")
-    start_time = time.time()
 
-    con = get_db_connection()
-    scalars = con.execute("SELECT * FROM scalar_metrics").df().iloc[0]
-
-    null_ratios_cols = con.execute("SELECT * FROM metric_null_ratios_per_column").df()
-    
-    test_data_df = con.execute("SELECT * FROM metric_test_data_entries").df()
-
-    plausi_df = con.execute("SELECT * FROM metric_plausibility_diffs_auftragsdaten").df()
-
-    grouped_col_ratios_df1 = con.execute("SELECT * FROM metric_cleanliness_cols_grouped_auftragsdaten").df()
-    
-    row_ratios_df = con.execute("SELECT * FROM metric_cleanliness_rows_grouped_auftragsdaten").df()
-    grouped_row_ratios_df1 = row_ratios_df.set_index('Kundengruppe')['row_null_ratio']
-
-    proforma_df = con.execute("SELECT * FROM metric_proforma").df()
-
-    above_50k_df = con.execute("SELECT * FROM metric_above_50k").df()
-
-    zeitwert_df = con.execute("SELECT * FROM metric_zeitwert_errors").df()
-
-    error_freq_df = con.execute("SELECT * FROM metric_error_heatmap").df()
-
-    handwerker_outliers = con.execute("SELECT * FROM metric_handwerker_outliers").df()
-
-    fn_stats_df1 = con.execute("SELECT * FROM metric_fn_stats_df1").df()
-    fn_details_df1 = con.execute("SELECT * FROM metric_fn_details_df1").df()
-    fn_count_df = fn_stats_df1['Fehler'].sum()
-    semantic_mismatches = con.execute("SELECT * FROM metric_semantic_mismatches").df()
-
-    empty_orders_df = con.execute("SELECT * FROM metric_empty_orders_dataframe").df()
-    
-    outliers_by_damage = con.execute("SELECT * FROM metric_outliers_by_damage").df()
-
-
-    metrics_df1 = {
-        "row_count": scalars['count_total_orders'],
-        "null_ratio_cols": null_ratios_cols,
-        "null_ratio_rows": scalars['null_row_ratio_orders'],
-        "test_kundengruppen_anzahl": scalars['count_test_data_rows'],
-        "test_data_df": test_data_df,
-        "plausi_forderung_einigung_df": plausi_df,
-        "plausi_forderung_einigung_count": scalars['count_plausibility_errors_df'],
-        "plausi_forderung_einigung_avg_diff": scalars['avg_plausibility_diff_df'],
-        "grouped_col_ratios": grouped_col_ratios_df1,
-        "grouped_row_ratios": grouped_row_ratios_df1,
-        "proforma_belege_df": proforma_df,
-        "proforma_belege_count": scalars['count_proforma_receipts'],
-        "above_50k_df": above_50k_df,
-        "zeitwert_error_df": zeitwert_df,
-        "zeitwert_errors_count": len(zeitwert_df),
-        "error_frequency_weekday_hour": error_freq_df,
-        "false_negative": fn_count_df,
-        "handwerker_gewerke_outlier": handwerker_outliers,
-        "false_negative_stats": fn_stats_df1,
-        "false_negative_details": fn_details_df1,
-        "empty_orders_count": scalars['count_empty_orders'],
-        "mismatched_entries": semantic_mismatches,
-        "empty_orders_df": empty_orders_df,
-        "outliers_by_damage": outliers_by_damage
-    }
-    
-    print(f"Loaded metrics for df1 in {round(time.time() - start_time, 2)}s")
-    return metrics_df1
-
-
-@st.cache_data
-def compute_metrics_df2(): # Analog für alle Metriken zu Positionsdaten
-    print("Loading metrics for df2 (Positionsdaten) from DB...")
-    start_time = time.time()
-    
-    con = get_db_connection()
-    scalars = con.execute("SELECT * FROM scalar_metrics").df().iloc[0]
-
-    plausi_df2 = con.execute("SELECT * FROM metric_plausibility_diffs_positionsdaten").df()
-
-    position_counts_df = con.execute("SELECT * FROM metric_position_count_positionsdaten").df()
-
-    fn_stats_df2 = con.execute("SELECT * FROM metric_fn_stats_df2").df()
-    fn_details_df2 = con.execute("SELECT * FROM metric_fn_details_df2").df()
-    disc_stats = con.execute("SELECT * FROM metric_discount_stats").df()
-    disc_details = con.execute("SELECT * FROM metric_discount_details").df()
-    null_ratio_cols = con.execute("SELECT * FROM metric_cleanliness_cols_ungrouped_positionsdaten").df()
-
-
-    metrics_df2 = {
-        "row_count": scalars['count_total_positions'],
-        "null_ratio_cols": null_ratio_cols,
-        "null_ratio_rows": scalars['null_row_ratio_positions'] if 'null_row_ratio_positions' in scalars else 0,
-        "discount_check_errors": scalars['count_discount_logic_errors'],
-        "position_counts_per_rechnung": position_counts_df,
-        "plausi_forderung_einigung_count": scalars["count_plausibility_errors_df2"], 
-        "plausi_forderung_einigung_avg_diff": scalars["avg_plausibility_diff_df2"],
-        "false_negative_stats": fn_stats_df2,
-        "false_negative_details": fn_details_df2,
-        "discount_stats": disc_stats,
-        "discount_details": disc_details,
-        "plausi_forderung_einigung_df2": plausi_df2
-    }
-
-    print(f"Loaded metrics for df2 in {round(time.time() - start_time, 2)}s")
-    return metrics_df2
-
-
-@st.cache_data
-def compute_metrics_combined(): #Analog für alle Metriken über beide Datensets
-    print("Loading combined metrics from DB...")
-    start_time = time.time()
-    
-    con = get_db_connection()
-    scalars = con.execute("SELECT * FROM scalar_metrics").df().iloc[0]
-    auftraege_abgleich_df = con.execute("SELECT * FROM metric_order_pos_mismatch").df()
-
-    metrics_combined = {
-        "kvarechnung_id_is_unique": bool(scalars['is_unique_kva_id']),
-        "kvarechnung_nummer_land_is_unique": bool(scalars['is_unique_kva_nr_per_land']),
-        "position_id_is_unique": bool(scalars['is_unique_position_id']),
-        "auftraege_abgleich": auftraege_abgleich_df
-    }
-    
-    print(f"Loaded combined metrics in {round(time.time() - start_time, 2)}s")
-    return metrics_combined
-
-
-@st.cache_data
-def compute_positions_over_time(): 
-    print("Loading positions per order over time from DB...")
-    start_time = time.time()
-    con = get_db_connection()
-    df_pos_time = con.execute("SELECT * FROM metric_positions_over_time").df()
-    
-    print(f"Loaded positions over time in {round(time.time() - start_time, 2)}s")
-    return df_pos_time
-
-@st.cache_data
-def compute_comparison_metrics():
-    print("Loading comparison metrics from DB...")
-    start_time = time.time()
-    
-    con = get_db_connection()
-    comparison_df = con.execute("SELECT * FROM metric_comparison").df()
-    
-    print(f"Loaded comparison metrics in {round(time.time() - start_time, 2)}s")
-    return comparison_df
-
-@st.cache_data
-def compute_issues_df():
-    print("Loading issues metrics from DB...")
+def content_key(db_path, *tables):
+    """Cache key of the content of the tables: their keys from build_table_keys; tables without a key (e.g. after an
+    incremental build or for metric_comparison, which changes with every build) are keyed by the database version."""
+    keys = load_content_keys(db_path)
+    return tuple(keys.get(table, db_path) for table in tables)
+
+
+@st.cache_data(max_entries=2)
+def _load_scalars(_db_path, content):
+    print("Loading scalar metrics from DB...")
+    with db_pool.cursor(_db_path) as con:
+        return fetch_df(con, "SELECT * FROM scalar_metrics").iloc[0]
+
+
+def load_scalars(db_path):
+    """Reads the single row of 'scalar_metrics' once per content (pandas.Series)."""
+    return _load_scalars(db_path, content_key(db_path, "scalar_metrics"))
+
+
+@st.cache_data(max_entries=64)
+def _load_table(_db_path, content, table):
     start_time = time.time()
-    con = get_db_connection()
-    issues_df = con.execute("SELECT * FROM issues").df().iloc[0]
-    print(f"Loaded issues metrics in {round(time.time() - start_time, 2)}s")
-    return issues_df
+    with db_pool.cursor(_db_path) as con:
+        df = fetch_df(con, f"SELECT * FROM {table}")
+    print(f"Loaded {table} ({len(df)} rows) in {round(time.time() - start_time, 2)}s")
+    return df
+
+
+def load_table(db_path, table): # jede Tabelle wird einzeln und erst beim ersten Zugriff geladen und gecached
+    """Loads one table of the given database version (cached by its content, see content_key)."""
+    return _load_table(db_path, content_key(db_path, table), table)
+
+
+@st.cache_data(max_entries=64)
+def count_table_rows(_db_path, content, table, filters=None, search=None, period=None):
+    """Number of rows of a table (matching the filters, see db_io.fetch_page), without loading it."""
+    with db_pool.cursor(_db_path) as con:
+        return count_rows(con, table, filters, search, period)
+
+
+@st.cache_data(max_entries=256)
+def load_table_page(_db_path, content, table, filters=None, search=None, period=None, order_by=None, descending=False, page_size=50, page=0):
+    """Loads one page of a detail table, filtering, sorting and paging run in DuckDB (see db_io.fetch_page)."""
+    with db_pool.cursor(_db_path) as con:
+        return fetch_page(con, table, filters, search, period, order_by, descending, limit=page_size, offset=page * page_size)
+
+
+@st.cache_data(max_entries=128)
+def load_monthly_counts(_db_path, content, table, time_col="CRMEingangszeit", period=None):
+    """Rows per month of a detail table (trend charts), aggregated in DuckDB (see db_io.monthly_counts)."""
+    with db_pool.cursor(_db_path) as con:
+        return monthly_counts(con, table, time_col, period=period)
+
+
+@st.cache_data(max_entries=64)
+def load_table_columns(_db_path, content, table):
+    """Column names of a table."""
+    with db_pool.cursor(_db_path) as con:
+        return [col[0] for col in con.execute(f"SELECT * FROM {table} LIMIT 0").description]
+
+
+@st.cache_data(max_entries=64)
+def load_distinct_values(_db_path, content, table, column):
+    """Sorted distinct values of a column (options of the column filters of the detail tables)."""
+    with db_pool.cursor(_db_path) as con:
+        return fetch_df(con, f'SELECT DISTINCT "{column}" FROM {table} WHERE "{column}" IS NOT NULL ORDER BY 1').iloc[:, 0].tolist()
+
+
+def table_loader(table, transform=None):
+    """Loader of a LazyMetrics value: the table (optionally transformed, e.g. set_index)."""
+    if transform is None:
+        return lambda db_path: load_table(db_path, table)
+    return lambda db_path: transform(load_table(db_path, table))
+
+
+def sql_table_loader(table):
+    """Loader of a LazyMetrics value: a SqlTable handle, the rows stay in the database until a page shows them."""
+    return lambda db_path: SqlTable(db_path, table)
+
+
+def scalar_loader(name, default=None):
+    """Loader of a LazyMetrics value: a column of 'scalar_metrics' (default if the column does not exist)."""
+    def load(db_path):
+        scalars = load_scalars(db_path)
+        return scalars[name] if name in scalars else default
+    return load
+
+
+class LazyMetrics(Mapping):
+    """Read-only dict of metrics whose values are loaded when a page accesses them (e.g. metrics_df1.get("proforma_belege_df")).
+
+    Parameters
+    ----------
+    db_path : str
+        database version to load from
+    loaders : dict
+        key -> function of db_path returning the value (see table_loader and scalar_loader)
+
+    Every value is loaded at most once per rerun; the tables and scalars themselves are cached across reruns by
+    load_table/load_scalars, so a page only pays for the tables it shows.
+    """
+    def __init__(self, db_path, loaders):
+        self.db_path = db_path
+        self._loaders = loaders
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._loaders[key](self.db_path)
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._loaders)
+
+    def __len__(self):
+        return len(self._loaders)
+
+
+class SqlTable:
+    """Handle of a detail table that stays in DuckDB; app_pages.table_view.paged_table only fetches the rows of the visible page.
+
+    Parameters
+    ----------
+    db_path : str
+        database version to read from
+    table : str
+        name of the table
+    """
+    def __init__(self, db_path, table):
+        self.db_path = db_path
+        self.table = table
+        self.content = content_key(db_path, table)
+
+    @property
+    def columns(self):
+        return load_table_columns(self.db_path, self.content, self.table)
+
+    def count(self, filters=None, search=None, period=None):
+        return count_table_rows(self.db_path, self.content, self.table, filters, search, period)
+
+    def page(self, page, page_size, filters=None, search=None, period=None, order_by=None, descending=False):
+        return load_table_page(self.db_path, self.content, self.table, filters, search, period, order_by, descending, page_size, page)
+
+    def monthly_counts(self, time_col="CRMEingangszeit", period=None):
+        return load_monthly_counts(self.db_path, self.content, self.table, time_col, period)
+
+    def distinct(self, column):
+        return load_distinct_values(self.db_path, self.content, self.table, column)
+
+    def to_csv(self, filters=None, search=None, period=None, order_by=None, descending=False):
+        """All rows matching the filters as CSV (bytes), built when the download is prepared."""
+        with db_pool.cursor(self.db_path) as con:
+            df = fetch_page(con, self.table, filters, search, period, order_by, descending)
+        return df.to_csv(index=False).encode('utf-8')
+
+
+# Vorberechnete Daten für Auftragsdaten (Rohdaten werden nicht vorgehalten)
+METRICS_DF1 = {
+    "row_count": scalar_loader('count_total_orders'),
+    "null_ratio_cols": table_loader("metric_null_ratios_per_column"),
+    "null_ratio_rows": scalar_loader('null_row_ratio_orders'),
+    "test_kundengruppen_anzahl": scalar_loader('count_test_data_rows'),
+    "test_data_df": sql_table_loader("metric_test_data_entries"),
+    "plausi_forderung_einigung_df": table_loader("metric_plausibility_diffs_auftragsdaten"),
+    "plausi_forderung_einigung_count": scalar_loader('count_plausibility_errors_df'),
+    "plausi_forderung_einigung_avg_diff": scalar_loader('avg_plausibility_diff_df'),
+    "grouped_col_ratios": table_loader("metric_cleanliness_cols_grouped_auftragsdaten", lambda df: df.set_index('Kundengruppe')),
+    "grouped_row_ratios": table_loader("metric_cleanliness_rows_grouped_auftragsdaten", lambda df: df.set_index('Kundengruppe')['row_null_ratio']),
+    "proforma_belege_df": table_loader("metric_proforma"),
+    "proforma_belege_count": scalar_loader('count_proforma_receipts'),
+    "above_50k_df": sql_table_loader("metric_above_50k"),
+    "zeitwert_error_df": sql_table_loader("metric_zeitwert_errors"),
+    "zeitwert_errors_count": lambda db_path: SqlTable(db_path, "metric_zeitwert_errors").count(),
+    "error_frequency_weekday_hour": table_loader("metric_error_heatmap"),
+    "false_negative": table_loader("metric_fn_stats_df1", lambda df: df['Fehler'].sum()),
+    "handwerker_gewerke_outlier": table_loader("metric_handwerker_outliers"),
+    "outlier_hotspots_gewerk": table_loader("metric_outlier_hotspots_gewerk"),
+    "outlier_hotspots_handwerker": table_loader("metric_outlier_hotspots_handwerker"),
+    "false_negative_stats": table_loader("metric_fn_stats_df1"),
+    "false_negative_details": table_loader("metric_fn_details_df1"),
+    "empty_orders_count": scalar_loader('count_empty_orders'),
+    "mismatched_entries": table_loader("metric_semantic_mismatches"),
+    "semantic_pair_scores": table_loader("metric_semantic_pair_scores"),
+    "empty_orders_df": sql_table_loader("metric_empty_orders_dataframe"),
+    "outliers_by_damage": sql_table_loader("metric_outliers_by_damage"),
+}
+
+# Analog für alle Metriken zu Positionsdaten
+METRICS_DF2 = {
+    "row_count": scalar_loader('count_total_positions'),
+    "null_ratio_cols": table_loader("metric_cleanliness_cols_ungrouped_positionsdaten"),
+    "null_ratio_rows": scalar_loader('null_row_ratio_positions', default=0),
+    "discount_check_errors": scalar_loader('count_discount_logic_errors'),
+    "position_counts_per_rechnung": table_loader("metric_position_count_positionsdaten"),
+    "plausi_forderung_einigung_count": scalar_loader("count_plausibility_errors_df2"),
+    "plausi_forderung_einigung_avg_diff": scalar_loader("avg_plausibility_diff_df2"),
+    "false_negative_stats": table_loader("metric_fn_stats_df2"),
+    "false_negative_details": sql_table_loader("metric_fn_details_df2"),
+    "discount_stats": table_loader("metric_discount_stats"),
+    "discount_details": sql_table_loader("metric_discount_details"),
+    "plausi_forderung_einigung_df2": table_loader("metric_plausibility_diffs_positionsdaten"),
+}
+
+# Analog für alle Metriken über beide Datensets
+METRICS_COMBINED = {
+    "kvarechnung_id_is_unique": lambda db_path: bool(load_scalars(db_path)['is_unique_kva_id']),
+    "kvarechnung_nummer_land_is_unique": lambda db_path: bool(load_scalars(db_path)['is_unique_kva_nr_per_land']),
+    "position_id_is_unique": lambda db_path: bool(load_scalars(db_path)['is_unique_position_id']),
+    "auftraege_abgleich": sql_table_loader("metric_order_pos_mismatch"),
+}
+
+
+@st.cache_data(max_entries=8)
+def _compute_grouped_cleanliness(_db_path, content, group_by_col):
+    with db_pool.cursor(_db_path) as con:
+        return ms.data_cleanliness(con, "auftragsdaten", group_by_col=group_by_col)
+
+def compute_grouped_cleanliness(db_path, group_by_col):
+    """Null ratios of the rows and columns of the Auftragsdaten per group of any column (one GROUP BY in DuckDB, see metrics_sql.data_cleanliness)."""
+    return _compute_grouped_cleanliness(db_path, content_key(db_path, "auftragsdaten"), group_by_col)
+
+@st.cache_data(max_entries=32)
+def _compute_issue_heatmap(_db_path, content, issue_table):
+    with db_pool.cursor(_db_path) as con:
+        return ms.error_frequency_by_weekday_hour(con, issue_table=issue_table)
+
+def compute_issue_heatmap(db_path, issue_table):
+    """Weekday x hour heatmap of the orders contained in the detail table of a check (one aggregation in DuckDB, see metrics_sql.error_frequency_by_weekday_hour)."""
+    return _compute_issue_heatmap(db_path, content_key(db_path, "auftragsdaten", *filter(None, [issue_table])), issue_table)
 
 # CSS
 st.markdown("""
@@ -261,18 +341,27 @@ with nav_col2:
 
 
 # PAGE ROUTING
-# data frames zur Weitergabe an page-module 
-metrics_df1 = compute_metrics_df1()
-metrics_df2 = compute_metrics_df2()
-metrics_combined = compute_metrics_combined()
-comparison_df = compute_comparison_metrics()
-issues_df = compute_issues_df()
+# aktuell veröffentlichte Datenbankversion (neue Versionen werden ohne Neustart geladen, Cache-Keys siehe content_key)
+db_path = current_db_path()
+if db_path is None:
+    st.error("Keine Datenbank gefunden. Bitte zuerst build_db.py ausführen.")
+    st.stop()
+
+# Metriken zur Weitergabe an page-module, Tabellen werden erst geladen, wenn eine Seite sie abfragt
+metrics_df1 = LazyMetrics(db_path, METRICS_DF1)
+metrics_df2 = LazyMetrics(db_path, METRICS_DF2)
+metrics_combined = LazyMetrics(db_path, METRICS_COMBINED)
+if selected != "Data Drift":
+    comparison_df = load_table(db_path, "metric_comparison")
+    issues_df = load_table(db_path, "issues").iloc[0]
 print(f"Global data loaded in {round(time.time() - start_global, 2)}s")
 
 if selected == "Startseite":
     start = time.time()
-    pos_time = compute_positions_over_time()
-    page1.show_page(metrics_df1, metrics_df2, metrics_combined, pos_time, comparison_df, issues_df)
+    pos_time = load_table(db_path, "metric_positions_over_time")
+    page1.show_page(metrics_df1, metrics_df2, metrics_combined, pos_time, comparison_df, issues_df,
+                    issue_heatmap=lambda issue_table: compute_issue_heatmap(db_path, issue_table),
+                    grouped_cleanliness=lambda group_by_col: compute_grouped_cleanliness(db_path, group_by_col))
     print("page 1 render time:", round(time.time() - start, 2), "s")
 
 elif selected == "Numerische Daten":
@@ -292,5 +381,5 @@ elif selected == "Plausibilitätscheck":
 
 elif selected == "Data Drift":
     start = time.time()
-    page5.show_page()
-    print("page 5 render time:", round(time.time() - start, 2), "s")
\ No newline at end of file
+    page5.show_page(db_path)
+    print("page 5 render time:", round(time.time() - start, 2), "s")
@@ -0,0 +1,178 @@
+import os
+import pandas as pd
+import pyarrow as pa
+
+"""
+Helper functions for reading the dashboard database (build_db.py and db_dashboard.py): location of the published database version
+Arrow-based fetching of query results,
+and paged queries of the detail tables with filtering and sorting in DuckDB (dashboard tables, see app_pages/table_view.py).
+
+Query results are fetched as Arrow tables and converted to pandas without materializing Python string objects:
+VARCHAR columns become pyarrow-backed strings (pandas 'string[pyarrow]'), ENUM columns become categories as with .df().
+"""
+
+DB_DIR = "resources"
+# database of builds before versioning was introduced, used as long as no version has been published
+DB_LEGACY_PATH = os.path.join(DB_DIR, "dashboard_data.duckdb")
+# build_db.py writes every build into its own file 'dashboard_data_<version>.duckdb' and publishes it by atomically replacing this pointer file
+DB_POINTER_PATH = os.path.join(DB_DIR, "CURRENT")
+
+# content key of every table of a version, written by full builds (build_cache.table_keys); the dashboard caches are keyed by it
+TABLE_KEYS = "build_table_keys"
+
+# VARCHAR -> 'string[pyarrow]' (shares the Arrow buffers instead of creating one Python object per value)
+ARROW_TYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+}
+
+# integer columns -> pandas nullable integers, so columns with missing values keep their type (e.g. Int16) instead of becoming float64
+NULLABLE_INT_TYPES = {
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype(),
+}
+
+
+# ENUM columns arrive as dictionaries with unsigned indices, which pyarrow < 22 can not convert to pandas: next wider signed type
+SIGNED_INDEX_TYPES = {
+    pa.uint8(): pa.int16(),
+    pa.uint16(): pa.int32(),
+    pa.uint32(): pa.int64(),
+}
+
+
+def _signed_dictionaries(table):
+    """Helper function. Casts dictionary columns with unsigned indices (DuckDB ENUM) to signed indices, other columns are kept."""
+    fields = [pa.field(f.name, pa.dictionary(SIGNED_INDEX_TYPES[f.type.index_type], f.type.value_type), f.nullable)
+              if pa.types.is_dictionary(f.type) and f.type.index_type in SIGNED_INDEX_TYPES else f
+              for f in table.schema]
+    schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table if schema.equals(table.schema) else table.cast(schema)
+
+
+def fetch_df(con, query, params=None, nullable_int=False):
+    """Runs a query and returns the result as pandas.DataFrame via Arrow.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection (or cursor) to run the query on
+    query : str
+        SQL query
+    params : list, optional
+        parameters of a prepared statement, by default None
+    nullable_int : bool, optional
+        If True, integer columns are returned as pandas nullable integers (round trip of cleaned data), by default False
+
+    Returns
+    -------
+    pandas.DataFrame
+        result with pyarrow-backed string columns; timestamps keep nanosecond resolution as with .df()
+    """
+    table = _signed_dictionaries(con.execute(query, params).fetch_arrow_table())
+    types = {**ARROW_TYPES, **NULLABLE_INT_TYPES} if nullable_int else ARROW_TYPES
+    return table.to_pandas(types_mapper=types.get, coerce_temporal_nanoseconds=True)
+
+
+def table_keys(con):
+    """Returns the content keys of the tables of a database version (table -> key), empty if it has none (e.g. after an incremental build)."""
+    if not con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [TABLE_KEYS]).fetchone()[0]:
+        return {}
+    return dict(con.execute(f"SELECT name, cache_key FROM {TABLE_KEYS}").fetchall())
+
+
+def _where(filters=None, search=None, period=None):
+    """Helper function. Builds the WHERE clause and its parameters of fetch_page/count_rows (see fetch_page)."""
+    conditions, params = [], []
+    if period:
+        # plain comparisons with the column, so DuckDB skips the row groups outside the period (tables sorted by time, see build_db.py)
+        conditions.append(f'"{period[0]}" >= ? AND "{period[0]}" < ?')
+        params.extend(period[1:])
+    for column, values in (filters or {}).items():
+        if len(values):
+            conditions.append(f'"{column}" IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+    if search and search[1]:
+        conditions.append(f'CAST("{search[0]}" AS VARCHAR) ILIKE ?')
+        params.append(f"%{search[1]}%")
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def fetch_page(con, table, filters=None, search=None, period=None, order_by=None, descending=False, limit=None, offset=0):
+    """Returns one page of the (filtered and sorted) rows of a table; filtering, sorting and paging run in DuckDB.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection (or cursor) to run the query on
+    table : str
+        table to read
+    filters : dict, optional
+        column -> list of values, keeps the rows whose value is in the list (empty lists are ignored), by default None
+    search : tuple, optional
+        (column, text), keeps the rows whose value contains text (case-insensitive), by default None
+    period : tuple, optional
+        (column, start, end), keeps the rows with start <= value < end, by default None
+    order_by : str, optional
+        column to sort by (missing values last), by default None (order of the table)
+    descending : bool, optional
+        sort descending, by default False
+    limit : int, optional
+        page size, by default None (all rows)
+    offset : int, optional
+        number of rows to skip, by default 0
+
+    Returns
+    -------
+    pandas.DataFrame
+        rows of the page
+    """
+    where, params = _where(filters, search, period)
+    # rowid as tie breaker keeps the pages disjoint if the sort column contains duplicates
+    order = f'"{order_by}" {"DESC" if descending else "ASC"} NULLS LAST, rowid' if order_by else "rowid"
+    page = f" LIMIT {int(limit)} OFFSET {int(offset)}" if limit is not None else ""
+    return fetch_df(con, f"SELECT * FROM {table}{where} ORDER BY {order}{page}", params)
+
+
+def count_rows(con, table, filters=None, search=None, period=None):
+    """Number of rows of a table matching the filters of fetch_page."""
+    where, params = _where(filters, search, period)
+    return con.execute(f"SELECT count(*) FROM {table}{where}", params).fetchone()[0]
+
+
+def monthly_counts(con, table, time_col="CRMEingangszeit", filters=None, period=None):
+    """Number of rows per month of a table (matching the filters of fetch_page).
+
+    Returns
+    -------
+    pandas.DataFrame
+        columns 'Monat' (first day of the month) and 'Anzahl', sorted by month; rows without timestamp are not counted
+    """
+    where, params = _where(filters, None, period)
+    where = (where + " AND" if where else " WHERE") + f' "{time_col}" IS NOT NULL'
+    return fetch_df(con, f"""
+        SELECT date_trunc('month', "{time_col}")::TIMESTAMP AS Monat, count(*) AS Anzahl
+        FROM {table}{where}
+        GROUP BY 1 ORDER BY 1
+    """, params)
+
+
+def current_db_path():
+    """Returns the path of the currently published database.
+
+    Returns
+    -------
+    str or None
+        database file named in resources/CURRENT, the unversioned resources/dashboard_data.duckdb if nothing has been published yet,
+        or None if no database exists
+    """
+    try:
+        with open(DB_POINTER_PATH, encoding="utf-8") as f:
+            path = os.path.join(DB_DIR, f.read().strip())
+        if os.path.exists(path):
+            return path
+    except FileNotFoundError:
+        pass
+    return DB_LEGACY_PATH if os.path.exists(DB_LEGACY_PATH) else None
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextlib import contextmanager
+import duckdb
+
+"""
+Thread-safe cursor pool for the dashboard database (db_dashboard.py and all pages).
+
+Every database version is opened once (one read-only DuckDB instance). Queries run on cursors of this instance: a thread checks
+out an idle cursor (or creates a new one), uses it exclusively and returns it afterwards. Concurrent Streamlit sessions therefore
+query in parallel instead of serializing on one shared connection, and no rerun pays for opening the database file.
+
+Usage:
+    with db_pool.cursor(db_path) as con:
+        df = fetch_df(con, "SELECT ...")
+"""
+
+# cursors per database version; further threads wait until a cursor is returned
+MAX_CURSORS = 8
+# database versions kept open (the published one and the previous one, until all sessions have switched)
+MAX_DATABASES = 2
+
+
+class _Database:
+    """Helper class. Connection and cursors of one database version."""
+    def __init__(self, path):
+        self.connection = duckdb.connect(path, read_only=True)
+        self.idle = []
+        self.in_use = 0
+        self.slots = threading.Semaphore(MAX_CURSORS)
+        self.retired = False
+
+
+class ConnectionPool:
+    """Pool of read-only DuckDB cursors, one database instance per database version.
+
+    Parameters
+    ----------
+    max_databases : int, optional
+        number of database versions kept open, the least recently opened one is closed first, by default MAX_DATABASES
+    """
+    def __init__(self, max_databases=MAX_DATABASES):
+        self.max_databases = max_databases
+        self._lock = threading.Lock()
+        self._databases = {} # path -> _Database, in the order they were opened
+        self._stats = {"connections_opened": 0, "cursors_created": 0, "checkouts": 0, "waits": 0, "wait_s": 0.0}
+
+    def _database(self, path):
+        """Helper function. Returns the open database of path, opens it (and retires the oldest one) if needed."""
+        with self._lock:
+            db = self._databases.get(path)
+            if db is None:
+                db = self._databases[path] = _Database(path)
+                self._stats["connections_opened"] += 1
+                while len(self._databases) > self.max_databases:
+                    oldest = self._databases.pop(next(iter(self._databases)))
+                    oldest.retired = True
+                    self._close_idle(oldest)
+            return db
+
+    @staticmethod
+    def _close_idle(db):
+        """Helper function. Closes the idle cursors of a retired database and the database itself once no cursor is in use."""
+        for cur in db.idle:
+            cur.close()
+        db.idle.clear()
+        if db.in_use == 0:
+            db.connection.close()
+
+    @contextmanager
+    def cursor(self, path):
+        """Checks out a cursor of the database at path for the calling thread and returns it to the pool afterwards.
+
+        Parameters
+        ----------
+        path : str
+            database version (e.g. db_io.current_db_path())
+
+        Yields
+        ------
+        duckdb.DuckDBPyConnection
+            cursor that is used by the calling thread only
+        """
+        while True:
+            db = self._database(path)
+            if not db.slots.acquire(blocking=False):
+                start = time.perf_counter()
+                db.slots.acquire()
+                with self._lock:
+                    self._stats["waits"] += 1
+                    self._stats["wait_s"] += time.perf_counter() - start
+            with self._lock:
+                if not db.retired:
+                    cur = db.idle.pop() if db.idle else None
+                    db.in_use += 1
+                    self._stats["checkouts"] += 1
+                    if cur is None:
+                        # created while holding the lock, so the database can not be closed in between
+                        cur = db.connection.cursor()
+                        self._stats["cursors_created"] += 1
+                    break
+            # retired (and possibly closed) in the meantime: open the version again
+            db.slots.release()
+        try:
+            yield cur
+        finally:
+            with self._lock:
+                db.in_use -= 1
+                if db.retired:
+                    cur.close()
+                    if db.in_use == 0 and not db.idle:
+                        db.connection.close()
+                else:
+                    db.idle.append(cur)
+            db.slots.release()
+
+    def metrics(self):
+        """Counters (opened databases, created cursors, checkouts, waits for a free cursor) and current state (open databases, cursors in use/idle) as dict."""
+        with self._lock:
+            return {
+                **self._stats,
+                "databases": len(self._databases),
+                "cursors_in_use": sum(db.in_use for db in self._databases.values()),
+                "cursors_idle": sum(len(db.idle) for db in self._databases.values()),
+            }
+
+
+# pool shared by all sessions and pages of the dashboard process
+pool = ConnectionPool()
+
+
+def cursor(path):
+    """Checks out a cursor of the shared pool, see ConnectionPool.cursor."""
+    return pool.cursor(path)
@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import duckdb
+from db_io import DB_DIR
+
+"""
+Persistent store of sentence embeddings for metrics.mismatched_entries.
+
+The vocabularies that are encoded (unique Gewerk_Name and Handwerker_Name values) barely change between builds, so every
+normalized embedding is stored once per model in a separate DuckDB file (it is not part of the versioned dashboard database
+and survives all builds). A build only encodes the texts that are not in the store yet.
+
+Table 'embeddings':
+    model   VARCHAR     id of the model (name of the SentenceTransformer model)
+    text    VARCHAR     encoded text
+    vector  FLOAT[]     normalized embedding
+"""
+
+STORE_PATH = os.path.join(DB_DIR, "embeddings.duckdb")
+
+
+class EmbeddingStore:
+    """Embeddings of texts, computed at most once per model and text.
+
+    Parameters
+    ----------
+    path : str, optional
+        DuckDB file of the store (created if it does not exist), by default resources/embeddings.duckdb
+    """
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+    def embeddings(self, texts, model_id, encode):
+        """Returns the embeddings of texts, new texts are encoded and added to the store.
+
+        Parameters
+        ----------
+        texts : array-like of str
+            unique texts, e.g. the uniques of pandas.factorize
+        model_id : str
+            id of the model, embeddings of different models are kept apart
+        encode : callable
+            called with the list of texts missing in the store, returns their normalized embeddings (numpy.ndarray, one row per text)
+
+        Returns
+        -------
+        numpy.ndarray
+            float32 matrix with one row per text, in the order of texts
+        """
+        df_texts = pd.DataFrame({"i": np.arange(len(texts)), "text": pd.Series(texts, dtype=object).astype(str)})
+        with duckdb.connect(self.path) as con:
+            con.execute("CREATE TABLE IF NOT EXISTS embeddings (model VARCHAR, text VARCHAR, vector FLOAT[], PRIMARY KEY (model, text))")
+            stored = con.execute("""
+                SELECT t.i, e.vector FROM df_texts t JOIN embeddings e ON e.model = ? AND e.text = t.text ORDER BY t.i
+            """, [model_id]).fetch_arrow_table()
+            found = stored["i"].to_numpy()
+            missing = np.setdiff1d(df_texts["i"].to_numpy(), found)
+            self.hits += len(found)
+            self.misses += len(missing)
+
+            vectors = None
+            if len(found):
+                values = stored["vector"].combine_chunks().flatten().to_numpy(zero_copy_only=False).astype(np.float32, copy=False)
+                vectors = np.empty((len(texts), len(values) // len(found)), dtype=np.float32)
+                vectors[found] = values.reshape(len(found), -1)
+            if len(missing):
+                new = np.asarray(encode(df_texts["text"].to_numpy()[missing].tolist()), dtype=np.float32)
+                if vectors is None:
+                    vectors = np.empty((len(texts), new.shape[1]), dtype=np.float32)
+                vectors[missing] = new
+                new_rows = pa.table({
+                    "model": pa.array([model_id] * len(missing), pa.string()),
+                    "text": pa.array(df_texts["text"].to_numpy()[missing], pa.string()),
+                    "vector": pa.FixedSizeListArray.from_arrays(pa.array(new.ravel()), new.shape[1]),
+                })
+                con.execute("INSERT INTO embeddings SELECT model, text, vector::FLOAT[] FROM new_rows")
+        if vectors is None: # no texts
+            return np.empty((0, 0), dtype=np.float32)
+        return vectors
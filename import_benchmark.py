@@ -0,0 +1,84 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+import pandas as pd
+
+"""
+Import-time benchmark of the project modules (startup cost of the dashboard and of the ETL scripts).
+
+Every module is imported in a fresh interpreter with 'python -X importtime', so nothing is cached between the measurements.
+For every module the script reports the import time, the wall time of the interpreter (incl. its startup), which of the
+heavy ML/reporting libraries have been loaded, and the most expensive direct imports.
+
+Usage:
+    python import_benchmark.py
+    python import_benchmark.py --repeat 5 --modules metrics data_drift_metrics
+"""
+
+MODULES = [
+    "db_io", "data_cleaning", "cleaning_sql", "metrics", "metrics_sql", "build_db",
+    "data_drift_metrics", "app_pages.page1", "app_pages.page2", "app_pages.page3", "app_pages.page4", "app_pages.page5",
+]
+# libraries that should only be imported by the functions that need them
+HEAVY_MODULES = ["torch", "sentence_transformers", "transformers", "evidently"]
+
+
+def parse_importtime(output):
+    """Parses the output of 'python -X importtime' into a DataFrame (module, depth, self_us, cumulative_us)."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        name = name[1:] # separator space
+        rows.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2,
+                     "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return pd.DataFrame(rows, columns=["module", "depth", "self_us", "cumulative_us"])
+
+
+def measure(module, top=3):
+    """Imports module in a fresh interpreter, returns import/wall time, loaded heavy libraries and the most expensive direct imports."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_s = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    df = parse_importtime(proc.stderr)
+    own = df[(df["module"] == module) & (df["depth"] == 0)]
+    # the lines of the direct imports of module precede its own line and have depth 1
+    end = own.index[-1]
+    begin = df.index[(df.index < end) & (df["depth"] == 0)].max()
+    begin = -1 if pd.isna(begin) else begin
+    direct = df.loc[begin + 1:end - 1]
+    direct = direct[direct["depth"] == 1].nlargest(top, "cumulative_us")
+    loaded = set(df["module"])
+    return {
+        "module": module,
+        "import_s": own["cumulative_us"].iloc[-1] / 1e6,
+        "wall_s": wall_s,
+        "heavy": ", ".join(m for m in HEAVY_MODULES if m in loaded) or "-",
+        "slowest_imports": ", ".join(f"{m} {us / 1e6:.2f}s" for m, us in zip(direct["module"], direct["cumulative_us"])),
+    }
+
+
+def main(modules=MODULES, repeat=3):
+    results = []
+    for module in modules:
+        runs = [measure(module) for _ in range(repeat)]
+        # median run by import time
+        results.append(sorted(runs, key=lambda r: r["import_s"])[len(runs) // 2])
+        print(f"  {module}: {results[-1]['import_s']:.2f}s")
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False, float_format="{:.3f}".format))
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the import time of the project modules in fresh interpreters.")
+    parser.add_argument("--modules", nargs="+", default=MODULES, help="modules to import (default: all project modules)")
+    parser.add_argument("--repeat", type=int, default=3, help="measurements per module, the median is reported (default: 3)")
+    args = parser.parse_args()
+    main(args.modules, args.repeat)
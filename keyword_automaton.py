@@ -0,0 +1,65 @@
+from collections import deque
+
+"""
+Aho-Corasick automaton for multi-keyword substring search (metrics.check_keywords).
+
+All keywords are compiled into one trie with failure links, so a single pass over a text finds every keyword contained
+in it, including overlapping ones (e.g. 'dach' and 'dachdecker' in 'dachdeckerei'). Every keyword carries a label
+(e.g. the trade it belongs to); a search returns the labels of all keywords found.
+"""
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over labeled keywords.
+
+    Parameters
+    ----------
+    keywords : iterable of (str, hashable)
+        pairs (keyword, label); a keyword may occur with several labels
+    """
+    def __init__(self, keywords):
+        # state 0 is the root; goto[state][char] -> state, output[state] = labels of the keywords ending in state
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+        for keyword, label in keywords:
+            state = 0
+            for char in keyword:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].add(label)
+
+        # failure links in breadth-first order: the longest proper suffix of the state that is a prefix of a keyword
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                if state == 0: # children of the root fall back to the root
+                    continue
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                # keywords that end in the suffix end here as well
+                self.output[child] |= self.output[self.fail[child]]
+        self.output = [frozenset(labels) for labels in self.output]
+        # an empty keyword matches every text
+        self.empty_labels = self.output[0]
+
+    def find(self, text):
+        """Returns the labels (frozenset) of all keywords contained in text."""
+        goto, fail, output = self.goto, self.fail, self.output
+        labels = set(self.empty_labels)
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                labels |= output[state]
+        return frozenset(labels)
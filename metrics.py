@@ -1,8 +1,7 @@
 import pandas as pd
 import numpy as np
-import re
-from sentence_transformers import SentenceTransformer
-import torch
+import warnings
+from keyword_automaton import KeywordAutomaton
 
 def load_data():
     df = pd.read_parquet("resources/Auftragsdaten_konvertiert")
@@ -181,7 +180,7 @@ def data_cleanliness(input_df,group_by_col="Kundengruppe", specific_group=None):
     input_df : pandas.DataFrame
         DataFrame that is to be evaluated.
     group_by_col: string, optional
-        Column identifier for grouping, default = 'Kundengruppe'
+        Column identifier for grouping (any categorical column, e.g. 'Land', 'Schadenart_Name', 'Gewerk_Name'), default = 'Kundengruppe'
     specific_group: string, optional
         Passes a group entry to filter the result by, if any. Default = None   
 
@@ -210,14 +209,15 @@ def data_cleanliness(input_df,group_by_col="Kundengruppe", specific_group=None):
 
     else:
 
-        grouped = input_df.groupby(group_by_col,observed=True)
+        keys = input_df[group_by_col]
 
-        # Group for columns & rows
-        grouped_null_counts = grouped.apply(lambda x: x.isnull().sum(), include_groups=False)
-        grouped_null_rows = grouped.apply(lambda x: x.isnull().any(axis=1).sum(), include_groups=False)
+        # null mask computed once (without the group column), aggregated per group with one groupby each for columns & rows
+        null_mask = input_df.drop(columns=group_by_col).isna()
+        grouped_null_counts = null_mask.groupby(keys, observed=True).sum()
+        grouped_null_rows = null_mask.any(axis=1).groupby(keys, observed=True).sum()
 
         # create group sizes
-        group_sizes = grouped.size()
+        group_sizes = keys.groupby(keys, observed=True).size()
 
         # calculate ratios
         grouped_col_ratios = grouped_null_counts.div(group_sizes, axis=0)
@@ -452,19 +452,23 @@ def positions_per_order_over_time(df, df2, time_col="CRMEingangszeit"):
 
     return result
 
-def error_frequency_by_weekday_hour(df, time_col="CRMEingangszeit", relevant_columns=None):
+def error_frequency_by_weekday_hour(df, time_col="CRMEingangszeit", relevant_columns=None, issue=None):
     """
     Aggregiert die Fehlerhäufigkeit (NaN-Werte) nach Wochentag und Stunde. Ein Auftrag gilt als fehlerhaft, wenn in mindestens einer der relevanten Spalten ein NaN-Wert vorkommt.
+    Es werden nur die benötigten Spalten gelesen, df wird nicht kopiert.
 
     Parameters
     ----------
         df: pandas.DataFrame
             Auftragsdaten-DataFrame (z.B. Auftragsdaten_konvertiert),muss 'KvaRechnung_ID' und die Zeitspalte enthalten.
         time_col: string
-            Name der Zeitspalte in df, z.B. 'CRMEingangszeit'.
+            Name der Zeitspalte in df, z.B. 'CRMEingangszeit'. Bereits typisierte Zeitstempel werden direkt verwendet.
         relevant_columns: list
             Liste der Spalten, die auf NaN geprüft werden sollen.
             Wenn None -> alle Spalten außer 'KvaRechnung_ID' und time_col.
+        issue: array-like of bool, optional
+            Fehler-Flag je Zeile von df (z.B. df['KvaRechnung_ID'].isin(<Detailtabelle einer Prüfung>['KvaRechnung_ID'])).
+            Ersetzt die NaN-Prüfung, so entsteht die Heatmap für eine beliebige Prüfung.
 
     Returns
     -------
@@ -477,127 +481,182 @@ def error_frequency_by_weekday_hour(df, time_col="CRMEingangszeit", relevant_col
             - 'error_rate'  : Fehlerquote in Prozent
     """
 
-    work_df = df.copy()
+    # Zeitspalte nur umwandeln, wenn sie noch nicht vom Typ datetime ist
+    times = df[time_col]
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, errors="coerce")
 
-    # Zeitspalte in datetime umwandeln
-    work_df[time_col] = pd.to_datetime(work_df[time_col], errors="coerce")
-    work_df = work_df.dropna(subset=[time_col])
-
-    # Wochentag + Stunde extrahieren
-    work_df["weekday"] = work_df[time_col].dt.day_name()
-    work_df["hour"] = work_df[time_col].dt.hour
-
-    # Relevante Spalten bestimmen
-    if relevant_columns is None:
-        exclude = {time_col, "KvaRechnung_ID", "weekday", "hour"}
-        relevant_columns = [c for c in work_df.columns if c not in exclude]
-
-    if not relevant_columns:
-        raise ValueError("Keine relevanten Spalten für die Fehlerprüfung gefunden.")
-
-    # Error = mind. ein NaN in den relevanten Spalten
-    work_df["has_error"] = work_df[relevant_columns].isna().any(axis=1)
+    if issue is not None:
+        has_error = np.asarray(issue, dtype=bool)
+        if len(has_error) != len(df):
+            raise ValueError("issue muss genau einen Wert je Zeile von df enthalten.")
+    else:
+        # Relevante Spalten bestimmen
+        if relevant_columns is None:
+            exclude = {time_col, "KvaRechnung_ID"}
+            relevant_columns = [c for c in df.columns if c not in exclude]
+
+        if not relevant_columns:
+            raise ValueError("Keine relevanten Spalten für die Fehlerprüfung gefunden.")
+
+        # Error = mind. ein NaN in den relevanten Spalten, spaltenweise akkumuliert (keine Kopie von df)
+        has_error = np.zeros(len(df), dtype=bool)
+        for col in relevant_columns:
+            has_error |= df[col].isna().to_numpy()
+
+    # Zeit-Slot je Auftrag: Wochentag (Montag = 0) * 24 + Stunde
+    valid = times.notna().to_numpy()
+    times = times[valid]
+    slot = times.dt.dayofweek.to_numpy() * 24 + times.dt.hour.to_numpy()
+    rows = np.bincount(slot, minlength=7 * 24)
+    total_rows = np.bincount(slot, weights=df["KvaRechnung_ID"].notna().to_numpy()[valid], minlength=7 * 24)
+    error_rows = np.bincount(slot, weights=has_error[valid], minlength=7 * 24)
 
-    result = (
-        work_df
-        .groupby(["weekday", "hour"],observed=True)
-        .agg(
-            total_rows=("KvaRechnung_ID", "count"),
-            error_rows=("has_error", "sum"),
-        )
-        .reset_index()
-    )
+    weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+    observed = np.flatnonzero(rows)
+    result = pd.DataFrame({
+        "weekday": pd.Categorical.from_codes(observed // 24, categories=weekday_order, ordered=True),
+        "hour": (observed % 24).astype(np.int32),
+        "total_rows": total_rows[observed].astype(np.int64),
+        "error_rows": error_rows[observed].astype(np.int64),
+    })
 
     result["error_rate"] = result["error_rows"] / result["total_rows"] * 100
 
-    weekday_order = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    result["weekday"] = pd.Categorical(result["weekday"], categories=weekday_order, ordered=True)
-    result = result.sort_values(["weekday", "hour"])
-
     return result
 
 
-def mismatched_entries(df, threshold=0.2, process_batch_size=16384, encode_batch_size=128):
-    """
-    Calculates the semantic similarity between 'Gewerk_Name' and 'Handwerker_Name' using a 
-    Sentence Transformer model on the GPU. Identifies entries where the similarity score 
-    falls below the threshold.(< 0.2).
-    
-    Parameters:
+SEMANTIC_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+# inference backends of the semantic check:
+#   'torch'      full precision PyTorch (GPU if available)
+#   'int8'       PyTorch on CPU with dynamically int8-quantized linear layers
+#   'onnx'       exported ONNX graph, run by onnxruntime on CPU (pip install sentence-transformers[onnx])
+#   'onnx-int8'  int8-quantized ONNX graph of the model repository, run by onnxruntime on CPU
+SEMANTIC_BACKENDS = ('torch', 'int8', 'onnx', 'onnx-int8')
+ONNX_INT8_FILE = 'onnx/model_quint8_avx2.onnx'
+
+def load_semantic_model(backend='torch', device='cpu', num_threads=None):
+    """Helper function. Loads the Sentence Transformer model of the semantic check with the given inference backend.
+
+    Parameters
     ----------
-        df: pandas.DataFrame
-            DataFrame (Auftragsdaten) that contains the columns 'Gewerk_Name' and 'Handwerker_Name'.
-        threshold: float, optional
-            Similarity threshold (default: 0.2). Values below this limit are considered mismatches.
-            The optimal threshold in a production system would need to be evaluated further. 
-        process_batch_size: int, optional
-            Number of rows to be compared simultaneously (high value possible, e.g. 16384).
-        encode_batch_size: int, optional
-            Number of unique terms to be vectorized simultaneously by the model (low value recommended, e.g. 128).
+    backend : str, optional
+        one of SEMANTIC_BACKENDS, by default 'torch'
+    device : str, optional
+        device of the 'torch' backend, all other backends run on the CPU, by default 'cpu'
+    num_threads : int, optional
+        intra-op threads of onnxruntime (the PyTorch backends are limited in semantic_similarity), by default None (all cores)
 
-    Returns:
+    Returns
     -------
-        mismatches: pandas.DataFrame
-            DataFrame containing rows where 'Similarity_Score' < threshold.
-            The results are sorted ascending by similarity and include the new column 'Similarity_Score'.
+    sentence_transformers.SentenceTransformer
     """
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Running on: {device}")
-    
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2', device=device)
+    # imported on first use, importing torch takes several seconds (see import_benchmark.py)
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if backend == 'torch':
+        return SentenceTransformer(SEMANTIC_MODEL, device=device)
+    if backend == 'int8':
+        model = SentenceTransformer(SEMANTIC_MODEL, device='cpu')
+        with warnings.catch_warnings():
+            # torch.ao.quantization is deprecated in newer PyTorch versions, dynamic quantization still works there
+            warnings.simplefilter('ignore')
+            return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend in ('onnx', 'onnx-int8'):
+        try:
+            import onnxruntime # optional dependency, only needed for the ONNX backends
+        except ImportError as e:
+            raise ImportError(f"The backend '{backend}' needs onnxruntime and optimum: pip install sentence-transformers[onnx]") from e
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        model_kwargs = {'provider': 'CPUExecutionProvider', 'session_options': session_options}
+        if backend == 'onnx-int8':
+            model_kwargs['file_name'] = ONNX_INT8_FILE
+        return SentenceTransformer(SEMANTIC_MODEL, device='cpu', backend='onnx', model_kwargs=model_kwargs)
+    raise ValueError(f"Unknown backend '{backend}', expected one of {SEMANTIC_BACKENDS}")
+
+def _distinct_pairs(df):
+    """Helper function. Factorizes the (Gewerk_Name, Handwerker_Name) pairs of df (rows with both names).
 
-    df = df.dropna(subset=['Gewerk_Name', 'Handwerker_Name']).copy()
+    Returns
+    -------
+    pair_codes: numpy.ndarray
+        code of the pair of every row (position in pairs)
+    pairs: pandas.DataFrame
+        one row per distinct pair: 'Gewerk_Name', 'Handwerker_Name', 'count' (number of rows)
+    """
     gewerk_codes, unique_gewerke = pd.factorize(df['Gewerk_Name'])
     handwerker_codes, unique_handwerker = pd.factorize(df['Handwerker_Name'])
+    # one int64 per combination of the two codes, factorized again -> code of the pair
+    pair_codes, pair_keys = pd.factorize(gewerk_codes.astype(np.int64) * len(unique_handwerker) + handwerker_codes)
+    pairs = pd.DataFrame({
+        'Gewerk_Name': unique_gewerke.take(pair_keys // len(unique_handwerker)),
+        'Handwerker_Name': unique_handwerker.take(pair_keys % len(unique_handwerker)),
+        'count': np.bincount(pair_codes, minlength=len(pair_keys)),
+    })
+    return pair_codes, pairs
+
+def _pair_similarity(pairs, process_batch_size, encode_batch_size, embedding_store, backend, num_threads):
+    """Helper function. Cosine similarity of the names of every pair (see semantic_similarity), float32 array in the order of pairs."""
+    import torch # imported on first use, see load_semantic_model
+    device = "cuda" if backend == 'torch' and torch.cuda.is_available() else "cpu"
+    print(f"Running on: {device} ({backend})")
+    # embeddings of the backends differ slightly, so each one has its own entries in the store
+    model_id = SEMANTIC_MODEL if backend == 'torch' else f"{SEMANTIC_MODEL}:{backend}"
+    
+    model = None
+
+    def encode(texts):
+        # the model is loaded on first use
+        nonlocal model
+        if model is None:
+            model = load_semantic_model(backend, device, num_threads)
+        torch_threads = torch.get_num_threads()
+        if num_threads and not backend.startswith('onnx'):
+            torch.set_num_threads(num_threads)
+        try:
+            return model.encode(
+                texts, 
+                batch_size=encode_batch_size, 
+                show_progress_bar=True, 
+                convert_to_tensor=True, 
+                device=device,
+                normalize_embeddings=True
+            )
+        finally:
+            torch.set_num_threads(torch_threads)
+
+    gewerk_codes, unique_gewerke = pd.factorize(pairs['Gewerk_Name'])
+    handwerker_codes, unique_handwerker = pd.factorize(pairs['Handwerker_Name'])
 
 
     print("Encoding unique values...")
-    emb_gewerke = model.encode(
-        unique_gewerke, 
-        batch_size=encode_batch_size, 
-        show_progress_bar=True, 
-        convert_to_tensor=True, 
-        device=device,
-        normalize_embeddings=True
-    )
-
-    emb_handwerker = model.encode(
-        unique_handwerker, 
-        batch_size=encode_batch_size, 
-        show_progress_bar=True, 
-        convert_to_tensor=True, 
-        device=device,
-        normalize_embeddings=True
-    )
+    if embedding_store is None:
+        emb_gewerke = encode(unique_gewerke)
+        emb_handwerker = encode(unique_handwerker)
+    else:
+        emb_gewerke, emb_handwerker = (
+            torch.from_numpy(embedding_store.embeddings(uniques, model_id, lambda texts: encode(texts).cpu().numpy())).to(device)
+            for uniques in (unique_gewerke, unique_handwerker)
+        )
+        print(f"Embedding store: {embedding_store.hits} terms loaded, {embedding_store.misses} encoded")
 
 
-    print("Calculating similarity scores on GPU...")
+    print(f"Calculating similarity scores of {len(pairs)} pairs on {device}...")
     similarity_scores = []
     
-    total_rows = len(df)
-    
     t_gewerk_codes = torch.tensor(gewerk_codes, device=device, dtype=torch.long)
     t_handwerker_codes = torch.tensor(handwerker_codes, device=device, dtype=torch.long)
 
     with torch.no_grad():
-        for i in range(0, total_rows, process_batch_size):
-            end = min(i + process_batch_size, total_rows)
-            
-            batch_g_codes = t_gewerk_codes[i:end]
-            batch_h_codes = t_handwerker_codes[i:end]
-            
-            batch_emb_g = emb_gewerke[batch_g_codes]
-            batch_emb_h = emb_handwerker[batch_h_codes]
-            
-            sim = torch.nn.functional.cosine_similarity(batch_emb_g, batch_emb_h, dim=1)
-            
+        for i in range(0, len(pairs), process_batch_size):
+            end = min(i + process_batch_size, len(pairs))
+            # normalized embeddings: cosine similarity = dot product
+            sim = (emb_gewerke[t_gewerk_codes[i:end]] * emb_handwerker[t_handwerker_codes[i:end]]).sum(dim=1)
             similarity_scores.append(sim.cpu().numpy())
 
-    full_scores = np.concatenate(similarity_scores)
-    df['Similarity_Score'] = full_scores
-    
-    mismatches = df[df['Similarity_Score'] < threshold].copy()
-    mismatches = mismatches.sort_values(by='Similarity_Score', ascending=True)
+    full_scores = np.concatenate(similarity_scores) if similarity_scores else np.empty(0, dtype=np.float32)
 
     # Cleanup GPU memory
     del emb_gewerke
@@ -606,15 +665,116 @@ def mismatched_entries(df, threshold=0.2, process_batch_size=16384, encode_batch
     del t_handwerker_codes
     torch.cuda.empty_cache()
 
+    return full_scores
+
+def semantic_pair_scores(df, process_batch_size=16384, encode_batch_size=128, embedding_store=None, backend='torch', num_threads=None):
+    """
+    Calculates the semantic similarity (see semantic_similarity) once for every distinct combination of
+    'Gewerk_Name' and 'Handwerker_Name'.
+
+    Parameters:
+    ----------
+        df: pandas.DataFrame
+            DataFrame (Auftragsdaten) that contains the columns 'Gewerk_Name' and 'Handwerker_Name'.
+        process_batch_size, encode_batch_size, embedding_store, backend, num_threads: optional
+            see semantic_similarity.
+
+    Returns:
+    -------
+        pairs: pandas.DataFrame
+            One row per pair: 'Gewerk_Name', 'Handwerker_Name', 'count' (number of orders) and 'Similarity_Score',
+            sorted ascending by similarity.
+    """
+    _, pairs = _distinct_pairs(df.dropna(subset=['Gewerk_Name', 'Handwerker_Name']))
+    pairs['Similarity_Score'] = _pair_similarity(pairs, process_batch_size, encode_batch_size, embedding_store, backend, num_threads)
+    return pairs.sort_values(by='Similarity_Score', ascending=True, kind='stable', ignore_index=True)
+
+def semantic_similarity(df, process_batch_size=16384, encode_batch_size=128, embedding_store=None, backend='torch', num_threads=None, pair_scores=None):
+    """
+    Calculates the semantic similarity between 'Gewerk_Name' and 'Handwerker_Name' using a 
+    Sentence Transformer model (on the GPU if available and backend='torch').
+    The score only depends on the two names, so every distinct pair is scored once and the scores are mapped back to the rows.
+    
+    Parameters:
+    ----------
+        df: pandas.DataFrame
+            DataFrame (Auftragsdaten) that contains the columns 'Gewerk_Name' and 'Handwerker_Name'.
+        process_batch_size: int, optional
+            Number of pairs to be compared simultaneously (high value possible, e.g. 16384).
+        encode_batch_size: int, optional
+            Number of unique terms to be vectorized simultaneously by the model (low value recommended, e.g. 128).
+        embedding_store: embedding_store.EmbeddingStore, optional
+            Persistent store of the embeddings (default: None, all terms are encoded). Only terms that are not in the store
+            are encoded, the model is not even loaded if all of them are known.
+        backend: str, optional
+            Inference backend, one of SEMANTIC_BACKENDS (default: 'torch'). The quantized/ONNX backends run on the CPU.
+        num_threads: int, optional
+            Number of intra-op threads used for encoding (default: None, the default of PyTorch/onnxruntime).
+        pair_scores: pandas.DataFrame, optional
+            Scores computed before by semantic_pair_scores (e.g. on the full data when df is a subset of it). The rows of df
+            are looked up in it instead of scoring their pairs, pairs missing in it get the score NaN.
+
+    Returns:
+    -------
+        df: pandas.DataFrame
+            Rows with both names, with the new column 'Similarity_Score'.
+    """
+    df = df.dropna(subset=['Gewerk_Name', 'Handwerker_Name']).copy()
+    pair_codes, pairs = _distinct_pairs(df)
+    if pair_scores is None:
+        pairs['Similarity_Score'] = _pair_similarity(pairs, process_batch_size, encode_batch_size, embedding_store, backend, num_threads)
+    else:
+        # left merge keeps the order of pairs
+        pairs = pairs.merge(pair_scores[['Gewerk_Name', 'Handwerker_Name', 'Similarity_Score']], how='left', on=['Gewerk_Name', 'Handwerker_Name'])
+    df['Similarity_Score'] = pairs['Similarity_Score'].to_numpy()[pair_codes]
+
+    return df
+
+def mismatched_entries(df, threshold=0.2, process_batch_size=16384, encode_batch_size=128, embedding_store=None, backend='torch', num_threads=None,
+                       pair_scores=None):
+    """
+    Identifies entries where the semantic similarity between 'Gewerk_Name' and 'Handwerker_Name' (see semantic_similarity)
+    falls below the threshold.(< 0.2).
+    
+    Parameters:
+    ----------
+        df: pandas.DataFrame
+            DataFrame (Auftragsdaten) that contains the columns 'Gewerk_Name' and 'Handwerker_Name'.
+        threshold: float, optional
+            Similarity threshold (default: 0.2). Values below this limit are considered mismatches.
+            The optimal threshold in a production system would need to be evaluated further. 
+        process_batch_size, encode_batch_size, embedding_store, backend, num_threads, pair_scores: optional
+            see semantic_similarity. backend='int8' or 'onnx'/'onnx-int8' speed up the encoding on CPU-only machines,
+            semantic_parity.py compares their scores and decisions with the full precision model.
+
+    Returns:
+    -------
+        mismatches: pandas.DataFrame
+            DataFrame containing rows where 'Similarity_Score' < threshold.
+            The results are sorted ascending by similarity and include the new column 'Similarity_Score'.
+    """
+    df = semantic_similarity(df, process_batch_size, encode_batch_size, embedding_store, backend, num_threads, pair_scores)
+    
+    mismatches = df[df['Similarity_Score'] < threshold].copy()
+    mismatches = mismatches.sort_values(by='Similarity_Score', ascending=True)
+
     return mismatches
 
-def handwerker_gewerke_outlier(df):
+def _category_codes(series):
+    """Helper function. Integer codes and labels of a column without missing values (the category codes for categorical columns)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories
+    return pd.factorize(series, sort=True)
+
+def handwerker_gewerke_outlier(df, return_matrix=False):
     """Determines which companies are on record with an unusual trade entry.
 
     Parameters
     ----------
     df : pandas.DataFrame
         'Auftragsdaten'-DataFrame
+    return_matrix : bool, optional
+        additionally return the full count matrix (default: False)
 
     Returns
     -------
@@ -627,21 +787,80 @@ def handwerker_gewerke_outlier(df):
         - 'ratio': float, count/total_count (per company)
         - 'anzahl_gewerke': int, absolute amount of trades (per company)  
         - 'is_outlier': bool, True for more than 1 trade, ratio < 0.2
+    counts: pandas.DataFrame
+        only if return_matrix=True: number of orders per company (index 'Handwerker_Name') and trade (columns 'Gewerk_Name'),
+        for all observed companies and trades. Input of outlier_hotspots.
     """
     df = df[["Handwerker_Name", "Gewerk_Name"]]
     df = df.dropna()
-    stats = df.groupby(['Handwerker_Name', 'Gewerk_Name'], observed=True).size().reset_index(name='count')
-    total_counts = df.groupby('Handwerker_Name', observed=True).size().reset_index(name='total_count')
-
-    stats = stats.merge(total_counts, on='Handwerker_Name')
+    handwerker_codes, handwerker = _category_codes(df["Handwerker_Name"])
+    gewerk_codes, gewerke = _category_codes(df["Gewerk_Name"])
+
+    # only observed companies/trades get a row/column of the matrix (order of the codes is kept)
+    observed_h = np.flatnonzero(np.bincount(handwerker_codes, minlength=len(handwerker)))
+    observed_g = np.flatnonzero(np.bincount(gewerk_codes, minlength=len(gewerke)))
+    row = np.zeros(len(handwerker), dtype=np.int64)
+    row[observed_h] = np.arange(len(observed_h))
+    col = np.zeros(len(gewerke), dtype=np.int64)
+    col[observed_g] = np.arange(len(observed_g))
+    row, col = row[handwerker_codes], col[gewerk_codes]
+    counts = np.bincount(row * len(observed_g) + col, minlength=len(observed_h) * len(observed_g)).reshape(len(observed_h), len(observed_g))
+
+    total_counts = counts.sum(axis=1)
+    anzahl_gewerke = np.count_nonzero(counts, axis=1)
+    # one row per observed combination, sorted by company and trade (like groupby)
+    h_idx, g_idx = np.nonzero(counts)
+    if isinstance(df["Handwerker_Name"].dtype, pd.CategoricalDtype):
+        handwerker_col = pd.Categorical.from_codes(observed_h[h_idx], dtype=df["Handwerker_Name"].dtype)
+    else:
+        handwerker_col = handwerker.take(observed_h[h_idx])
+    if isinstance(df["Gewerk_Name"].dtype, pd.CategoricalDtype):
+        gewerk_col = pd.Categorical.from_codes(observed_g[g_idx], dtype=df["Gewerk_Name"].dtype)
+    else:
+        gewerk_col = gewerke.take(observed_g[g_idx])
+    stats = pd.DataFrame({
+        'Handwerker_Name': handwerker_col,
+        'Gewerk_Name': gewerk_col,
+        'count': counts[h_idx, g_idx],
+        'total_count': total_counts[h_idx],
+    })
     stats['ratio'] = stats['count'] / stats['total_count']
 
-    stats['anzahl_gewerke'] = stats.groupby('Handwerker_Name', observed=True)['Gewerk_Name'].transform('count')
+    stats['anzahl_gewerke'] = anzahl_gewerke[h_idx]
     stats['is_outlier'] = (stats['anzahl_gewerke'] > 1) & (stats['ratio'] < 0.2)
-    stats = stats.dropna()
 
+    if return_matrix:
+        matrix = pd.DataFrame(counts, index=pd.Index(handwerker.take(observed_h), name='Handwerker_Name'),
+                              columns=pd.Index(gewerke.take(observed_g), name='Gewerk_Name'))
+        return stats, matrix
     return stats
 
+def outlier_hotspots(counts):
+    """Aggregates the outliers of handwerker_gewerke_outlier per trade and per company (top charts on page3).
+
+    Parameters
+    ----------
+    counts : pandas.DataFrame
+        count matrix, second result of handwerker_gewerke_outlier(df, return_matrix=True)
+
+    Returns
+    -------
+    per_gewerk: pandas.DataFrame
+        'Gewerk', 'Anzahl': number of outlier companies per trade, descending
+    per_handwerker: pandas.DataFrame
+        'Handwerker', 'Summe_Fehler': number of orders of a company in its outlier trades, descending
+    """
+    values = counts.to_numpy()
+    # same rule as handwerker_gewerke_outlier: more than 1 trade and ratio < 0.2
+    ratio = values / values.sum(axis=1, keepdims=True)
+    is_outlier = (values > 0) & (np.count_nonzero(values, axis=1) > 1)[:, None] & (ratio < 0.2)
+
+    per_gewerk = pd.DataFrame({'Gewerk': counts.columns.astype(object), 'Anzahl': is_outlier.sum(axis=0)})
+    per_handwerker = pd.DataFrame({'Handwerker': counts.index.astype(object), 'Summe_Fehler': np.where(is_outlier, values, 0).sum(axis=1)})
+    per_gewerk = per_gewerk[per_gewerk['Anzahl'] > 0].sort_values('Anzahl', ascending=False, kind='stable', ignore_index=True)
+    per_handwerker = per_handwerker[per_handwerker['Summe_Fehler'] > 0].sort_values('Summe_Fehler', ascending=False, kind='stable', ignore_index=True)
+    return per_gewerk, per_handwerker
+
 def check_keywords(df):
     """This metrics tries to check if an observed company-trade combination is valid by checking the company name for relation to a given trade.
 
@@ -725,37 +944,30 @@ def check_keywords(df):
 
 
 
-    names = df['Handwerker_Name'].astype(str).str.lower()
-
-    confirmed_mask = np.zeros(len(df), dtype=bool)
-
-    conflict_series = pd.Series([None] * len(df), index=df.index)
-
-    for trade, keywords in keywords_mapping.items():
-        if not keywords:
-            continue
+    trades = [trade for trade, keywords in keywords_mapping.items() if keywords]
+    # one automaton for all keywords, labeled with the position of their trade (= priority of the conflicts)
+    automaton = KeywordAutomaton((keyword, i) for i, trade in enumerate(trades) for keyword in keywords_mapping[trade])
 
-        pattern = '|'.join(map(re.escape, keywords))
-
-        has_keyword = names.str.contains(pattern, regex=True, na=False)
-
-        is_current_trade = (df['Gewerk_Name'] == trade)
-        confirmed_mask = confirmed_mask | (has_keyword & is_current_trade)
-
-        is_conflict = (has_keyword & ~is_current_trade)
-
-        mask_to_update = is_conflict & conflict_series.isna()
-        conflict_series.loc[mask_to_update] = f"CONFLICT_WITH_{trade.upper()}"
-
-    final_result = np.where(
-        confirmed_mask,
-        "CONFIRMED_BY_NAME",
-        np.where(
-            conflict_series.notna(),
-            conflict_series,
-            "NO_KEYWORD_INFO"
-        )
-    )
+    names = df['Handwerker_Name'].astype(str).str.lower()
+    name_codes, unique_names = pd.factorize(names)
+    # trades whose keywords occur in the name, in the order of keywords_mapping; every name is searched once
+    name_trades = [sorted(automaton.find(name)) for name in unique_names]
+    # position of the trade of the order in trades, -1 for other trades or missing values
+    trade_codes = pd.Index(trades).get_indexer(df['Gewerk_Name'].astype(object))
+
+    def check(name_code, trade_code):
+        matches = name_trades[name_code]
+        if trade_code in matches:
+            return "CONFIRMED_BY_NAME"
+        if matches: # first trade of the name (the one of the order is not among them)
+            return f"CONFLICT_WITH_{trades[matches[0]].upper()}"
+        return "NO_KEYWORD_INFO"
+
+    # the result only depends on the name and the trade: evaluated once per combination
+    n_trades = len(trades) + 1
+    pair_codes, pair_keys = pd.factorize(name_codes.astype(np.int64) * n_trades + (trade_codes + 1))
+    pair_results = np.array([check(key // n_trades, key % n_trades - 1) for key in pair_keys], dtype=object)
+    final_result = pair_results[pair_codes]
 
     return final_result
 
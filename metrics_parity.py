@@ -0,0 +1,83 @@
+import argparse
+import sys
+import duckdb
+import pandas as pd
+import db_io
+import build_db
+from db_io import fetch_df
+
+"""
+Parity check of the SQL metric engine (build_db.py --engine sql, metrics_sql.py) with the pandas metrics (metrics.py).
+
+Runs every task of build_db.SQL_METRIC_TASKS and its pandas counterpart in build_db.METRIC_TASKS on the tables of the current
+database and compares the results as they are stored by build_db.py: DataFrames are written to DuckDB and read back, then
+compared exactly with pandas.testing.assert_frame_equal (same columns, types, row order and values), scalars must be equal.
+
+Usage:
+    python metrics_parity.py
+    python metrics_parity.py --metric metric_zeitwert_errors
+
+The check fails (exit code 1) if any output differs.
+"""
+
+
+def stored(con, value):
+    """Helper function. Returns a DataFrame as build_db.py stores it (written to DuckDB and read back), other values unchanged."""
+    if not isinstance(value, pd.DataFrame):
+        return value
+    con.register("parity_df", value)
+    try:
+        return fetch_df(con, "SELECT * FROM parity_df")
+    finally:
+        con.unregister("parity_df")
+
+
+def compare(name, pandas_value, sql_value):
+    """Helper function. Compares one output of both engines, returns a description of the difference or None."""
+    if isinstance(pandas_value, pd.DataFrame):
+        try:
+            pd.testing.assert_frame_equal(pandas_value, sql_value, check_exact=True)
+        except AssertionError as e:
+            return str(e)
+        return None
+    if pd.isna(pandas_value) and pd.isna(sql_value):
+        return None
+    return None if pandas_value == sql_value else f"{pandas_value!r} != {sql_value!r}"
+
+
+def main(metrics=None):
+    db_path = db_io.current_db_path()
+    if db_path is None:
+        sys.exit("No database found, run build_db.py first.")
+    with duckdb.connect(db_path, read_only=True) as con:
+        # the cleaned data as build_db.py loads it for the pandas engine
+        inputs = {"df": fetch_df(con, "SELECT * FROM auftragsdaten", nullable_int=True),
+                  "df2": fetch_df(con, "SELECT * FROM positionsdaten", nullable_int=True),
+                  "con": con, "auftragsdaten": "auftragsdaten", "positionsdaten": "positionsdaten"}
+        pandas_tasks = {t.name: t for t in build_db.METRIC_TASKS}
+
+        failed = []
+        for sql_task in build_db.SQL_METRIC_TASKS:
+            if metrics and not set(sql_task.outputs) & set(metrics):
+                continue
+            pandas_task = pandas_tasks[sql_task.name]
+            results = []
+            for task in (pandas_task, sql_task):
+                value = task.func(*(inputs[i] for i in task.inputs))
+                results.append(value if len(task.outputs) > 1 else (value,))
+            for name, pandas_value, sql_value in zip(sql_task.outputs, *results):
+                difference = compare(name, stored(con, pandas_value), stored(con, sql_value))
+                print(f"{name}: {'identical' if difference is None else 'DIFFERENT'}")
+                if difference is not None:
+                    print("    " + difference.replace("\n", "\n    "))
+                    failed.append(name)
+
+    print("PASSED" if not failed else f"FAILED: {', '.join(failed)}")
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the outputs of the SQL metric engine with the pandas metrics on the current database.")
+    parser.add_argument("--metric", action="append", default=None, help="only compare this output (can be given several times)")
+    args = parser.parse_args()
+    sys.exit(0 if main(args.metric) else 1)
@@ -0,0 +1,349 @@
+import pandas as pd
+
+"""
+DuckDB-SQL implementation of the metrics in metrics.py that filter or aggregate the cleaned data row by row.
+
+The functions run directly against the tables 'auftragsdaten'/'positionsdaten' of the dashboard database (or any table with the same
+columns) and return the same DataFrames as their counterparts in metrics.py, so DuckDB's multithreaded engine does the work instead of pandas.
+Every call uses its own cursor, the functions can therefore be run in parallel threads with a shared connection (see build_db.py --engine sql).
+"""
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def _query(con, sql, params=None):
+    """Helper function. Runs a query on a new cursor of con and returns the result as pandas.DataFrame."""
+    with con.cursor() as cur:
+        return cur.execute(sql, params).df()
+
+
+def _columns(con, table):
+    """Helper function. Returns the column names of a table."""
+    with con.cursor() as cur:
+        return [col[0] for col in cur.execute(f"SELECT * FROM {table} LIMIT 0").description]
+
+
+def _round(expr, decimals=2):
+    """Helper function. SQL of expr rounded like pandas/numpy round: scaled, rounded half to even and scaled back in the type of expr.
+    DuckDB's round() computes FLOAT values in double precision, which differs from pandas in the last decimal for about 10 % of the values."""
+    scale = f"{10 ** decimals}::FLOAT"
+    return f"(round_even(({expr}) * {scale}, 0) / {scale})"
+
+
+def plausibilitaetscheck_forderung_einigung(con, table="auftragsdaten"):
+    """SQL version of metrics.plausibilitaetscheck_forderung_einigung().
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        connection to the database
+    table : str, optional
+        table with 'Auftragsdaten' or 'Positionsdaten', by default 'auftragsdaten'
+
+    Returns
+    -------
+    results: pandas.DataFrame
+        a DataFrame of all differences > 0 as float values alongside their ID, Forderung_Netto and Einigung_Netto
+    count: int
+        total number of rows with difference >0
+    avg: float
+        average difference over all found instances
+    """
+    id_col = "KvaRechnung_ID" if "AuftragID" in _columns(con, table) else "Position_ID"
+
+    results = _query(con, f"""
+        SELECT {id_col}, Forderung_Netto, Einigung_Netto, {_round("Einigung_Netto - Forderung_Netto")} AS Diff
+        FROM {table}
+        WHERE {_round("Einigung_Netto")} > {_round("Forderung_Netto")}
+        ORDER BY rowid
+    """)
+    return results, len(results), results['Diff'].mean()
+
+
+def proformabelege(con, table="auftragsdaten"):
+    """SQL version of metrics.proformabelege().
+
+    Returns
+    -------
+    proforma: pandas.DataFrame
+        DataFrame containing all found pro-forma receipt rows
+    proforma_count: int
+        Amount of found receipts
+    """
+    proforma = _query(con, f"SELECT * FROM {table} WHERE Einigung_Netto BETWEEN 0.01::FLOAT AND 1 ORDER BY rowid")
+    return proforma, len(proforma)
+
+
+def above_50k(con, table="auftragsdaten"):
+    """SQL version of metrics.above_50k().
+
+    Returns
+    -------
+    suspicious_data: pandas.DataFrame
+        Data frame containing suspiciously high positions
+    """
+    return _query(con, f"""
+        SELECT KvaRechnung_ID, Forderung_Netto, Empfehlung_Netto, Einigung_Netto, Kundengruppe, Handwerker_Name, CRMEingangszeit
+        FROM {table}
+        WHERE Einigung_Netto >= 50000
+        ORDER BY rowid
+    """)
+
+
+def check_zeitwert(con, table="auftragsdaten"):
+    """SQL version of metrics.check_zeitwert(). Rows with missing values can not be checked and are returned as errors (as in pandas).
+
+    Returns
+    -------
+    result_df: pandas.DataFrame
+        DataFrame of all error values (float) alongside the ID found in the original data frame
+    """
+    return _query(con, f"""
+        SELECT KvaRechnung_ID, CRMEingangszeit, "Differenz Zeitwert"
+        FROM (
+            SELECT *, {_round("Forderung_Netto - Einigung_Netto")} - {_round("Differenz_vor_Zeitwert_Netto")} AS "Differenz Zeitwert", rowid AS row_nr
+            FROM {table}
+        )
+        WHERE NOT coalesce(abs("Differenz Zeitwert"::DOUBLE) <= 0.01, false)
+        ORDER BY row_nr
+    """)
+
+
+def position_count(con, table="positionsdaten"):
+    """SQL version of metrics.position_count(). As in pandas (observed=False) all values of the categorical (ENUM) KvaRechnung_ID are listed.
+
+    Returns
+    -------
+    position_count: pandas.DataFrame
+        DataFrame with the columns 'KvaRechnung_ID' and the amount of associated positions.
+    """
+    position_count = _query(con, f"""
+        SELECT KvaRechnung_ID, count(Position_ID) AS PositionsAnzahl
+        FROM {table}
+        WHERE KvaRechnung_ID IS NOT NULL
+        GROUP BY KvaRechnung_ID
+        ORDER BY KvaRechnung_ID
+    """)
+
+    ids = position_count['KvaRechnung_ID']
+    if isinstance(ids.dtype, pd.CategoricalDtype) and len(ids) < len(ids.cat.categories):
+        # orders without positions (unobserved categories) are listed with 0
+        all_ids = pd.Series(ids.cat.categories, dtype=ids.dtype, name='KvaRechnung_ID').to_frame()
+        position_count = all_ids.merge(position_count, on='KvaRechnung_ID', how='left')
+        position_count['PositionsAnzahl'] = position_count['PositionsAnzahl'].fillna(0).astype('int64')
+    return position_count
+
+
+def data_cleanliness(con, table="auftragsdaten", group_by_col="Kundengruppe"):
+    """SQL version of metrics.data_cleanliness() with grouping: null counts of all columns and rows in one GROUP BY.
+
+    Parameters
+    ----------
+    group_by_col : str, optional
+        any column of the table, e.g. 'Kundengruppe', 'Land', 'Schadenart_Name' or 'Gewerk_Name', by default 'Kundengruppe'
+
+    Returns
+    -------
+    grouped_row_ratios: pandas.Series
+        share of rows with at least one null value per group
+    grouped_col_ratios: pandas.DataFrame
+        share of null values per column (columns) and group (index)
+    """
+    columns = [c for c in _columns(con, table) if c != group_by_col]
+    null_counts = ",\n            ".join(f'count(*) - count("{c}") AS "{c}"' for c in columns)
+    has_null = " OR ".join(f'"{c}" IS NULL' for c in columns)
+    result = _query(con, f"""
+        SELECT
+            "{group_by_col}",
+            count(*) AS __group_size,
+            count_if({has_null}) AS __null_rows,
+            {null_counts}
+        FROM {table}
+        WHERE "{group_by_col}" IS NOT NULL
+        GROUP BY ALL
+        ORDER BY 1
+    """).set_index(group_by_col)
+
+    group_sizes = result.pop("__group_size")
+    grouped_row_ratios = result.pop("__null_rows") / group_sizes
+    grouped_row_ratios.name = None
+    grouped_col_ratios = result.div(group_sizes, axis=0)
+    return grouped_row_ratios, grouped_col_ratios
+
+
+def error_frequency_by_weekday_hour(con, table="auftragsdaten", time_col="CRMEingangszeit", relevant_columns=None, issue_table=None):
+    """SQL version of metrics.error_frequency_by_weekday_hour().
+
+    Parameters
+    ----------
+    issue_table : str, optional
+        detail table of a check with the column 'KvaRechnung_ID' (e.g. 'metric_zeitwert_errors'). If given, an order counts as an
+        error if it is contained in that table (instead of the NULL check), so the heatmap of any check is one aggregation.
+
+    Returns
+    -------
+    result: pandas.DataFrame
+        DataFrame mit Spalten 'weekday', 'hour', 'total_rows', 'error_rows' und 'error_rate'
+    """
+    if issue_table is not None:
+        has_error = f"KvaRechnung_ID IN (SELECT KvaRechnung_ID FROM {issue_table})"
+    else:
+        if relevant_columns is None:
+            relevant_columns = [c for c in _columns(con, table) if c not in {time_col, "KvaRechnung_ID"}]
+
+        if not relevant_columns:
+            raise ValueError("Keine relevanten Spalten für die Fehlerprüfung gefunden.")
+
+        has_error = " OR ".join(f'"{c}" IS NULL' for c in relevant_columns)
+    result = _query(con, f"""
+        SELECT
+            dayname("{time_col}") AS weekday,
+            hour("{time_col}")::INTEGER AS hour,
+            count(KvaRechnung_ID) AS total_rows,
+            count_if({has_error})::BIGINT AS error_rows
+        FROM {table}
+        WHERE "{time_col}" IS NOT NULL
+        GROUP BY ALL
+    """)
+
+    result["error_rate"] = result["error_rows"] / result["total_rows"] * 100
+    result["weekday"] = pd.Categorical(result["weekday"], categories=WEEKDAYS, ordered=True)
+    result = result.sort_values(["weekday", "hour"]).reset_index(drop=True)
+    return result
+
+
+def abgleich_auftraege(con, table="auftragsdaten", positions_table="positionsdaten"):
+    """SQL version of metrics.abgleich_auftraege(). Positionssummen werden (wie in pandas) im Datentyp der Spalten gebildet.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Abweichungen mit den Spalten 'KvaRechnung_ID', 'Diff_Forderung', 'Diff_Einigung' und 'CRMEingangszeit'
+    """
+    return _query(con, f"""
+        WITH pos AS (
+            SELECT
+                KvaRechnung_ID::VARCHAR AS KvaRechnung_ID,
+                coalesce(sum(Forderung_Netto), 0)::FLOAT AS Forderung_Netto,
+                coalesce(sum(Einigung_Netto), 0)::FLOAT AS Einigung_Netto
+            FROM {positions_table}
+            GROUP BY ALL
+        ),
+        merged AS (
+            SELECT
+                a.KvaRechnung_ID,
+                {_round("a.Forderung_Netto - coalesce(pos.Forderung_Netto, 0)")} AS Diff_Forderung,
+                {_round("a.Einigung_Netto - coalesce(pos.Einigung_Netto, 0)")} AS Diff_Einigung,
+                a.CRMEingangszeit,
+                a.rowid AS row_nr
+            FROM {table} a
+            LEFT JOIN pos ON a.KvaRechnung_ID::VARCHAR = pos.KvaRechnung_ID
+        )
+        SELECT KvaRechnung_ID, Diff_Forderung, Diff_Einigung, CRMEingangszeit
+        FROM merged
+        WHERE Diff_Forderung IS DISTINCT FROM 0 OR Diff_Einigung IS DISTINCT FROM 0
+        ORDER BY row_nr
+    """)
+
+
+def false_negative_df1(con, table="auftragsdaten"):
+    """SQL version of metrics.false_negative_df1().
+
+    Returns
+    -------
+    stats_df: pandas.DataFrame
+        Small DataFrame containing error counts per column (Einigung, Empfehlung, Forderung) for visualization.
+    details_df: pandas.DataFrame
+        DataFrame containing the error instances.
+    """
+    flags = f"""
+        SELECT *,
+            (m_ein <> m_emp AND m_ein <> m_for) AS e_ein,
+            (m_emp <> m_ein AND m_emp <> m_for) AS e_emp,
+            (m_for <> m_ein AND m_for <> m_emp) AS e_for
+        FROM (
+            SELECT KvaRechnung_ID, Forderung_Netto, Empfehlung_Netto, Einigung_Netto, rowid AS row_nr,
+                coalesce(Einigung_Netto < 0, false) AS m_ein,
+                coalesce(Empfehlung_Netto < 0, false) AS m_emp,
+                coalesce(Forderung_Netto < 0, false) AS m_for
+            FROM {table}
+        )
+    """
+    counts = _query(con, f"SELECT count_if(e_ein) AS e_ein, count_if(e_emp) AS e_emp, count_if(e_for) AS e_for FROM ({flags})").iloc[0]
+    stats_df = pd.DataFrame({
+        "Spalte": ["Einigung_Netto", "Empfehlung_Netto", "Forderung_Netto"],
+        "Fehler": [int(counts["e_ein"]), int(counts["e_emp"]), int(counts["e_for"])]
+    })
+    details_df = _query(con, f"""
+        SELECT KvaRechnung_ID, Forderung_Netto, Empfehlung_Netto, Einigung_Netto
+        FROM ({flags})
+        WHERE e_ein OR e_emp OR e_for
+        ORDER BY row_nr
+    """)
+    return stats_df, details_df
+
+
+def false_negative_df2(con, table="positionsdaten"):
+    """SQL version of metrics.false_negative_df2(), expects all columns of 'Positionsdaten'.
+
+    Returns
+    -------
+    stats_df : pandas.DataFrame
+        Eine Tabelle mit zwei Spalten: 'Kategorie' (Art des Fehlers) und 'Anzahl' (Häufigkeit). Bleibt leer, wenn keine Fehler gefunden wurden.
+    details_df : pandas.DataFrame
+        Ein Auszug aus den Positionsdaten, der nur die Zeilen enthält, in denen mindestens ein Fehler gefunden wurde.
+    """
+    flags = f"""
+        SELECT *, rowid AS row_nr,
+            coalesce(Menge < 0, false) AS mask_menge,
+            coalesce(Menge_Einigung < 0, false) AS mask_menge_ein,
+            coalesce(EP < 0, false) <> coalesce(EP_Einigung < 0, false) AS mask_ep,
+            coalesce(Forderung_Netto < 0, false) <> coalesce(Einigung_Netto < 0, false) AS mask_betrag
+        FROM {table}
+    """
+    counts = _query(con, f"""
+        SELECT count_if(mask_menge) AS "Menge < 0", count_if(mask_menge_ein) AS "Menge_Einigung < 0",
+               count_if(mask_ep) AS "Vorzeichen EP ungleich", count_if(mask_betrag) AS "Vorzeichen Betrag ungleich"
+        FROM ({flags})
+    """).iloc[0]
+    stats_df = pd.DataFrame([{"Kategorie": category, "Anzahl": int(count)} for category, count in counts.items() if count > 0])
+
+    details_df = pd.DataFrame()
+    if not stats_df.empty:
+        details_df = _query(con, f"""
+            SELECT Position_ID, Bezeichnung, Menge, Menge_Einigung, EP, EP_Einigung, Forderung_Netto, Einigung_Netto
+            FROM ({flags})
+            WHERE mask_menge OR mask_menge_ein OR mask_ep OR mask_betrag
+            ORDER BY row_nr
+        """)
+    return stats_df, details_df
+
+
+def discount_details(con, table="positionsdaten"):
+    """SQL version of metrics.discount_details(). Descriptions with the same count are ordered by their first occurrence.
+
+    Returns
+    -------
+    stats_df: pandas.DataFrame
+        DataFrame with counts of the most frequent descriptions (Bezeichnung) among invalid entries.
+    details_df: pandas.DataFrame
+        DataFrame containing specific invalid rows.
+    """
+    details_df = _query(con, f"""
+        SELECT Position_ID, Bezeichnung, Forderung_Netto, Einigung_Netto, ist_Abzug
+        FROM {table}
+        WHERE NOT Plausibel
+        ORDER BY rowid
+    """)
+
+    stats_df = pd.DataFrame()
+    if not details_df.empty:
+        stats_df = _query(con, f"""
+            SELECT Bezeichnung, count(*) AS Anzahl
+            FROM {table}
+            WHERE NOT Plausibel AND Bezeichnung IS NOT NULL
+            GROUP BY Bezeichnung
+            ORDER BY Anzahl DESC, min(rowid)
+            LIMIT 15
+        """)
+    return stats_df, details_df
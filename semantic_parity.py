@@ -0,0 +1,85 @@
+import argparse
+import sys
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+import torch
+import metrics as mt
+import db_io
+from db_io import fetch_df
+
+"""
+Parity check and CPU throughput of the inference backends of the semantic check (metrics.mismatched_entries).
+
+Encodes the unique Gewerk_Name/Handwerker_Name values of the current database with the full precision model ('torch' on CPU)
+and with the chosen backend, and compares the similarity scores and threshold decisions of all orders.
+
+Usage:
+    python semantic_parity.py --backend int8
+    python semantic_parity.py --backend onnx-int8 --threads 4 --tolerance 0.03
+
+The check fails (exit code 1) if a score differs by more than the tolerance, or if a threshold decision changes for an order
+whose reference score is not within the tolerance of the threshold.
+"""
+
+
+def encode(backend, texts, num_threads, batch_size):
+    """Helper function. Loads the model with the given backend and encodes texts, returns the embeddings and the timings."""
+    start = time.perf_counter()
+    model = mt.load_semantic_model(backend, "cpu", num_threads)
+    load_s = time.perf_counter() - start
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True)
+    return embeddings, load_s, time.perf_counter() - start
+
+
+def main(backend="int8", num_threads=None, threshold=0.2, tolerance=0.05, batch_size=128):
+    db_path = db_io.current_db_path()
+    if db_path is None:
+        sys.exit("No database found, run build_db.py first.")
+    if num_threads:
+        # PyTorch backends, onnxruntime gets the threads via its session options
+        torch.set_num_threads(num_threads)
+    with duckdb.connect(db_path, read_only=True) as con:
+        df = fetch_df(con, "SELECT Gewerk_Name, Handwerker_Name FROM auftragsdaten WHERE Gewerk_Name IS NOT NULL AND Handwerker_Name IS NOT NULL")
+
+    texts = pd.unique(pd.concat([df["Gewerk_Name"].astype(object), df["Handwerker_Name"].astype(object)]))
+    codes = pd.Index(texts)
+    gewerk_codes, handwerker_codes = codes.get_indexer(df["Gewerk_Name"].astype(object)), codes.get_indexer(df["Handwerker_Name"].astype(object))
+    print(f"{len(df)} orders, {len(texts)} unique names, {torch.get_num_threads() if not num_threads else num_threads} thread(s)")
+
+    timings, scores = [], {}
+    for name in ("torch", backend):
+        embeddings, load_s, encode_s = encode(name, texts.tolist(), num_threads, batch_size)
+        # normalized embeddings: cosine similarity = dot product
+        scores[name] = np.einsum("ij,ij->i", embeddings[gewerk_codes], embeddings[handwerker_codes])
+        timings.append({"backend": name, "load_s": load_s, "encode_s": encode_s, "texts_per_s": len(texts) / encode_s})
+    df_timings = pd.DataFrame(timings)
+    print(df_timings.to_string(index=False, float_format="{:.3f}".format))
+    print(f"Speedup of '{backend}': {df_timings['encode_s'].iloc[0] / df_timings['encode_s'].iloc[1]:.2f}x")
+
+    reference, candidate = scores["torch"], scores[backend]
+    diff = np.abs(candidate - reference)
+    flips = (reference < threshold) != (candidate < threshold)
+    # decisions may only change for orders whose score is within the tolerance of the threshold
+    unexpected_flips = flips & (np.abs(reference - threshold) > tolerance)
+    print(f"Score difference: max {diff.max():.5f}, mean {diff.mean():.5f}, p99 {np.quantile(diff, 0.99):.5f} (tolerance {tolerance})")
+    print(f"Mismatches (< {threshold}): torch {int((reference < threshold).sum())}, {backend} {int((candidate < threshold).sum())}, "
+          f"changed decisions {int(flips.sum())} ({flips.mean():.3%}), outside the tolerance band {int(unexpected_flips.sum())}")
+
+    passed = diff.max() <= tolerance and not unexpected_flips.any()
+    print("PASSED" if passed else "FAILED")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the similarity scores of an inference backend of the semantic check with the full precision model.")
+    parser.add_argument("--backend", choices=[b for b in mt.SEMANTIC_BACKENDS if b != "torch"], default="int8",
+                        help="backend to compare with the full precision PyTorch model (default: int8)")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads (default: all cores)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="similarity threshold of mismatched_entries (default: 0.2)")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="allowed absolute difference of the scores (default: 0.05)")
+    parser.add_argument("--batch-size", type=int, default=128, help="encode batch size (default: 128)")
+    args = parser.parse_args()
+    sys.exit(0 if main(args.backend, args.threads, args.threshold, args.tolerance, args.batch_size) else 1)